@@ -0,0 +1,129 @@
+import boto3
+import json
+import os
+import sys
+import argparse
+from datetime import timezone
+
+# Share the meal store with the Lambda functions
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lambda_functions'))
+import feedback_segments
+import history_index
+import meal_stats
+import meal_store
+
+# Initialize clients
+s3 = boto3.client('s3')
+
+# Copies existing meal records from the feedback bucket into the DynamoDB
+# meal history table. Run it while the Lambdas dual-write
+# (MEAL_STORE_DUAL_WRITE=true), so meals saved during the backfill land in
+# both stores, then switch reads over with MEAL_STORE=dynamodb. Writes are
+# idempotent puts keyed by (userId, timestamp), so it can be re-run.
+#
+# --target stats (or both) also seeds the nutrition rollups
+# ({user_id}/_stats.json, see meal_stats.py) of users who have none yet,
+# from the records read here. Saving a meal only creates rollups for new
+# users, so long-standing users otherwise get theirs on their first
+# GET /meal-stats. Existing rollups are left alone.
+def load_record(feedback_bucket, item):
+    obj = s3.get_object(Bucket=feedback_bucket, Key=item['Key'])
+    record = json.loads(obj['Body'].read().decode('utf-8'))
+
+    key = item['Key']
+    record.setdefault('userId', key.split('/')[0])
+    record.setdefault('imageId', key.split('/')[-1][:-len(history_index.FEEDBACK_SUFFIX)])
+    if not record.get('timestamp'):
+        modified = item['LastModified'].astimezone(timezone.utc).replace(tzinfo=None)
+        record['timestamp'] = modified.isoformat()
+    if record.pop('imageBase64', None):
+        # Items are capped at 400 KB; inline images belong in the images
+        # bucket (migrate_feedback_images.py)
+        print(f"Dropped inline image from {key}; run migrate_feedback_images.py for it")
+    return record
+
+def load_segment(feedback_bucket, item):
+    # Records compacted by compact_feedback.py, all from one GET
+    records, _ = feedback_segments.read_segment(s3, feedback_bucket, item['Key'])
+    for record in records:
+        record.setdefault('userId', item['Key'].split('/')[0])
+        if record.pop('imageBase64', None):
+            print(f"Dropped inline image from {item['Key']}; run migrate_feedback_images.py for it")
+    return records
+
+def seed_stats(feedback_bucket, user_id, records, reader, dry_run=False):
+    # True if the user's rollups were created (or would be, in a dry run)
+    if not records or meal_stats.read_stats(s3, feedback_bucket, user_id) is not None:
+        return False
+    if not dry_run:
+        meal_stats.seed(s3, feedback_bucket, user_id, records, reader)
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description='Backfill the DynamoDB meal history table from S3 records')
+    parser.add_argument('--feedback-bucket', default='healthy-meal-feedback-bucket')
+    parser.add_argument('--table', default=meal_store.MEALS_TABLE)
+    parser.add_argument('--endpoint-url', default=meal_store.DYNAMODB_ENDPOINT_URL,
+                        help='DynamoDB endpoint, e.g. http://localhost:8000 for DynamoDB Local')
+    parser.add_argument('--prefix', default='', help='Only backfill keys under this prefix (e.g. a user id)')
+    parser.add_argument('--target', choices=('table', 'stats', 'both'), default='table',
+                        help='Copy records to the table, seed missing meal stats rollups, or both')
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    dynamodb = boto3.client('dynamodb', endpoint_url=args.endpoint_url)
+    store = meal_store.DynamoMealStore(dynamodb, args.table)
+    # Where the Lambdas read history from, for meals saved while seeding
+    reader = meal_store.reader(s3, args.feedback_bucket, dynamodb)
+    copy_records = args.target in ('table', 'both')
+    seed_rollups = args.target in ('stats', 'both')
+
+    copied = 0
+    failed = 0
+    seeded = 0
+    batch = []
+    # A user's keys are listed together: their records are collected and
+    # seeded when the listing moves on to the next user
+    user_id = None
+    user_records = []
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=args.feedback_bucket, Prefix=args.prefix):
+        for item in page.get('Contents', []):
+            is_segment = feedback_segments.is_segment_key(item['Key'])
+            if not is_segment and not item['Key'].endswith(history_index.FEEDBACK_SUFFIX):
+                continue
+            owner = item['Key'].split('/')[0]
+            if seed_rollups and owner != user_id:
+                seeded += seed_stats(args.feedback_bucket, user_id, user_records, reader, args.dry_run)
+                user_id, user_records = owner, []
+            try:
+                if is_segment:
+                    loaded = load_segment(args.feedback_bucket, item)
+                else:
+                    loaded = [load_record(args.feedback_bucket, item)]
+            except Exception as e:
+                failed += 1
+                print(f"Error reading {item['Key']}: {e}")
+                continue
+            if copy_records:
+                batch.extend(loaded)
+            if seed_rollups:
+                user_records.extend(loaded)
+        if not copy_records:
+            continue
+        # Write as we go, one list page (up to 1000 records) at a time
+        if batch and not args.dry_run:
+            store.put_many(batch)
+        copied += len(batch)
+        print(f"{'Would copy' if args.dry_run else 'Copied'} {copied} records so far")
+        batch = []
+    if seed_rollups:
+        seeded += seed_stats(args.feedback_bucket, user_id, user_records, reader, args.dry_run)
+
+    if copy_records:
+        print(f"\n{'Would copy' if args.dry_run else 'Copied'}: {copied}, failed: {failed}")
+    if seed_rollups:
+        print(f"{'Would seed' if args.dry_run else 'Seeded'} meal stats for {seeded} users, failed reads: {failed}")
+
+if __name__ == "__main__":
+    main()
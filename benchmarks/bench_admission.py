@@ -0,0 +1,133 @@
+import argparse
+import base64
+import io
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+
+import stubs
+from bench_image_preprocessing import synthetic_images
+
+# A client retry storm against /analyze-meal, with and without admission
+# control (admission). One noisy user fires --noisy-requests requests from
+# --concurrency threads while --quiet-users other users send one request
+# each. Bedrock is stubbed with an account quota of --account-concurrency
+# concurrent calls (calls beyond it are throttled) and the admission table
+# is a FakeDynamoDB with --ddb-ms per call.
+#
+# With --stream the noisy user asks for streamed analyses, which run as
+# jobs (here inline, through a StubLambda) that take their model slot in
+# run_job instead of in the request.
+#
+# Reports per run: status codes of each group, p50 latency of quiet
+# requests and of 429s, peak concurrent model calls, throttles, and the
+# queueing delay admitted requests and jobs spent waiting for a slot.
+#
+#   python benchmarks/bench_admission.py --noisy-requests 60 --concurrency 24
+#   python benchmarks/bench_admission.py --stream
+
+TABLE = 'bench-admission'
+
+
+def percentile(values, share):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * share))], 1)
+
+
+def run(process_image, args, images, enabled):
+    admission = process_image.admission
+    meal_analysis = process_image.meal_analysis
+    admission.ENABLED = enabled
+    admission.USER_RATE_PER_MINUTE = args.rate
+    admission.USER_BURST = args.burst
+    admission.MAX_MODEL_IN_FLIGHT = args.max_in_flight
+    admission.ADMISSION_MAX_WAIT_MS = args.max_wait_ms
+    table = stubs.FakeDynamoDB({TABLE: ('pk', 'sk')}, latency_ms=args.ddb_ms)
+    admission.store = admission.CounterStore(table, TABLE)
+    meal_analysis.s3 = stubs.FakeS3()
+    bedrock = stubs.StubBedrockRuntime(base_ms=args.model_ms, max_concurrency=args.account_concurrency)
+    meal_analysis.bedrock_runtime = bedrock
+    meal_analysis.lambda_client = stubs.StubLambda(process_image.lambda_handler)
+    meal_analysis.ANALYSIS_WORKER_FUNCTION = 'bench-analysis-worker'
+    for breaker in process_image.model_invoker.breakers.values():
+        breaker.outcomes.clear()
+        breaker.state = 'closed'
+
+    requests = ([('noisy', 'noisy-user', n) for n in range(args.noisy_requests)]
+                + [('quiet', f"quiet-user-{n}", n) for n in range(args.quiet_users)])
+    # Quiet users arrive in the middle of the storm
+    middle = args.noisy_requests // 2
+    requests = requests[:middle] + requests[args.noisy_requests:] + requests[middle:args.noisy_requests]
+    results = []
+    lock = threading.Lock()
+
+    def send(request):
+        group, user_id, number = request
+        start = time.perf_counter()
+        response = process_image.lambda_handler({'body': json.dumps({
+            'image': images[number % len(images)],
+            'userId': user_id,
+            'stream': args.stream and group == 'noisy'
+        })}, None)
+        with lock:
+            results.append((group, response['statusCode'], (time.perf_counter() - start) * 1000))
+
+    log = io.StringIO()
+    start = time.perf_counter()
+    with redirect_stdout(log), ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(send, requests))
+    seconds = time.perf_counter() - start
+
+    queued = [line['admissionQueueMs'] for line in map(json.loads, (
+        l for l in log.getvalue().splitlines() if l.startswith('{"_aws"')))
+        if line.get('admission') == 'admitted']
+    statuses = {}
+    for group, status, _ in results:
+        statuses.setdefault(group, {}).setdefault(str(status), 0)
+        statuses[group][str(status)] += 1
+    return {
+        'admission': 'on' if enabled else 'off',
+        'stream': args.stream,
+        'statusCodes': {group: dict(sorted(codes.items())) for group, codes in sorted(statuses.items())},
+        'quietP50Ms': percentile([ms for group, status, ms in results if group == 'quiet'], 0.5),
+        'quietSucceeded': sum(1 for group, status, _ in results if group == 'quiet' and status == 200),
+        'rejectedP50Ms': percentile([ms for _, status, ms in results if status == 429], 0.5),
+        'modelCalls': bedrock.calls['invoke_model'],
+        'throttles': bedrock.calls['throttled'],
+        'peakModelInFlight': bedrock.peak_in_flight,
+        'queueP50Ms': percentile(queued, 0.5),
+        'queueMaxMs': percentile(queued, 1.0),
+        'admissionTableCalls': dict(sorted(table.calls.items())),
+        'wallMs': round(seconds * 1000)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark per-user rate limits and the model concurrency cap')
+    parser.add_argument('--noisy-requests', type=int, default=60)
+    parser.add_argument('--quiet-users', type=int, default=10)
+    parser.add_argument('--concurrency', type=int, default=24)
+    parser.add_argument('--model-ms', type=float, default=400)
+    parser.add_argument('--account-concurrency', type=int, default=10, help='Stub Bedrock quota')
+    parser.add_argument('--ddb-ms', type=float, default=4, help='Simulated DynamoDB round trip')
+    parser.add_argument('--rate', type=float, default=6, help='Tokens per minute per user')
+    parser.add_argument('--burst', type=int, default=10)
+    parser.add_argument('--max-in-flight', type=int, default=8)
+    parser.add_argument('--max-wait-ms', type=int, default=2000)
+    parser.add_argument('--stream', action='store_true', help='Noisy requests ask for streamed analyses')
+    args = parser.parse_args()
+
+    process_image = stubs.import_lambda('process_image')
+    process_image.meal_analysis.analysis_cache.ENABLED = False
+    images = [f"data:{media_type};base64,{base64.b64encode(content).decode('ascii')}"
+              for _, media_type, content in synthetic_images(8, width=640, height=480)]
+    for enabled in (False, True):
+        print(json.dumps(run(process_image, args, images, enabled)))
+
+
+if __name__ == '__main__':
+    main()
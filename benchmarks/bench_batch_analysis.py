@@ -0,0 +1,96 @@
+import argparse
+import base64
+import json
+import time
+
+import stubs
+from bench_image_preprocessing import synthetic_images
+
+# Throughput of N meal photos sent one /analyze-meal request at a time
+# versus one batch request, against a stubbed model with injected latency
+# and throttling (a concurrency quota plus random throttles). Reports
+# images/minute, throttles absorbed by the adaptive limiter, failed items
+# and S3 writes.
+#
+#   python benchmarks/bench_batch_analysis.py --images 20 --model-ms 800 --quota 4
+
+
+def data_url(media_type, content):
+    return f"data:{media_type};base64,{base64.b64encode(content).decode('ascii')}"
+
+
+def run_single(process_image, images):
+    failed = 0
+    for _, media_type, content in images:
+        response = process_image.lambda_handler({'body': json.dumps({
+            'image': data_url(media_type, content),
+            'userId': 'bench-user'
+        })}, None)
+        failed += response['statusCode'] != 200
+    return failed
+
+
+def run_batch(process_image, images):
+    response = process_image.lambda_handler({'body': json.dumps({
+        'userId': 'bench-user',
+        'items': [{'image': data_url(media_type, content)} for _, media_type, content in images]
+    })}, None)
+    body = json.loads(response['body'])
+    if response['statusCode'] != 200:
+        raise RuntimeError(body)
+    return body['failed']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark batch meal analysis throughput')
+    parser.add_argument('--images', type=int, default=20)
+    parser.add_argument('--model-ms', type=float, default=800, help='Stub model latency per call')
+    parser.add_argument('--quota', type=int, default=4, help='Concurrent model calls before throttling')
+    parser.add_argument('--throttle-rate', type=float, default=0.05, help='Random throttle probability')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 8],
+                        help='Batch model concurrency limits to try')
+    parser.add_argument('--backoff-ms', type=float, default=200, help='Base backoff after a throttle')
+    args = parser.parse_args()
+
+    process_image = stubs.import_lambda('process_image')
+    meal_analysis = process_image.meal_analysis
+    batch_analysis = process_image.batch_analysis
+    meal_analysis.analysis_cache.ENABLED = False
+    images = synthetic_images(args.images, width=1024, height=768)
+
+    def fresh_stubs():
+        s3 = stubs.FakeS3()
+        meal_analysis.s3 = s3
+        meal_analysis.bedrock_runtime = stubs.StubBedrockRuntime(
+            base_ms=args.model_ms, max_concurrency=args.quota, throttle_rate=args.throttle_rate, seed=7)
+        return s3, meal_analysis.bedrock_runtime
+
+    runs = [('single', None)] + [('batch', c) for c in args.concurrency]
+    for mode, concurrency in runs:
+        s3, model = fresh_stubs()
+        if mode == 'batch':
+            batch_analysis.limiter = batch_analysis.adaptive_limiter.AdaptiveLimiter(
+                concurrency, base_delay=args.backoff_ms / 1000.0)
+        start = time.perf_counter()
+        try:
+            failed = run_single(process_image, images) if mode == 'single' else run_batch(process_image, images)
+        except RuntimeError as e:
+            print(f"{mode} failed: {e}")
+            continue
+        seconds = time.perf_counter() - start
+        result = {
+            'mode': mode if mode == 'single' else f"batch(concurrency={concurrency})",
+            'seconds': round(seconds, 2),
+            'imagesPerMinute': round((args.images - failed) / seconds * 60, 1),
+            'failed': failed,
+            'modelCalls': model.calls['invoke_model'],
+            'throttled': model.calls['throttled'],
+            's3Puts': s3.calls['put_object']
+        }
+        if mode == 'batch':
+            result.update(batch_analysis.limiter.stats())
+        print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import stubs
+
+# Measures cold-start cost per handler, each in a fresh interpreter: module
+# import time, whether boto3 was loaded by the import, client construction
+# (a {"warmup": true} ping, boto3 import excluded) and the first real
+# request against stub clients.
+# Run with --max-import-ms to fail when an import regresses past a budget.
+
+# 1x1 PNG
+TINY_PNG = 'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8z8BQDwAEhQGAhKmMIQAAAABJRU5ErkJggg=='
+
+FIRST_REQUESTS = {
+    'process_image': {'body': json.dumps({'image': TINY_PNG, 'userId': 'bench-user'})},
+    'get_user_history': {'pathParameters': {'userId': 'bench-user'}},
+    'get_analysis_status': {'pathParameters': {'jobId': 'missing-job'}},
+    'create_upload_url': {'body': json.dumps({'userId': 'bench-user', 'contentType': 'image/jpeg'})},
+    'submit_analysis': {'body': json.dumps({'image': TINY_PNG, 'userId': 'bench-user'})},
+    'analysis_worker': {'Records': []}
+}
+
+CHILD_ENV = {'ANALYSIS_QUEUE_URL': 'https://sqs.us-west-2.amazonaws.com/000000000000/bench'}
+
+
+def use_stub_clients():
+    # Swap every lazily declared client for a stub, so the first request
+    # runs offline
+    import aws_clients
+    fakes = {'s3': stubs.FakeS3(), 'bedrock-runtime': stubs.StubBedrockRuntime(base_ms=0, per_mb_ms=0),
+             'sqs': stubs.StubSQS()}
+    for module in list(sys.modules.values()):
+        if getattr(module, '__file__', None) and os.path.dirname(os.path.abspath(module.__file__)) == os.path.abspath(stubs.LAMBDA_DIR):
+            for name, value in list(vars(module).items()):
+                if isinstance(value, aws_clients.LazyClient) and value.service in fakes:
+                    setattr(module, name, fakes[value.service])
+
+
+def measure_child(name):
+    result = {'handler': name}
+    start = time.perf_counter()
+    module = stubs.import_lambda(name, CHILD_ENV)
+    result['importMs'] = round((time.perf_counter() - start) * 1000, 1)
+    result['boto3Imported'] = 'boto3' in sys.modules
+
+    try:
+        import boto3  # noqa: F401  (only to check it is available)
+        start = time.perf_counter()
+        module.lambda_handler({'warmup': True}, None)
+        result['warmupMs'] = round((time.perf_counter() - start) * 1000, 1)
+    except ImportError:
+        result['warmupMs'] = None
+
+    use_stub_clients()
+    start = time.perf_counter()
+    response = module.lambda_handler(FIRST_REQUESTS[name], None)
+    result['firstRequestMs'] = round((time.perf_counter() - start) * 1000, 1)
+    result['statusCode'] = response.get('statusCode') if isinstance(response, dict) else None
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark handler import and first-invoke time')
+    parser.add_argument('--handler', action='append', choices=sorted(FIRST_REQUESTS),
+                        help='Handler to measure (repeatable, default: all)')
+    parser.add_argument('--runs', type=int, default=3, help='Fresh interpreters per handler')
+    parser.add_argument('--max-import-ms', type=float, help='Fail if a median import exceeds this')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        # Keep handler logs off stdout, which carries the result
+        real_stdout = sys.stdout
+        sys.stdout = sys.stderr
+        result = measure_child(args.child)
+        real_stdout.write(json.dumps(result) + '\n')
+        return
+
+    results = []
+    for name in args.handler or sorted(FIRST_REQUESTS):
+        runs = []
+        for _ in range(args.runs):
+            out = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', name],
+                                 capture_output=True, text=True, check=True)
+            runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+        summary = {'handler': name, 'boto3Imported': runs[0]['boto3Imported'],
+                   'statusCode': runs[0]['statusCode']}
+        for field in ('importMs', 'warmupMs', 'firstRequestMs'):
+            values = sorted(r[field] for r in runs if r[field] is not None)
+            summary[field] = values[len(values) // 2] if values else None
+        results.append(summary)
+        print(json.dumps(summary))
+
+    if args.max_import_ms is not None:
+        slow = [r['handler'] for r in results if r['importMs'] > args.max_import_ms]
+        if slow:
+            print(f"Import time over {args.max_import_ms} ms: {', '.join(slow)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
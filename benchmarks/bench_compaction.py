@@ -0,0 +1,109 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+
+import stubs
+from bench_meal_stats import seed_history, synthetic_meal
+
+# History reads of a long meal history before and after compaction into
+# segment files (feedback_segments, compact_feedback.py). One user has
+# --meals records, one every ~50 minutes; everything older than
+# --older-than-days before the newest meal is compacted. S3 is a FakeS3
+# with --s3-latency-ms per call.
+#
+# Reports, before and after: objects and bytes under the user's prefix, and
+# S3 calls and latency of the newest page (limit 50, as GET /history), a
+# page deep in the history, and a full scan (meal_stats.all_records, as a
+# rollup repair or an export). Then the compaction job's own calls and
+# time. Finally new meals are saved after compaction and the merged history
+# is checked to be exactly the records before compaction plus the new ones.
+#
+#   python benchmarks/bench_compaction.py --meals 5000
+
+
+def measure(s3, store, meal_stats, user_id, deep_cursor):
+    results = {}
+    for name, read in (
+            ('firstPage', lambda: store.query(user_id, limit=50)[0]),
+            ('deepPage', lambda: store.query(user_id, cursor=deep_cursor, limit=50)[0]),
+            ('fullScan', lambda: list(meal_stats.all_records(store, user_id)))):
+        s3.calls.clear()
+        start = time.perf_counter()
+        records = read()
+        results[name] = {
+            'ms': round((time.perf_counter() - start) * 1000, 1),
+            's3Calls': sum(s3.calls.values()),
+            'records': len(records)
+        }
+    return results
+
+
+def footprint(s3, bucket, user_id):
+    sizes = [len(obj['Body']) for (b, key), obj in s3.objects.items() if b == bucket and key.startswith(f"{user_id}/")]
+    return {'objects': len(sizes), 'bytes': sum(sizes)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark history reads before and after segment compaction')
+    parser.add_argument('--meals', type=int, default=5000)
+    parser.add_argument('--older-than-days', type=int, default=30)
+    parser.add_argument('--new-meals', type=int, default=20, help='Meals saved after compaction')
+    parser.add_argument('--s3-latency-ms', type=float, default=5)
+    parser.add_argument('--concurrency', type=int, default=16)
+    args = parser.parse_args()
+
+    meal_stats = stubs.import_lambda('meal_stats')
+    meal_store = stubs.import_lambda('meal_store')
+    feedback_segments = stubs.import_lambda('feedback_segments')
+    bucket = 'bench-feedback'
+    user_id = 'bench-user'
+
+    s3 = stubs.FakeS3()
+    next_time = seed_history(s3, bucket, user_id, args.meals)
+    s3.latency_ms = args.s3_latency_ms
+    executor = ThreadPoolExecutor(max_workers=args.concurrency)
+    store = meal_store.S3MealStore(s3, bucket, executor)
+
+    # A page about 80% of the way back, in the compacted part
+    before_records = list(meal_stats.all_records(store, user_id))
+    deep = before_records[int(len(before_records) * 0.8)]
+    deep_cursor = (deep['timestamp'], deep['imageId'])
+    before = {'footprint': footprint(s3, bucket, user_id), **measure(s3, store, meal_stats, user_id, deep_cursor)}
+    print(json.dumps({'history': 'objects', **before}))
+
+    cutoff = (next_time - timedelta(days=args.older_than_days)).isoformat()
+    s3.calls.clear()
+    start = time.perf_counter()
+    summary = feedback_segments.compact_user(s3, bucket, user_id, cutoff, executor)
+    print(json.dumps({'compaction': {
+        'ms': round((time.perf_counter() - start) * 1000, 1),
+        's3Calls': dict(sorted(s3.calls.items())),
+        'compacted': summary['compacted'],
+        'segments': summary['segments'],
+        'deleted': summary['deleted']
+    }}))
+
+    after = {'footprint': footprint(s3, bucket, user_id), **measure(s3, store, meal_stats, user_id, deep_cursor)}
+    print(json.dumps({'history': 'segments', **after}))
+
+    # New meals land as objects next to the segments
+    new_records = [synthetic_meal(user_id, args.meals + i, datetime(2024, 1, 1)) for i in range(args.new_meals)]
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        for record in new_records:
+            store.put(record)
+    merged = list(meal_stats.all_records(store, user_id))
+    expected = sorted(before_records + new_records, key=lambda r: (r['timestamp'], r['imageId']), reverse=True)
+    print(json.dumps({'mergedRecords': len(merged), 'identical': merged == expected}))
+
+    # Compacting again with nothing new in the old months changes nothing
+    again = feedback_segments.compact_user(s3, bucket, user_id, cutoff, executor)
+    print(json.dumps({'recompacted': again['compacted'],
+                      'identicalAfterRerun': list(meal_stats.all_records(store, user_id)) == expected}))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+import argparse
+import json
+import os
+import time
+
+import stubs
+
+# Guideline retrieval for the analysis prompt: the in-Lambda BM25 index
+# (guideline_index.json, GUIDELINE_RETRIEVAL=local) against the remote
+# knowledge base path (GUIDELINE_RETRIEVAL=kb), stubbed with a hashed
+# embedding function and a simulated round trip. Reports index load time,
+# per-query latency and grounding: how often the guideline a meal calls
+# for is among the passages injected into the prompt.
+#
+#   python build_guideline_index.py
+#   python benchmarks/bench_guideline_retrieval.py --kb-ms 120
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Ingredient queries (as the fast tier reports them) and the guidelines
+# that should ground their analysis
+LABELED_QUERIES = [
+    ('brown rice quinoa oats', {'Carbohydrate Guidelines'}),
+    ('white bread pasta added sugar', {'Carbohydrate Guidelines'}),
+    ('sweet potatoes squash', {'Carbohydrate Guidelines'}),
+    ('grilled chicken breast turkey', {'Protein Guidelines'}),
+    ('bacon sausage red meat', {'Protein Guidelines'}),
+    ('tofu lentils tempeh', {'Protein Guidelines'}),
+    ('eggs low-fat yogurt', {'Protein Guidelines'}),
+    ('avocado almonds olive oil', {'Fat Guidelines'}),
+    ('salmon fatty fish', {'Fat Guidelines', 'Protein Guidelines'}),
+    ('butter fried food saturated fat', {'Fat Guidelines'}),
+    ('broccoli spinach fruits vegetables', {'Healthy Plate Model'}),
+    ('soda sweetened tea', {'Healthy Plate Model'}),
+    ('large steak portion', {'Portion Size Guidelines', 'Protein Guidelines'}),
+    ('cup of rice fist-sized', {'Portion Size Guidelines'}),
+]
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def evaluate(search, k, repeat):
+    timings = []
+    hits_1 = hits_k = 0
+    for query, expected in LABELED_QUERIES:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            passages = search(query, k)
+            timings.append((time.perf_counter() - start) * 1000)
+        titles = [p['title'] for p in passages]
+        hits_1 += bool(titles[:1]) and titles[0] in expected
+        hits_k += bool(expected & set(titles))
+    return {
+        'p50Ms': round(percentile(timings, 0.5), 3),
+        'p95Ms': round(percentile(timings, 0.95), 3),
+        'hitAt1': round(hits_1 / len(LABELED_QUERIES), 3),
+        f"hitAt{k}": round(hits_k / len(LABELED_QUERIES), 3)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark local guideline retrieval against the remote KB')
+    parser.add_argument('--k', type=int, default=3)
+    parser.add_argument('--kb-ms', type=float, default=120, help='Simulated KB round trip')
+    parser.add_argument('--kb-jitter-ms', type=float, default=60)
+    parser.add_argument('--repeat', type=int, default=20, help='Local searches per query')
+    args = parser.parse_args()
+
+    guideline_index = stubs.import_lambda('guideline_index')
+    with open(os.path.join(ROOT, 'nutrition_guidelines.json'), encoding='utf-8') as f:
+        documents = json.load(f)
+
+    start = time.perf_counter()
+    index = guideline_index.load(guideline_index.INDEX_PATH)
+    load_ms = (time.perf_counter() - start) * 1000
+    if index is None:
+        raise SystemExit('Run build_guideline_index.py first')
+
+    local = evaluate(lambda q, k: guideline_index.search(index, q, k), args.k, args.repeat)
+    local.update({
+        'mode': 'local',
+        'indexLoadMs': round(load_ms, 2),
+        'indexBytes': os.path.getsize(guideline_index.INDEX_PATH),
+        'passages': len(index['passages'])
+    })
+    print(json.dumps(local))
+
+    guideline_index.bedrock_agent_runtime = stubs.StubKnowledgeBase(
+        documents, latency_ms=args.kb_ms, jitter_ms=args.kb_jitter_ms, seed=3)
+    remote = evaluate(guideline_index.search_kb, args.k, 1)
+    remote['mode'] = 'kb (stubbed embeddings)'
+    print(json.dumps(remote))
+
+    # What a container sees per request: the default query is memoized
+    guideline_index.RETRIEVAL_MODE = 'local'
+    guideline_index._results.clear()
+    timings = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        passages = guideline_index.retrieve()
+        timings.append((time.perf_counter() - start) * 1000)
+    print(json.dumps({
+        'mode': 'local retrieve() per request',
+        'firstMs': round(timings[0], 3),
+        'p50Ms': round(percentile(timings, 0.5), 4),
+        'promptChars': len(guideline_index.prompt_context(passages))
+    }))
+
+
+if __name__ == '__main__':
+    main()
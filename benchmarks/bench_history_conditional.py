@@ -0,0 +1,81 @@
+import argparse
+import json
+import random
+import time
+
+import stubs
+from load_test import seed_history
+
+# Transfer size and handler time of GET /meal-history for a client that
+# re-polls an unchanged history: a plain request, compressed responses
+# (gzip, and brotli when the module is installed), and revalidation with
+# If-None-Match, which is answered with a bodiless 304 after one S3 read
+# of the history index. Ends with a poll after a new meal, which must get
+# the new page.
+#
+#   python benchmarks/bench_history_conditional.py --meals 300 --page-size 50 --s3-ms 15
+
+
+def request(get_user_history, headers, page_size):
+    return get_user_history.lambda_handler({
+        'pathParameters': {'userId': 'load-user-0'},
+        'queryStringParameters': {'limit': str(page_size)},
+        'headers': headers
+    }, None)
+
+
+def measure(get_user_history, s3, name, headers, page_size, repeat):
+    timings = []
+    before = sum(s3.calls.values())
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = request(get_user_history, headers, page_size)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    print(json.dumps({
+        'request': name,
+        'status': response['statusCode'],
+        'contentEncoding': response['headers'].get('Content-Encoding', 'identity'),
+        # What goes over the wire: API Gateway decodes base64 bodies
+        'transferBytes': (len(response['body']) * 3 // 4 if response.get('isBase64Encoded')
+                          else len(response['body'])),
+        'p50Ms': round(timings[len(timings) // 2], 2),
+        's3CallsPerRequest': (sum(s3.calls.values()) - before) / repeat
+    }))
+    return response
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark conditional and compressed history responses')
+    parser.add_argument('--meals', type=int, default=300)
+    parser.add_argument('--page-size', type=int, default=50)
+    parser.add_argument('--s3-ms', type=float, default=15, help='Simulated S3 round trip')
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    get_user_history = stubs.import_lambda('get_user_history')
+    http_cache = get_user_history.http_cache
+    store = get_user_history.meal_store.S3MealStore(stubs.FakeS3(), get_user_history.FEEDBACK_BUCKET,
+                                                    get_user_history.executor)
+    seed_history(store, 1, args.meals, random.Random(5))
+    s3 = store.s3
+    s3.latency_ms = args.s3_ms
+    get_user_history.s3 = s3
+
+    plain = measure(get_user_history, s3, 'plain', {}, args.page_size, args.repeat)
+    for encoding in http_cache.ENCODINGS:
+        measure(get_user_history, s3, encoding, {'accept-encoding': encoding}, args.page_size, args.repeat)
+    etag = plain['headers']['ETag']
+    measure(get_user_history, s3, 'If-None-Match, unchanged', {'if-none-match': etag, 'accept-encoding': 'gzip'},
+            args.page_size, args.repeat)
+
+    store.put({'userId': 'load-user-0', 'imageId': 'meal-new', 'timestamp': '2099-01-01T00:00:00',
+               'feedback': 'New meal'})
+    changed = measure(get_user_history, s3, 'If-None-Match, after a new meal',
+                      {'if-none-match': etag, 'accept-encoding': 'gzip'}, args.page_size, 1)
+    if changed['statusCode'] != 200:
+        raise RuntimeError('A changed history was answered with 304')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+import argparse
+import base64
+import io
+import json
+import os
+import random
+import statistics
+import time
+
+import stubs
+
+# Compares process_image with and without image preprocessing over a folder
+# of meal photos (or synthetic ones), against a stubbed model whose latency
+# grows with request size.
+#
+#   python benchmarks/bench_image_preprocessing.py --images ~/meal-photos
+#   python benchmarks/bench_image_preprocessing.py --synthetic 10
+
+MEDIA_TYPES = {
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.webp': 'image/webp',
+    '.heic': 'image/heic'
+}
+
+
+def load_images(folder):
+    images = []
+    for name in sorted(os.listdir(folder)):
+        media_type = MEDIA_TYPES.get(os.path.splitext(name)[1].lower())
+        if media_type:
+            with open(os.path.join(folder, name), 'rb') as f:
+                images.append((name, media_type, f.read()))
+    return images
+
+
+def synthetic_images(count, width=4032, height=3024):
+    # Phone-camera sized images with enough texture to compress like a photo
+    from PIL import Image, ImageFilter
+    rng = random.Random(42)
+    images = []
+    for i in range(count):
+        small = Image.new('RGB', (width // 16, height // 16))
+        small.putdata([(rng.randrange(256), rng.randrange(256), rng.randrange(256))
+                       for _ in range(small.width * small.height)])
+        img = small.resize((width, height)).filter(ImageFilter.GaussianBlur(2))
+        out = io.BytesIO()
+        img.save(out, format='JPEG', quality=92)
+        images.append((f"synthetic_{i}.jpg", 'image/jpeg', out.getvalue()))
+    return images
+
+
+def run(process_image, images, preprocess):
+    process_image.image_utils.PREPROCESS_ENABLED = preprocess
+    model = process_image.meal_analysis.bedrock_runtime
+    model.request_bytes.clear()
+    latencies = []
+    for name, media_type, content in images:
+        event = {'body': json.dumps({
+            'image': f"data:{media_type};base64,{base64.b64encode(content).decode('ascii')}",
+            'userId': 'bench-user'
+        })}
+        start = time.perf_counter()
+        response = process_image.lambda_handler(event, None)
+        latencies.append((time.perf_counter() - start) * 1000)
+        if response['statusCode'] != 200:
+            raise RuntimeError(f"{name}: {response['body']}")
+    return {
+        'originalBytes': sum(len(c) for _, _, c in images),
+        'modelRequestBytes': sum(model.request_bytes),
+        'p50Ms': round(statistics.median(latencies), 1),
+        'meanMs': round(statistics.mean(latencies), 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark image preprocessing before model invocation')
+    parser.add_argument('--images', help='Folder of sample meal photos')
+    parser.add_argument('--synthetic', type=int, default=5, help='Generated photos if no folder is given')
+    parser.add_argument('--model-base-ms', type=float, default=2000)
+    parser.add_argument('--model-per-mb-ms', type=float, default=400)
+    args = parser.parse_args()
+
+    process_image = stubs.import_lambda('process_image')
+    process_image.meal_analysis.s3 = stubs.FakeS3()
+    process_image.meal_analysis.bedrock_runtime = stubs.StubBedrockRuntime(args.model_base_ms, args.model_per_mb_ms)
+    # Every run must reach the model
+    process_image.meal_analysis.analysis_cache.ENABLED = False
+
+    images = load_images(args.images) if args.images else synthetic_images(args.synthetic)
+    print(f"{len(images)} images")
+
+    results = {
+        'passthrough': run(process_image, images, preprocess=False),
+        'preprocessed': run(process_image, images, preprocess=True)
+    }
+    print(json.dumps(results, indent=2))
+    before = results['passthrough']['modelRequestBytes']
+    after = results['preprocessed']['modelRequestBytes']
+    print(f"Model request bytes: {before} -> {after} ({100 * (1 - after / before):.1f}% smaller)")
+
+
+if __name__ == '__main__':
+    main()
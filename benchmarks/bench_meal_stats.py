@@ -0,0 +1,126 @@
+import argparse
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import stubs
+
+# Compares the two ways of producing GET /meal-stats rollups for a user
+# with a long history: the incremental update done as each meal is saved,
+# and the repair path that recomputes everything from the raw records.
+# Reports wall time and S3 calls against a simulated S3 latency.
+
+INGREDIENTS = ['brown rice', 'white rice', 'chicken breast', 'salmon', 'tofu', 'broccoli', 'spinach',
+               'avocado', 'eggs', 'whole wheat bread', 'pasta', 'beef', 'lentils', 'chickpeas', 'cheese',
+               'olive oil', 'tomato', 'quinoa', 'sweet potato', 'yogurt', 'berries', 'almonds', 'bacon']
+
+
+def synthetic_meal(user_id, index, start):
+    rng = random.Random(index)
+    timestamp = start + timedelta(minutes=index * 50 + rng.randint(0, 40))
+    return {
+        'userId': user_id,
+        'imageId': f"meal-{index:06d}",
+        'imageKey': f"{user_id}/meal-{index:06d}.jpg",
+        'imageContentType': 'image/jpeg',
+        'timestamp': timestamp.isoformat(),
+        'feedback': 'Synthetic analysis text. ' * 80,
+        'ingredients': rng.sample(INGREDIENTS, rng.randint(2, 6)),
+        'scores': {field: rng.randint(1, 10) for field in ('nutrition', 'balance', 'health', 'sustainability')},
+        'alternatives': [],
+        'analysisFormat': 'json',
+        'cacheHit': False
+    }
+
+
+def seed_history(s3, bucket, user_id, meals):
+    # Writes records and the history index directly (no rollup updates)
+    import history_index
+    start = datetime(2024, 1, 1)
+    entries = []
+    for i in range(meals):
+        record = synthetic_meal(user_id, i, start)
+        key = history_index.feedback_key(user_id, record['imageId'])
+        s3.put_object(Bucket=bucket, Key=key, Body=json.dumps(record), ContentType='application/json')
+        entries.append({'imageId': record['imageId'], 'timestamp': record['timestamp'], 'key': key})
+    history_index.write_index(s3, bucket, user_id, entries)
+    return start + timedelta(minutes=meals * 50 + 60)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark incremental meal stats against full recomputation')
+    parser.add_argument('--meals', type=int, default=10000)
+    parser.add_argument('--updates', type=int, default=100, help='Meals saved incrementally')
+    parser.add_argument('--s3-latency-ms', type=float, default=5)
+    parser.add_argument('--concurrency', type=int, default=16)
+    args = parser.parse_args()
+
+    handler = stubs.import_lambda('get_meal_stats')
+    meal_stats = handler.meal_stats
+    meal_store = handler.meal_store
+    bucket = handler.FEEDBACK_BUCKET
+    user_id = 'bench-user'
+
+    s3 = stubs.FakeS3()
+    handler.s3 = s3
+    next_time = seed_history(s3, bucket, user_id, args.meals)
+    s3.latency_ms = args.s3_latency_ms
+    executor = ThreadPoolExecutor(max_workers=args.concurrency)
+    store = meal_store.S3MealStore(s3, bucket, executor)
+    results = {}
+
+    s3.calls.clear()
+    start = time.perf_counter()
+    stats = meal_stats.recompute(s3, bucket, store, user_id)
+    results['recompute'] = {
+        'ms': round((time.perf_counter() - start) * 1000, 1),
+        's3Calls': sum(s3.calls.values()),
+        'meals': stats['meals']
+    }
+
+    timings = []
+    rollup_calls = 0
+    for i in range(args.updates):
+        record = synthetic_meal(user_id, args.meals + i, next_time)
+        # Saved like save_feedback does, but only the rollup update is timed
+        store.put(record)
+        calls_before = sum(s3.calls.values())
+        start = time.perf_counter()
+        meal_stats.record_meal(s3, bucket, record, store)
+        timings.append((time.perf_counter() - start) * 1000)
+        rollup_calls += sum(s3.calls.values()) - calls_before
+    timings.sort()
+    results['incremental'] = {
+        'meanMs': round(sum(timings) / len(timings), 2),
+        'p95Ms': round(timings[int(len(timings) * 0.95) - 1], 2),
+        's3CallsPerMeal': round(rollup_calls / args.updates, 2),
+        'documentBytes': len(s3.objects[(bucket, meal_stats.stats_key(user_id))]['Body'])
+    }
+
+    for period in meal_stats.PERIODS:
+        s3.calls.clear()
+        start = time.perf_counter()
+        response = handler.lambda_handler({
+            'pathParameters': {'userId': user_id},
+            'queryStringParameters': {'period': period}
+        }, None)
+        body = json.loads(response['body'])
+        results[f"read_{period}"] = {
+            'ms': round((time.perf_counter() - start) * 1000, 1),
+            's3Calls': sum(s3.calls.values()),
+            'buckets': len(body['buckets']),
+            'responseBytes': len(response['body'])
+        }
+
+    # Both paths must agree
+    rebuilt = meal_stats.build(meal_stats.all_records(store, user_id))
+    stored = meal_stats.read_stats(s3, bucket, user_id)
+    results['consistent'] = rebuilt['periods'] == stored['periods'] and rebuilt['meals'] == stored['meals']
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import argparse
+import base64
+import hashlib
+import json
+import time
+
+import stubs
+from bench_image_preprocessing import synthetic_images
+
+# Latency and token cost of tiered model routing (model_router) against
+# sending every image to the full model. The stubbed fast model reports a
+# confident "simple" triage for --simple-share of the images and a complex
+# plate for the rest; those are escalated. Reports mean/p95 latency,
+# escalation rate, tokens per tier and an estimated cost per 1000 images
+# from per-million-token prices.
+#
+#   python benchmarks/bench_model_routing.py --images 40 --fast-ms 400 --full-ms 1500
+
+ANALYSIS = ("Identification: grilled chicken, rice.\n\n```json\n"
+            '{"ingredients": ["chicken", "rice"], "scores": {"nutrition": 7, "balance": 6, '
+            '"health": 7, "sustainability": 6}, "alternatives": []%s}\n```')
+
+
+def stub_text(fast_model_id, simple_share):
+    def text(model_id, body):
+        if model_id != fast_model_id:
+            return ANALYSIS % ''
+        # The image decides, so a retry gets the same triage
+        image = json.loads(body)['messages'][0]['content'][0]['source']['data']
+        simple = int(hashlib.sha256(image.encode('ascii')).hexdigest(), 16) % 1000 < simple_share * 1000
+        triage = ', "confidence": 0.9, "complexity": "simple"' if simple else \
+            ', "confidence": 0.55, "complexity": "complex"'
+        return ANALYSIS % triage
+    return text
+
+
+def run(process_image, images, detail):
+    timings = []
+    for _, media_type, content in images:
+        start = time.perf_counter()
+        response = process_image.lambda_handler({'body': json.dumps({
+            'image': f"data:{media_type};base64,{base64.b64encode(content).decode('ascii')}",
+            'userId': 'bench-user',
+            'detail': detail
+        })}, None)
+        timings.append((time.perf_counter() - start) * 1000)
+        if response['statusCode'] != 200:
+            raise RuntimeError(response['body'])
+    return sorted(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark tiered model routing')
+    parser.add_argument('--images', type=int, default=40)
+    parser.add_argument('--simple-share', type=float, default=0.7, help='Images the fast model keeps')
+    parser.add_argument('--fast-ms', type=float, default=400, help='Stub fast model latency')
+    parser.add_argument('--full-ms', type=float, default=1500, help='Stub full model latency')
+    parser.add_argument('--output-tokens', type=int, default=600)
+    parser.add_argument('--fast-price', type=float, nargs=2, default=[0.25, 1.25],
+                        help='Fast model $ per million input/output tokens')
+    parser.add_argument('--full-price', type=float, nargs=2, default=[3.0, 15.0],
+                        help='Full model $ per million input/output tokens')
+    args = parser.parse_args()
+
+    process_image = stubs.import_lambda('process_image')
+    meal_analysis = process_image.meal_analysis
+    router = meal_analysis.model_router
+    meal_analysis.analysis_cache.ENABLED = False
+    images = synthetic_images(args.images, width=1024, height=768)
+    prices = {router.FAST_MODEL_ID: args.fast_price, meal_analysis.MODEL_ID: args.full_price}
+
+    for mode in ('single', 'tiered', 'tiered-detailed'):
+        router.ROUTING_MODE = 'single' if mode == 'single' else 'tiered'
+        for outcome in router.stats:
+            router.stats[outcome] = 0
+        meal_analysis.s3 = stubs.FakeS3()
+        model = stubs.StubBedrockRuntime(
+            text=stub_text(router.FAST_MODEL_ID, args.simple_share), output_tokens=args.output_tokens,
+            model_ms={router.FAST_MODEL_ID: args.fast_ms, meal_analysis.MODEL_ID: args.full_ms})
+        meal_analysis.bedrock_runtime = model
+
+        timings = run(process_image, images, 'detailed' if mode == 'tiered-detailed' else 'auto')
+        cost = sum(model.tokens[(model_id, 'input')] * price[0] + model.tokens[(model_id, 'output')] * price[1]
+                   for model_id, price in prices.items()) / 1e6
+        tiered = router.stats['fast'] + router.stats['escalated']
+        print(json.dumps({
+            'mode': mode,
+            'meanMs': round(sum(timings) / len(timings), 1),
+            'p95Ms': round(timings[max(0, int(len(timings) * 0.95) - 1)], 1),
+            'escalationRate': round(router.stats['escalated'] / tiered, 3) if tiered else None,
+            'modelCalls': dict(model.model_calls),
+            'tokens': {f"{model_id}:{kind}": count for (model_id, kind), count in model.tokens.items()},
+            'costPer1000Images': round(cost / len(images) * 1000, 3)
+        }))
+
+
+if __name__ == '__main__':
+    main()
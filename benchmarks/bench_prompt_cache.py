@@ -0,0 +1,124 @@
+import argparse
+import base64
+import json
+import os
+import time
+from contextlib import redirect_stdout
+
+import stubs
+from bench_image_preprocessing import synthetic_images
+
+# Token budget of the analysis prompts (prompts.budget) and the effect of
+# prompt-prefix caching on repeat invocations. The stubbed model bills the
+# system prefix marked with cache_control as a cache write on first use
+# and a cache read afterwards, and adds prefill latency per uncached input
+# token. Input cost uses cache write = 1.25x and cache read = 0.1x the
+# input price, as Bedrock bills them.
+#
+# Each configuration runs with caching off and on:
+#   default        the deployed MODEL_ID and the shipped guideline index.
+#                  The model isn't in prompts.CACHING_MODELS, so no
+#                  cache_control is sent and nothing is cached.
+#   eligibleModel  a cache-capable model with the same prefix, which is
+#                  still shorter than --min-cache-tokens: nothing cached.
+#   longPrefix     a cache-capable model with the guideline context padded
+#                  with synthetic passages to --prefix-tokens, standing in
+#                  for a larger guideline corpus: repeats read the cache.
+#
+#   python benchmarks/bench_prompt_cache.py --requests 10 --min-cache-tokens 1024
+
+CACHING_MODEL = 'anthropic.claude-3-7-sonnet-20250219-v1:0'
+FILLER = ('Prefer minimally processed foods, vary protein sources across the week, '
+          'and keep added sugars and sodium low when judging a meal. ')
+
+
+def request(process_image, image):
+    _, media_type, content = image
+    return process_image.lambda_handler({'body': json.dumps({
+        'image': f"data:{media_type};base64,{base64.b64encode(content).decode('ascii')}",
+        'userId': 'bench-user'
+    })}, None)
+
+
+def padded(passages, guideline_index, prompts, prefix_tokens):
+    # Adds synthetic passages until the analysis system prefix is an
+    # estimated prefix_tokens long
+    passages = list(passages)
+    while prompts.budget('analysis', guideline_index.prompt_context(passages))['systemTokens'] < prefix_tokens:
+        passages.append({'title': f"Additional Guideline {len(passages) + 1}", 'text': FILLER * 4})
+    return passages
+
+
+def run(process_image, images, model_id, args):
+    meal_analysis = process_image.meal_analysis
+    meal_analysis.s3 = stubs.FakeS3()
+    model = stubs.StubBedrockRuntime(base_ms=args.model_ms, min_cache_tokens=args.min_cache_tokens,
+                                     prefill_ms_per_ktok=args.prefill_ms_per_ktok)
+    meal_analysis.bedrock_runtime = model
+    calls = []
+    for image in images:
+        before = model.tokens.copy()
+        start = time.perf_counter()
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            response = request(process_image, image)
+        if response['statusCode'] != 200:
+            raise RuntimeError(response['body'])
+        ms = (time.perf_counter() - start) * 1000
+        used = {kind: model.tokens[(model_id, kind)] - before[(model_id, kind)]
+                for kind in ('input', 'cacheRead', 'cacheWrite')}
+        cost = (used['input'] + 1.25 * used['cacheWrite'] + 0.1 * used['cacheRead']) * args.input_price / 1e6
+        calls.append({'ms': ms, 'cost': cost, **used})
+    repeats = calls[1:] or calls
+    return {
+        'first': {k: round(v, 6) if k == 'cost' else round(v, 1) for k, v in calls[0].items()},
+        'repeatMeanMs': round(sum(c['ms'] for c in repeats) / len(repeats), 1),
+        'repeatInputTokens': round(sum(c['input'] for c in repeats) / len(repeats), 1),
+        'repeatCacheReadTokens': round(sum(c['cacheRead'] for c in repeats) / len(repeats), 1),
+        'inputCostPer1000': round(sum(c['cost'] for c in calls) / len(calls) * 1000, 4)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark prompt token budget and prefix caching')
+    parser.add_argument('--requests', type=int, default=10)
+    parser.add_argument('--min-cache-tokens', type=int, default=1024,
+                        help='Shortest cacheable prefix (1024 for Sonnet, 2048 for Haiku)')
+    parser.add_argument('--prefix-tokens', type=int, default=1400,
+                        help='Estimated system prefix of the longPrefix configuration')
+    parser.add_argument('--prefill-ms-per-ktok', type=float, default=60)
+    parser.add_argument('--model-ms', type=float, default=300)
+    parser.add_argument('--input-price', type=float, default=3.0, help='$ per million input tokens')
+    args = parser.parse_args()
+
+    process_image = stubs.import_lambda('process_image')
+    meal_analysis = process_image.meal_analysis
+    prompts = meal_analysis.prompts
+    guideline_index = meal_analysis.guideline_index
+    meal_analysis.analysis_cache.ENABLED = False
+    default_model = meal_analysis.MODEL_ID
+    shipped = guideline_index.retrieve()
+    long_passages = padded(shipped, guideline_index, prompts, args.prefix_tokens)
+    retrieve = guideline_index.retrieve
+
+    images = synthetic_images(args.requests, width=1024, height=768)
+    for name, model_id, passages in (('default', default_model, shipped),
+                                     ('eligibleModel', CACHING_MODEL, shipped),
+                                     ('longPrefix', CACHING_MODEL, long_passages)):
+        meal_analysis.MODEL_ID = model_id
+        guideline_index.retrieve = lambda query=None, k=None, passages=passages: passages
+        context = guideline_index.prompt_context(passages)
+        prompts.PROMPT_CACHING = True
+        for prompt in prompts.PROMPTS:
+            for size in ((512, 384), (1024, 768), (1568, 1176)):
+                print(json.dumps({'config': name, 'budget': prompts.budget(prompt, context, size, model_id),
+                                  'imageSize': size}))
+        for caching in (False, True):
+            prompts.PROMPT_CACHING = caching
+            print(json.dumps({'config': name, 'modelId': model_id, 'caching': caching,
+                              **run(process_image, images, model_id, args)}))
+    guideline_index.retrieve = retrieve
+    meal_analysis.MODEL_ID = default_model
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+import stubs
+
+# Provisioning of the app's AWS resources (setup_aws_resources.py, then the
+# API of setup_api_gateway.py) against an in-memory account: every API call
+# is counted and takes a simulated round trip, and a new table takes a while
+# to become ACTIVE. Compares a first run with one step at a time against
+# the concurrent engine, then shows that a second run and a plan only read.
+#
+#   python benchmarks/bench_provisioning.py --latency-ms 40 --table-ready-ms 2000
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FUNCTIONS = ['process_image', 'get_user_history', 'get_analysis_status', 'submit_analysis',
+             'create_upload_url', 'get_meal_stats']
+
+WRITE_PREFIXES = ('create', 'put', 'add', 'associate', 'prepare', 'update')
+
+
+def load_setup():
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-west-2')
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    import provisioning
+    import setup_api_gateway
+    import setup_aws_resources
+    return provisioning, setup_aws_resources, setup_api_gateway
+
+
+def fake_account(latency_ms, table_ready_ms):
+    return {
+        's3': stubs.FakeS3(latency_ms=latency_ms),
+        'dynamodb': stubs.FakeDynamoDB(latency_ms=latency_ms, table_ready_ms=table_ready_ms),
+        'cloud': stubs.FakeControlPlane(latency_ms=latency_ms)
+    }
+
+
+def connect(account, provisioning, setup_aws_resources, setup_api_gateway):
+    cloud = account['cloud']
+    setup_aws_resources.s3 = account['s3']
+    setup_aws_resources.dynamodb = account['dynamodb']
+    setup_aws_resources.sqs = cloud.client('sqs')
+    setup_aws_resources.bedrock_agent = cloud.client('bedrock-agent')
+    setup_api_gateway.s3 = account['s3']
+    setup_api_gateway.api_gateway = cloud.client('apigatewayv2')
+    setup_api_gateway.lambda_client = cloud.client('lambda')
+    provisioning.clients['sts'] = cloud.client('sts')
+    provisioning.reset()
+
+
+def api_calls(account):
+    calls = {}
+    for service in ('s3', 'dynamodb'):
+        for operation, count in account[service].calls.items():
+            calls[(service, operation)] = count
+    calls.update(account['cloud'].calls)
+    return calls
+
+
+def run(account, modules, apply, workers):
+    provisioning, setup_aws_resources, setup_api_gateway = modules
+    connect(account, *modules)
+    before = api_calls(account)
+    arns = {name: f"arn:aws:lambda:us-west-2:000000000000:function:{name}" for name in FUNCTIONS}
+    routes = setup_api_gateway.api_routes(arns['process_image'], arns['get_user_history'],
+                                          arns['get_analysis_status'], arns['submit_analysis'],
+                                          arns['create_upload_url'], arns['get_meal_stats'])
+    results = []
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for steps in (setup_aws_resources.build_steps(), setup_api_gateway.api_steps(routes)):
+            results += provisioning.run(steps, apply=apply, workers=workers)[1]
+    wall_ms = (time.perf_counter() - start) * 1000
+
+    after = api_calls(account)
+    used = {key: after[key] - before.get(key, 0) for key in after if after[key] - before.get(key, 0)}
+    actions = {}
+    for result in results:
+        actions[result['action']] = actions.get(result['action'], 0) + 1
+    integrations = sum(len(api['integrations']) for api in account['cloud'].apis.values())
+    return {
+        'wallMs': round(wall_ms, 1),
+        'apiCalls': sum(used.values()),
+        'writes': sum(count for (_, operation), count in used.items() if operation.startswith(WRITE_PREFIXES)),
+        'stsCalls': used.get(('sts', 'get_caller_identity'), 0),
+        'steps': actions,
+        'integrations': integrations
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark concurrent, idempotent provisioning')
+    parser.add_argument('--latency-ms', type=float, default=40, help='Simulated round trip per API call')
+    parser.add_argument('--table-ready-ms', type=float, default=2000, help='Time for a new table to become ACTIVE')
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    modules = load_setup()
+
+    sequential = run(fake_account(args.latency_ms, args.table_ready_ms), modules, True, 1)
+    print(json.dumps({'run': 'first, one step at a time', **sequential}))
+
+    account = fake_account(args.latency_ms, args.table_ready_ms)
+    concurrent = run(account, modules, True, args.workers)
+    print(json.dumps({'run': f"first, {args.workers} workers", **concurrent}))
+    print(json.dumps({'run': 'second (idempotent)', **run(account, modules, True, args.workers)}))
+    print(json.dumps({'run': 'plan on provisioned account', **run(account, modules, False, args.workers)}))
+    empty = fake_account(args.latency_ms, args.table_ready_ms)
+    print(json.dumps({'run': 'plan on empty account', **run(empty, modules, False, args.workers)}))
+    print(json.dumps({'speedup': round(sequential['wallMs'] / concurrent['wallMs'], 2),
+                      'functions': len(FUNCTIONS)}))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+import argparse
+import base64
+import io
+import json
+import os
+import random
+import time
+from contextlib import redirect_stdout
+
+import stubs
+from bench_image_preprocessing import MEDIA_TYPES
+
+# Precision and latency of near-duplicate analysis reuse (similarity_index).
+#
+# Images are labeled by meal: a folder with one subfolder per meal, each
+# holding several photos of it (--images ~/meal-shots), or a synthetic set
+# of plated meals re-shot with small crops, rotations, lighting and JPEG
+# quality changes (--meals, --shots). The first shot of half the meals is
+# indexed; every other shot is a query. A query of an indexed meal should
+# match it, a query of a meal never seen before should match nothing.
+#
+# Reports, per hash and distance threshold, precision (matches that are the
+# right meal), recall (shots of indexed meals that matched) and false reuse
+# (shots of new meals that matched something). Then hashing time,
+# multi-index search against a linear scan for growing indexes, and
+# process_image end
+# to end: model calls and latency with and without similarity reuse.
+#
+#   python benchmarks/bench_similarity.py --meals 40 --shots 5
+#   python benchmarks/bench_similarity.py --images ~/meal-shots
+
+
+def load_labeled(folder):
+    images = []
+    for label in sorted(os.listdir(folder)):
+        path = os.path.join(folder, label)
+        if not os.path.isdir(path):
+            continue
+        for name in sorted(os.listdir(path)):
+            media_type = MEDIA_TYPES.get(os.path.splitext(name)[1].lower())
+            if media_type:
+                with open(os.path.join(path, name), 'rb') as f:
+                    images.append((label, media_type, f.read()))
+    return images
+
+
+def synthetic_meal(rng, width, height):
+    # A plate on a table with a few food items, all from shared palettes so
+    # different meals still look alike
+    from PIL import Image, ImageDraw, ImageFilter
+    table = rng.choice([(120, 85, 60), (200, 190, 170), (60, 60, 65), (235, 235, 230)])
+    img = Image.new('RGB', (width, height), table)
+    draw = ImageDraw.Draw(img)
+    for _ in range(40):
+        x, y = rng.randrange(width), rng.randrange(height)
+        shade = tuple(max(0, min(255, c + rng.randint(-25, 25))) for c in table)
+        draw.line((x, y, x + rng.randint(-80, 80), y + rng.randint(-10, 10)), fill=shade, width=3)
+    margin_x, margin_y = width // 8, height // 10
+    draw.ellipse((margin_x, margin_y, width - margin_x, height - margin_y), fill=(245, 245, 240),
+                 outline=(210, 210, 205), width=6)
+    foods = [(230, 190, 60), (90, 150, 60), (170, 60, 40), (240, 230, 200), (120, 70, 40), (250, 140, 50)]
+    for _ in range(rng.randint(3, 5)):
+        color = rng.choice(foods)
+        cx = rng.randint(width // 4, 3 * width // 4)
+        cy = rng.randint(height // 4, 3 * height // 4)
+        rx, ry = rng.randint(width // 14, width // 7), rng.randint(height // 14, height // 7)
+        draw.ellipse((cx - rx, cy - ry, cx + rx, cy + ry), fill=color)
+        for _ in range(25):
+            px, py = cx + rng.randint(-rx, rx) // 2, cy + rng.randint(-ry, ry) // 2
+            dot = tuple(max(0, min(255, c + rng.randint(-40, 40))) for c in color)
+            draw.ellipse((px - 4, py - 4, px + 4, py + 4), fill=dot)
+    return img.filter(ImageFilter.GaussianBlur(1.5))
+
+
+def reshoot(img, rng):
+    # The same meal photographed again: a slightly different framing, angle,
+    # exposure and encoder
+    from PIL import ImageEnhance
+    width, height = img.size
+    shot = img.rotate(rng.uniform(-5, 5), resample=3, expand=False, fillcolor=img.getpixel((0, 0)))
+    dx, dy = int(width * rng.uniform(0, 0.06)), int(height * rng.uniform(0, 0.06))
+    shot = shot.crop((dx, dy, width - int(width * rng.uniform(0, 0.06)), height - int(height * rng.uniform(0, 0.06))))
+    shot = shot.resize((width, height))
+    shot = ImageEnhance.Brightness(shot).enhance(rng.uniform(0.85, 1.15))
+    shot = ImageEnhance.Contrast(shot).enhance(rng.uniform(0.9, 1.1))
+    out = io.BytesIO()
+    shot.save(out, format='JPEG', quality=rng.randint(70, 95))
+    return out.getvalue()
+
+
+def synthetic_labeled(meals, shots, width=1024, height=768, seed=7):
+    rng = random.Random(seed)
+    images = []
+    for meal in range(meals):
+        base = synthetic_meal(rng, width, height)
+        for _ in range(shots):
+            images.append((f"meal-{meal:03d}", 'image/jpeg', reshoot(base, rng)))
+    return images
+
+
+def evaluate(similarity_index, images, algorithm, thresholds):
+    hashes = []
+    timings = []
+    for label, _, content in images:
+        start = time.perf_counter()
+        hashes.append((label, similarity_index.perceptual_hash(content, algorithm)))
+        timings.append((time.perf_counter() - start) * 1000)
+    labels = sorted({label for label, _ in hashes})
+    indexed = set(labels[::2])
+    gallery = {}
+    queries = []
+    for label, value in hashes:
+        if label in indexed and label not in gallery:
+            gallery[label] = value
+        else:
+            queries.append((label, value))
+
+    index = similarity_index.MultiIndex()
+    for label, value in gallery.items():
+        index.add(value, label)
+    rows = []
+    for threshold in thresholds:
+        correct = wrong = reused_new = 0
+        for label, value in queries:
+            found, _ = index.search(value, threshold)
+            if not found:
+                continue
+            if label not in indexed:
+                reused_new += 1
+            elif found[0][1] == label:
+                correct += 1
+            else:
+                wrong += 1
+        matched = correct + wrong + reused_new
+        known = sum(1 for label, _ in queries if label in indexed)
+        rows.append({
+            'hash': algorithm,
+            'maxDistance': threshold,
+            'precision': round(correct / matched, 3) if matched else None,
+            'recall': round(correct / known, 3) if known else None,
+            'falseReuse': round(reused_new / (len(queries) - known), 3) if len(queries) > known else None
+        })
+    timings.sort()
+    return rows, round(timings[len(timings) // 2], 2)
+
+
+def search_latency(similarity_index, sizes, max_distance, seed=3):
+    # Multi-index search against comparing with every entry, on random
+    # 64-bit hashes
+    rng = random.Random(seed)
+    results = []
+    for size in sizes:
+        values = [rng.getrandbits(64) for _ in range(size)]
+        index = similarity_index.MultiIndex()
+        for value in values:
+            index.add(value, None)
+        queries = [v ^ (1 << rng.randrange(64)) for v in rng.sample(values, 50)]
+        start = time.perf_counter()
+        compared = sum(index.search(q, max_distance)[1] for q in queries)
+        index_us = (time.perf_counter() - start) * 1e6 / len(queries)
+        start = time.perf_counter()
+        for q in queries:
+            [v for v in values if similarity_index.distance(q, v) <= max_distance]
+        scan_us = (time.perf_counter() - start) * 1e6 / len(queries)
+        results.append({'entries': size, 'maxDistance': max_distance, 'multiIndexUs': round(index_us, 1),
+                        'comparedPerSearch': compared // len(queries), 'linearScanUs': round(scan_us, 1)})
+    return results
+
+
+def end_to_end(images, model_ms, s3_ms, enabled):
+    # One user sending every shot in turn, with the exact-bytes cache on
+    process_image = stubs.import_lambda('process_image')
+    meal_analysis = process_image.meal_analysis
+    meal_analysis.analysis_cache.ENABLED = True
+    meal_analysis.analysis_cache._lru.clear()
+    meal_analysis.similarity_index.ENABLED = enabled
+    meal_analysis.s3 = stubs.FakeS3(latency_ms=s3_ms)
+    model = stubs.StubBedrockRuntime(base_ms=model_ms)
+    meal_analysis.bedrock_runtime = model
+    latencies = []
+    reused = 0
+    for label, media_type, content in images:
+        start = time.perf_counter()
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            response = process_image.lambda_handler({'body': json.dumps({
+                'image': f"data:{media_type};base64,{base64.b64encode(content).decode('ascii')}",
+                'userId': f"similarity-user-{enabled}"
+            })}, None)
+        latencies.append((time.perf_counter() - start) * 1000)
+        reused += bool(json.loads(response['body']).get('similarMatch'))
+    latencies.sort()
+    return {'similarity': 'on' if enabled else 'off', 'requests': len(images),
+            'modelCalls': model.calls['invoke_model'], 'reused': reused,
+            'p50Ms': round(latencies[len(latencies) // 2], 1), 'meanMs': round(sum(latencies) / len(latencies), 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark perceptual-hash reuse of meal analyses')
+    parser.add_argument('--images', help='Folder with one subfolder of photos per meal')
+    parser.add_argument('--meals', type=int, default=40)
+    parser.add_argument('--shots', type=int, default=5)
+    parser.add_argument('--thresholds', type=int, nargs='+', default=[2, 4, 6, 8, 10, 12, 14])
+    parser.add_argument('--index-sizes', type=int, nargs='+', default=[500, 5000, 50000])
+    parser.add_argument('--model-ms', type=float, default=400)
+    parser.add_argument('--s3-ms', type=float, default=15)
+    args = parser.parse_args()
+
+    images = load_labeled(args.images) if args.images else synthetic_labeled(args.meals, args.shots)
+    similarity_index = stubs.import_lambda('similarity_index')
+    for algorithm in similarity_index.ALGORITHMS:
+        rows, hash_ms = evaluate(similarity_index, images, algorithm, args.thresholds)
+        for row in rows:
+            print(json.dumps(row))
+        print(json.dumps({'hash': algorithm, 'hashP50Ms': hash_ms}))
+    for max_distance in sorted({similarity_index.MAX_DISTANCE, 8}):
+        for row in search_latency(similarity_index, args.index_sizes, max_distance):
+            print(json.dumps(row))
+    # Shots of a few meals, in the order a user would send them
+    sample = sorted(images[:min(len(images), 4 * args.shots)], key=lambda image: image[0])
+    for enabled in (False, True):
+        print(json.dumps(end_to_end(sample, args.model_ms, args.s3_ms, enabled)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+import argparse
+import base64
+import json
+import os
+import tracemalloc
+import uuid
+
+import stubs
+from bench_image_preprocessing import synthetic_images
+
+# Compares the two ways of getting a photo to process_image: a base64 data
+# URL in the JSON body versus a direct S3 upload referenced by imageKey.
+# Reports API request bytes and peak Python heap during the handler.
+
+
+def measure(handler, event):
+    tracemalloc.start()
+    response = handler(event, None)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    if response['statusCode'] != 200:
+        raise RuntimeError(response['body'])
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark base64 request bodies against presigned uploads')
+    parser.add_argument('--images', type=int, default=3)
+    args = parser.parse_args()
+
+    process_image = stubs.import_lambda('process_image')
+    meal_analysis = process_image.meal_analysis
+    s3 = stubs.FakeS3()
+    meal_analysis.s3 = s3
+    meal_analysis.bedrock_runtime = stubs.StubBedrockRuntime()
+    meal_analysis.analysis_cache.ENABLED = False
+
+    results = {'base64Body': {'requestBytes': 0, 'peakHeapBytes': 0},
+               'imageKey': {'requestBytes': 0, 'peakHeapBytes': 0}}
+    for name, media_type, content in synthetic_images(args.images):
+        body = json.dumps({
+            'image': f"data:{media_type};base64,{base64.b64encode(content).decode('ascii')}",
+            'userId': 'bench-user'
+        })
+        results['base64Body']['requestBytes'] += len(body)
+        results['base64Body']['peakHeapBytes'] = max(
+            results['base64Body']['peakHeapBytes'], measure(process_image.lambda_handler, {'body': body}))
+        del body
+
+        # What the presigned POST would have written
+        image_key = process_image.image_utils.upload_key('bench-user', str(uuid.uuid4()), media_type)
+        s3.put_object(Bucket=meal_analysis.IMAGES_BUCKET, Key=image_key, Body=content, ContentType=media_type)
+        body = json.dumps({'imageKey': image_key, 'userId': 'bench-user'})
+        results['imageKey']['requestBytes'] += len(body)
+        results['imageKey']['peakHeapBytes'] = max(
+            results['imageKey']['peakHeapBytes'], measure(process_image.lambda_handler, {'body': body}))
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
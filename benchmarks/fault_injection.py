@@ -0,0 +1,224 @@
+import argparse
+import base64
+import json
+import random
+import sys
+import time
+
+import stubs
+from bench_image_preprocessing import synthetic_images
+
+# Fault-injection harness for the model invocation layer (model_invoker):
+# drives /analyze-meal requests through process_image against a stubbed
+# Bedrock that throttles, times out or fails on command, and checks how
+# the handler behaves. Each scenario prints one JSON line; the exit status
+# is non-zero if any expectation fails.
+#
+#   python benchmarks/fault_injection.py
+#   python benchmarks/fault_injection.py --scenario outage_with_fallback
+
+FALLBACK = 'stub.fallback-model'
+
+
+class FakeContext:
+    # Lambda context whose remaining time counts down from timeout_ms
+    def __init__(self, timeout_ms):
+        self.aws_request_id = 'fault-injection'
+        self.expires = time.monotonic() + timeout_ms / 1000.0
+
+    def get_remaining_time_in_millis(self):
+        return int((self.expires - time.monotonic()) * 1000)
+
+
+class Harness:
+    def __init__(self, args):
+        self.args = args
+        self.process_image = stubs.import_lambda('process_image')
+        self.meal_analysis = self.process_image.meal_analysis
+        self.invoker = self.process_image.model_invoker
+        self.meal_analysis.analysis_cache.ENABLED = False
+        self.images = synthetic_images(4, width=640, height=480)
+        self.sent = 0
+
+    def reset(self, fallback='', **faults):
+        # Seeded so the retry jitter, like the injected faults, repeats
+        random.seed(5)
+        self.invoker.breakers.clear()
+        self.invoker.FALLBACK_MODEL_ID = fallback
+        self.invoker.MODEL_RETRY_BASE_MS = self.args.retry_base_ms
+        self.invoker.MODEL_MIN_ATTEMPT_MS = self.args.min_attempt_ms
+        self.invoker.CIRCUIT_COOLDOWN_SECONDS = self.args.cooldown_s
+        self.meal_analysis.s3 = stubs.FakeS3()
+        model = stubs.StubBedrockRuntime(base_ms=self.args.model_ms, seed=11, **faults)
+        self.meal_analysis.bedrock_runtime = model
+        return model
+
+    def request(self, timeout_ms=None):
+        # Returns (status, seconds, body, headers)
+        _, media_type, content = self.images[self.sent % len(self.images)]
+        self.sent += 1
+        event = {'body': json.dumps({
+            'image': f"data:{media_type};base64,{base64.b64encode(content).decode('ascii')}",
+            'userId': 'fault-user'
+        })}
+        start = time.perf_counter()
+        response = self.process_image.lambda_handler(event, FakeContext(timeout_ms or self.args.lambda_timeout_ms))
+        return (response['statusCode'], time.perf_counter() - start,
+                json.loads(response['body']), response['headers'])
+
+    def run(self, count, timeout_ms=None):
+        return [self.request(timeout_ms) for _ in range(count)]
+
+
+def summarize(results):
+    seconds = sorted(r[1] for r in results)
+    statuses = {}
+    for status, _, _, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        'statuses': statuses,
+        'p50Ms': round(seconds[len(seconds) // 2] * 1000, 1),
+        'maxMs': round(seconds[-1] * 1000, 1)
+    }
+
+
+def scenario_throttles(h):
+    # Random throttles are absorbed by jittered retries
+    model = h.reset(throttle_rate=0.2)
+    results = h.run(h.args.requests)
+    report = summarize(results)
+    report['throttled'] = model.calls['throttled']
+    checks = {
+        'allSucceeded': report['statuses'] == {'200': len(results)},
+        'retried': model.calls['throttled'] > 0
+    }
+    return report, checks
+
+
+def scenario_timeouts(h):
+    # Occasional timeouts are retried; a request never spends more than its
+    # budget
+    model = h.reset(timeout_rate=0.2, timeout_ms=h.args.timeout_ms)
+    results = h.run(h.args.requests)
+    report = summarize(results)
+    report['timeouts'] = model.calls['timeouts']
+    budget_s = (h.args.lambda_timeout_ms - h.invoker.MODEL_DEADLINE_MARGIN_MS) / 1000.0
+    checks = {
+        'mostSucceeded': report['statuses'].get('200', 0) >= len(results) * 0.9,
+        'withinBudget': max(r[1] for r in results) <= budget_s
+    }
+    return report, checks
+
+
+def scenario_outage(h):
+    # The model fails every call: once the circuit opens, requests fail fast
+    # with 503 + Retry-After and the model stops being called
+    model = h.reset(error_rate=1.0)
+    results = h.run(h.args.requests)
+    report = summarize(results)
+    calls_after_open = model.model_calls.copy()
+    late = h.run(5)
+    fast_ms = max(r[1] for r in late) * 1000
+    report.update({
+        'circuit': h.invoker.breaker(h.meal_analysis.MODEL_ID).stats(),
+        'fastFailMaxMs': round(fast_ms, 1),
+        'retryAfter': late[-1][3].get('Retry-After')
+    })
+    checks = {
+        'no500s': '500' not in report['statuses'],
+        'circuitOpened': report['circuit']['opened'] >= 1,
+        'failsFast': fast_ms < h.args.model_ms * 2 + 200,
+        'modelShielded': model.model_calls == calls_after_open,
+        'retryAfterSet': bool(report['retryAfter']) and late[-1][0] == 503
+    }
+    return report, checks
+
+
+def scenario_outage_with_fallback(h):
+    # Only the primary model is down: requests are served by the fallback,
+    # and once the primary's circuit opens they go straight to it
+    model = h.reset(fallback=FALLBACK, error_rate=1.0, fault_models={h.meal_analysis.MODEL_ID})
+    results = h.run(h.args.requests)
+    report = summarize(results)
+    report['modelCalls'] = dict(model.model_calls)
+    checks = {
+        'allSucceeded': report['statuses'] == {'200': len(results)},
+        'fallbackUsed': model.model_calls[FALLBACK] == len(results),
+        'primaryShielded': model.model_calls[h.meal_analysis.MODEL_ID] < len(results) * h.invoker.MODEL_MAX_ATTEMPTS
+    }
+    return report, checks
+
+
+def scenario_recovery(h):
+    # After the cooldown a single probe goes through; once it succeeds the
+    # circuit closes and traffic flows again
+    model = h.reset(error_rate=1.0)
+    h.run(h.args.requests)
+    opened = h.invoker.breaker(h.meal_analysis.MODEL_ID).stats()['state'] == 'open'
+    model.error_rate = 0.0
+    time.sleep(h.args.cooldown_s)
+    results = h.run(5)
+    report = summarize(results)
+    report['circuit'] = h.invoker.breaker(h.meal_analysis.MODEL_ID).stats()
+    checks = {
+        'opened': opened,
+        'closedAgain': report['circuit']['state'] == 'closed',
+        'allSucceeded': report['statuses'] == {'200': len(results)}
+    }
+    return report, checks
+
+
+def scenario_deadline(h):
+    # Every call hangs for the client's whole read timeout, far past the
+    # budget: the request gives up with a 503 when the budget runs out,
+    # not when the hung call does
+    h.reset(timeout_rate=1.0, timeout_ms=h.args.hang_ms)
+    timeout_ms = h.invoker.MODEL_DEADLINE_MARGIN_MS + h.args.timeout_ms * 2
+    results = h.run(2, timeout_ms)
+    report = summarize(results)
+    checks = {
+        'gaveUp': report['statuses'] == {'503': len(results)},
+        'beforeLambdaTimeout': max(r[1] for r in results) * 1000 < timeout_ms
+    }
+    return report, checks
+
+
+SCENARIOS = {
+    'throttles': scenario_throttles,
+    'timeouts': scenario_timeouts,
+    'outage': scenario_outage,
+    'outage_with_fallback': scenario_outage_with_fallback,
+    'recovery': scenario_recovery,
+    'deadline': scenario_deadline
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fault-injection checks for Bedrock invocation')
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), nargs='+', default=list(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--model-ms', type=float, default=50, help='Stub model latency per call')
+    parser.add_argument('--timeout-ms', type=float, default=300, help='How long a timed-out call hangs')
+    parser.add_argument('--hang-ms', type=float, default=30000,
+                        help='How long a hung call blocks (the client read timeout) in the deadline scenario')
+    parser.add_argument('--lambda-timeout-ms', type=float, default=6000)
+    parser.add_argument('--retry-base-ms', type=float, default=20)
+    parser.add_argument('--min-attempt-ms', type=float, default=200)
+    parser.add_argument('--cooldown-s', type=float, default=0.5)
+    args = parser.parse_args()
+
+    h = Harness(args)
+    failed = []
+    for name in args.scenario:
+        report, checks = SCENARIOS[name](h)
+        passed = all(checks.values())
+        if not passed:
+            failed.append(name)
+        print(json.dumps({'scenario': name, 'passed': passed, 'checks': checks, **report}))
+    if failed:
+        print(f"FAILED: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,285 @@
+import argparse
+import base64
+import hashlib
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+
+import stubs
+from bench_image_preprocessing import synthetic_images
+
+# Load test of the two request paths, POST /analyze-meal (process_image)
+# and GET /meal-history/{userId} (get_user_history), run offline against
+# FakeS3 and a stubbed Bedrock runtime. Requests are sent from a pool of
+# --concurrency threads. Model latency is log-normal around --model-ms,
+# throttles are injected at --throttle-rate, and analysis text lengths are
+# log-normal around --response-chars. Each scenario runs in its own
+# interpreter, so peak RSS is that scenario's alone.
+#
+# analyze runs with MODEL_ROUTING=single (stubs.DEFAULT_ENV); analyze-tiered
+# runs the default tiered routing, with a fast model at 40% of --model-ms
+# that keeps a confident answer for 70% of the images and escalates the
+# rest to the full model.
+#
+# Reports p50/p95/p99 latency, throughput, peak RSS, and S3 calls per
+# request. baselines/load_test.json keeps the last accepted numbers.
+# --check fails when a scenario regresses past --tolerance, or makes more
+# S3 calls per request. --update-baseline records the current run; commit
+# the result with the change that caused it.
+#
+#   python benchmarks/load_test.py --concurrency 8 --requests 200
+#   python benchmarks/load_test.py --check
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines', 'load_test.json')
+SCENARIOS = ('analyze', 'analyze-tiered', 'history')
+
+# Settings that change the numbers; a baseline only compares against a run
+# with the same ones
+WORKLOAD_SETTINGS = ('concurrency', 'requests', 's3_ms', 'model_ms', 'model_sigma', 'throttle_rate',
+                     'response_chars', 'response_sigma', 'images', 'history_users', 'history_meals',
+                     'page_size', 'seed')
+
+WORDS = ('grilled chicken brown rice broccoli salmon quinoa avocado spinach lentils oats yogurt berries '
+         'almonds olive oil sweet potato whole grain fiber protein balanced portion vegetables').split()
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def analysis_text(rng, lock, mean_chars, sigma):
+    # Model answer of log-normally distributed length around mean_chars
+    with lock:
+        chars = int(mean_chars * rng.lognormvariate(0, sigma))
+        words = [rng.choice(WORDS) for _ in range(max(1, chars // 7))]
+    return 'Meal analysis: ' + ' '.join(words)
+
+
+def seed_history(store, users, meals, rng):
+    # meals records per user, shaped like meal_analysis saves them; every
+    # thumbnail is different, so they compress like real ones
+    start = datetime(2024, 1, 1)
+    records = []
+    for u in range(users):
+        for m in range(meals):
+            records.append({
+                'userId': f"load-user-{u}",
+                'imageId': f"meal-{m:05d}",
+                'timestamp': (start + timedelta(hours=8 * m)).isoformat(),
+                'imageKey': f"load-user-{u}/meal-{m:05d}.jpg",
+                'imageContentType': 'image/jpeg',
+                'feedback': ' '.join(rng.choice(WORDS) for _ in range(350)),
+                'thumbnailBase64': f"data:image/jpeg;base64,{base64.b64encode(rng.randbytes(6000)).decode('ascii')}",
+                'cacheHit': False,
+                'scores': {'nutrition': 7, 'balance': 6, 'health': 7, 'sustainability': 8}
+            })
+    store.put_many(records)
+
+
+# Triage block of the fast model's answer
+TRIAGE = ('\n\n```json\n{"ingredients": ["chicken", "rice"], "scores": {"nutrition": 7, "balance": 6, '
+          '"health": 7, "sustainability": 6}, "alternatives": [], "confidence": %s, "complexity": "%s"}\n```')
+
+
+def tiered_text(rng, lock, args, fast_model_id):
+    def text(model_id, body):
+        prose = analysis_text(rng, lock, args.response_chars, args.response_sigma)
+        if model_id != fast_model_id:
+            return prose
+        # The image decides, so a retry gets the same triage
+        image = json.loads(body)['messages'][0]['content'][0]['source']['data']
+        simple = int(hashlib.sha256(image.encode('ascii')).hexdigest(), 16) % 10 < 7
+        return prose + (TRIAGE % (0.9, 'simple') if simple else TRIAGE % (0.55, 'complex'))
+    return text
+
+
+def analyze_scenario(args, routing='single'):
+    process_image = stubs.import_lambda('process_image')
+    meal_analysis = process_image.meal_analysis
+    meal_analysis.analysis_cache.ENABLED = False
+    router = meal_analysis.model_router
+    router.ROUTING_MODE = routing
+    s3 = stubs.FakeS3(latency_ms=args.s3_ms)
+    meal_analysis.s3 = s3
+    rng = random.Random(args.seed)
+    lock = threading.Lock()
+    if routing == 'tiered':
+        text = tiered_text(rng, lock, args, router.FAST_MODEL_ID)
+    else:
+        text = lambda model_id, body: analysis_text(rng, lock, args.response_chars, args.response_sigma)
+    meal_analysis.bedrock_runtime = stubs.StubBedrockRuntime(
+        base_ms=args.model_ms, latency_sigma=args.model_sigma, throttle_rate=args.throttle_rate,
+        seed=args.seed, text=text, model_ms={router.FAST_MODEL_ID: args.model_ms * 0.4})
+    images = [f"data:{media_type};base64,{base64.b64encode(content).decode('ascii')}"
+              for _, media_type, content in synthetic_images(args.images, width=1024, height=768)]
+
+    def request(number):
+        return process_image.lambda_handler({'body': json.dumps({
+            'image': images[number % len(images)],
+            'userId': f"load-user-{number % 16}"
+        })}, None)
+    return s3, request
+
+
+def history_scenario(args):
+    get_user_history = stubs.import_lambda('get_user_history')
+    store = get_user_history.meal_store.S3MealStore(stubs.FakeS3(), get_user_history.FEEDBACK_BUCKET,
+                                                    get_user_history.executor)
+    seed_history(store, args.history_users, args.history_meals, random.Random(args.seed))
+    # Seeding is free; requests pay the S3 round trip
+    s3 = store.s3
+    s3.latency_ms = args.s3_ms
+    s3.calls.clear()
+    get_user_history.s3 = s3
+
+    def request(number):
+        return get_user_history.lambda_handler({
+            'pathParameters': {'userId': f"load-user-{number % args.history_users}"},
+            'queryStringParameters': {'limit': str(args.page_size)}
+        }, None)
+    return s3, request
+
+
+def run_scenario(name, args):
+    # Runs in the child interpreter; returns the scenario's result
+    s3, request = {'analyze': analyze_scenario, 'analyze-tiered': lambda a: analyze_scenario(a, 'tiered'),
+                   'history': history_scenario}[name](args)
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    response_bytes = []
+
+    def timed(number):
+        start = time.perf_counter()
+        response = request(number)
+        ms = (time.perf_counter() - start) * 1000
+        with lock:
+            latencies.append(ms)
+            statuses[response['statusCode']] = statuses.get(response['statusCode'], 0) + 1
+            response_bytes.append(len(response['body']))
+
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        # One warm-up request per worker: cold-start costs are measured by
+        # bench_cold_start.py, not here
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            list(executor.map(request, range(args.concurrency)))
+        latencies.clear()
+        s3.calls.clear()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            list(executor.map(timed, range(args.requests)))
+        seconds = time.perf_counter() - start
+
+    s3_calls = sum(s3.calls.values())
+    return {
+        'scenario': name,
+        'requests': args.requests,
+        'statusCodes': {str(code): count for code, count in sorted(statuses.items())},
+        'p50Ms': round(percentile(latencies, 0.5), 1),
+        'p95Ms': round(percentile(latencies, 0.95), 1),
+        'p99Ms': round(percentile(latencies, 0.99), 1),
+        'throughputRps': round(args.requests / seconds, 1),
+        # ru_maxrss is in KiB on Linux
+        'peakRssMb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'meanResponseBytes': round(sum(response_bytes) / len(response_bytes)),
+        's3CallsPerRequest': round(s3_calls / args.requests, 2),
+        's3Calls': dict(sorted(s3.calls.items()))
+    }
+
+
+def run_child(name, argv):
+    result = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', name] + argv,
+                            capture_output=True, text=True)
+    if result.returncode:
+        raise RuntimeError(f"{name} failed:\n{result.stderr.strip()}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def regressions(result, baseline, tolerance):
+    problems = []
+    for metric in ('p50Ms', 'p95Ms', 'p99Ms', 'peakRssMb'):
+        if result[metric] > baseline[metric] * (1 + tolerance):
+            problems.append(f"{metric} {result[metric]} > {baseline[metric]} + {tolerance:.0%}")
+    if result['throughputRps'] < baseline['throughputRps'] * (1 - tolerance):
+        problems.append(f"throughputRps {result['throughputRps']} < {baseline['throughputRps']} - {tolerance:.0%}")
+    # S3 calls only vary with retried conditional index writes: more than
+    # that is a change in the access path
+    if result['s3CallsPerRequest'] > baseline['s3CallsPerRequest'] * 1.02:
+        problems.append(f"s3CallsPerRequest {result['s3CallsPerRequest']} > {baseline['s3CallsPerRequest']}")
+    if result['statusCodes'] != baseline['statusCodes']:
+        problems.append(f"statusCodes {result['statusCodes']} != {baseline['statusCodes']}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline load test of the analyze and history handlers')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--s3-ms', type=float, default=15, help='Simulated S3 round trip')
+    parser.add_argument('--model-ms', type=float, default=400, help='Median stub model latency')
+    parser.add_argument('--model-sigma', type=float, default=0.3, help='Log-normal spread of model latency')
+    parser.add_argument('--throttle-rate', type=float, default=0.02)
+    parser.add_argument('--response-chars', type=int, default=2500, help='Median analysis length')
+    parser.add_argument('--response-sigma', type=float, default=0.4)
+    parser.add_argument('--images', type=int, default=12, help='Distinct photos sent to analyze')
+    parser.add_argument('--history-users', type=int, default=20)
+    parser.add_argument('--history-meals', type=int, default=300, help='Meals per user')
+    parser.add_argument('--page-size', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=11)
+    parser.add_argument('--check', action='store_true', help='Fail on regressions against the baseline')
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.3, help='Allowed slowdown for timings and RSS')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_scenario(args.child, args)))
+        return
+
+    settings = {name: getattr(args, name) for name in WORKLOAD_SETTINGS}
+    argv = [a for a in sys.argv[1:] if a not in ('--check', '--update-baseline')]
+    try:
+        with open(BASELINE_PATH, encoding='utf-8') as f:
+            baselines = json.load(f)
+    except FileNotFoundError:
+        baselines = {}
+
+    failed = False
+    for name in args.scenarios:
+        result = run_child(name, argv)
+        print(json.dumps(result))
+        baseline = baselines.get(name)
+        if args.check:
+            if not baseline or baseline['settings'] != settings:
+                print(f"{name}: no baseline recorded with these settings")
+                failed = True
+                continue
+            problems = regressions(result, baseline['result'], args.tolerance)
+            for problem in problems:
+                print(f"{name} regressed: {problem}")
+            failed = failed or bool(problems)
+        if args.update_baseline:
+            baselines[name] = {'settings': settings, 'result': result}
+
+    if args.update_baseline:
+        os.makedirs(os.path.dirname(BASELINE_PATH), exist_ok=True)
+        with open(BASELINE_PATH, 'w', encoding='utf-8') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"Baseline written to {BASELINE_PATH}")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,884 @@
+import hashlib
+import io
+import json
+import os
+import random
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+# In-memory stand-ins for the AWS clients used by the Lambda functions, so
+# the handlers can be benchmarked without an AWS account. Errors mimic
+# botocore's ClientError shape (e.response['Error']['Code']).
+
+
+class StubClientError(Exception):
+    def __init__(self, code, operation):
+        super().__init__(f"An error occurred ({code}) when calling the {operation} operation")
+        self.response = {'Error': {'Code': code, 'Message': code}}
+
+
+class ReadTimeoutError(Exception):
+    # Named like botocore's exception, which carries no error code
+    pass
+
+
+class FakeS3:
+    # ETags are the MD5 of the body, as S3 gives single-part uploads. Bucket
+    # operations (for the setup scripts) only apply to buckets created here;
+    # object operations work on any bucket name.
+    def __init__(self, latency_ms=0):
+        self.objects = {}
+        self.buckets = {}
+        self.calls = Counter()
+        self.latency_ms = latency_ms
+        self._lock = threading.Lock()
+
+    def _call(self, operation):
+        with self._lock:
+            self.calls[operation] += 1
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0)
+
+    def put_object(self, Bucket, Key, Body, ContentType=None, IfMatch=None, IfNoneMatch=None, **kwargs):
+        self._call('put_object')
+        if isinstance(Body, str):
+            Body = Body.encode('utf-8')
+        elif hasattr(Body, 'read'):
+            Body = Body.read()
+        with self._lock:
+            existing = self.objects.get((Bucket, Key))
+            if IfNoneMatch == '*' and existing is not None:
+                raise StubClientError('PreconditionFailed', 'PutObject')
+            if IfMatch is not None and (existing is None or existing['ETag'] != IfMatch):
+                raise StubClientError('PreconditionFailed', 'PutObject')
+            etag = f'"{hashlib.md5(bytes(Body)).hexdigest()}"'
+            self.objects[(Bucket, Key)] = {
+                'Body': bytes(Body),
+                'ETag': etag,
+                'ContentType': ContentType,
+                'LastModified': datetime.now(timezone.utc)
+            }
+        return {'ETag': etag}
+
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        self._call('get_object')
+        obj = self.objects.get((Bucket, Key))
+        if obj is None:
+            raise StubClientError('NoSuchKey', 'GetObject')
+        body = obj['Body']
+        if Range:
+            # Only the 'bytes=first-last' form
+            first, last = Range[len('bytes='):].split('-')
+            body = body[int(first):int(last) + 1]
+        return {
+            'Body': io.BytesIO(body),
+            'ETag': obj['ETag'],
+            'ContentType': obj['ContentType'],
+            'ContentLength': len(body),
+            'LastModified': obj['LastModified']
+        }
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self._call('head_object')
+        obj = self.objects.get((Bucket, Key))
+        if obj is None:
+            raise StubClientError('404', 'HeadObject')
+        return {
+            'ETag': obj['ETag'],
+            'ContentType': obj['ContentType'],
+            'ContentLength': len(obj['Body']),
+            'LastModified': obj['LastModified']
+        }
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self._call('delete_object')
+        with self._lock:
+            self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def delete_objects(self, Bucket, Delete, **kwargs):
+        self._call('delete_objects')
+        with self._lock:
+            for item in Delete['Objects']:
+                self.objects.pop((Bucket, item['Key']), None)
+        return {}
+
+    def list_objects_v2(self, Bucket, Prefix='', ContinuationToken=None, MaxKeys=1000, **kwargs):
+        self._call('list_objects_v2')
+        keys = sorted(k for (b, k) in list(self.objects) if b == Bucket and k.startswith(Prefix))
+        if ContinuationToken:
+            keys = [k for k in keys if k > ContinuationToken]
+        page = keys[:MaxKeys]
+        response = {
+            'KeyCount': len(page),
+            'IsTruncated': len(keys) > MaxKeys,
+            'Contents': [{
+                'Key': k,
+                'Size': len(self.objects[(Bucket, k)]['Body']),
+                'ETag': self.objects[(Bucket, k)]['ETag'],
+                'LastModified': self.objects[(Bucket, k)]['LastModified']
+            } for k in page]
+        }
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = page[-1]
+        return response
+
+    def get_paginator(self, operation):
+        return _Paginator(getattr(self, operation), 'ContinuationToken', 'NextContinuationToken')
+
+    def head_bucket(self, Bucket, **kwargs):
+        self._call('head_bucket')
+        if Bucket not in self.buckets:
+            raise StubClientError('404', 'HeadBucket')
+        return {}
+
+    def create_bucket(self, Bucket, **kwargs):
+        self._call('create_bucket')
+        with self._lock:
+            if Bucket in self.buckets:
+                raise StubClientError('BucketAlreadyOwnedByYou', 'CreateBucket')
+            self.buckets[Bucket] = {}
+        return {'Location': f"/{Bucket}"}
+
+    def _bucket_config(self, operation, Bucket, name, value=None, missing=None):
+        self._call(operation)
+        if Bucket not in self.buckets:
+            raise StubClientError('NoSuchBucket', operation)
+        if value is not None:
+            self.buckets[Bucket][name] = value
+            return {}
+        if name not in self.buckets[Bucket]:
+            if missing:
+                raise StubClientError(missing, operation)
+            return {}
+        return self.buckets[Bucket][name]
+
+    def put_bucket_cors(self, Bucket, CORSConfiguration, **kwargs):
+        return self._bucket_config('put_bucket_cors', Bucket, 'cors', CORSConfiguration)
+
+    def get_bucket_lifecycle_configuration(self, Bucket, **kwargs):
+        return self._bucket_config('get_bucket_lifecycle_configuration', Bucket, 'lifecycle',
+                                   missing='NoSuchLifecycleConfiguration')
+
+    def put_bucket_lifecycle_configuration(self, Bucket, LifecycleConfiguration, **kwargs):
+        return self._bucket_config('put_bucket_lifecycle_configuration', Bucket, 'lifecycle',
+                                   LifecycleConfiguration)
+
+    def get_bucket_notification_configuration(self, Bucket, **kwargs):
+        return self._bucket_config('get_bucket_notification_configuration', Bucket, 'notification')
+
+    def put_bucket_notification_configuration(self, Bucket, NotificationConfiguration, **kwargs):
+        return self._bucket_config('put_bucket_notification_configuration', Bucket, 'notification',
+                                   NotificationConfiguration)
+
+    def generate_presigned_url(self, ClientMethod, Params=None, ExpiresIn=3600, **kwargs):
+        Params = Params or {}
+        return f"https://{Params.get('Bucket')}.s3.local/{Params.get('Key')}?X-Amz-Expires={ExpiresIn}"
+
+
+    def generate_presigned_post(self, Bucket, Key, Fields=None, Conditions=None, ExpiresIn=3600, **kwargs):
+        return {'url': f"https://{Bucket}.s3.local/", 'fields': {**(Fields or {}), 'key': Key}}
+
+
+class _Paginator:
+    def __init__(self, call, token_param, token_field):
+        self.call = call
+        self.token_param = token_param
+        self.token_field = token_field
+
+    def paginate(self, **kwargs):
+        while True:
+            page = self.call(**kwargs)
+            yield page
+            if not page.get(self.token_field):
+                return
+            kwargs[self.token_param] = page[self.token_field]
+
+
+class FakeDynamoDB:
+    # Low-level DynamoDB client stand-in: items are stored in DynamoDB JSON
+    # ({'S': ...}, {'N': ...}). Supports the key-condition, projection and
+    # paging subset the Lambda functions use. Like DynamoDB Local, tables
+    # must be created first (or passed as {table: (hash_key, range_key)}).
+    def __init__(self, tables=None, latency_ms=0, table_ready_ms=0):
+        self.key_schema = dict(tables or {})
+        self.items = {name: {} for name in self.key_schema}
+        self.ttl = {}
+        self.calls = Counter()
+        self.latency_ms = latency_ms
+        self.table_ready_ms = table_ready_ms
+        self._lock = threading.Lock()
+
+    def _call(self, operation, table):
+        with self._lock:
+            self.calls[operation] += 1
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0)
+        if table not in self.key_schema:
+            raise StubClientError('ResourceNotFoundException', operation)
+
+    def create_table(self, TableName, KeySchema, **kwargs):
+        if TableName in self.key_schema:
+            raise StubClientError('ResourceInUseException', 'CreateTable')
+        with self._lock:
+            self.calls['create_table'] += 1
+        hash_key = next(k['AttributeName'] for k in KeySchema if k['KeyType'] == 'HASH')
+        range_key = next((k['AttributeName'] for k in KeySchema if k['KeyType'] == 'RANGE'), None)
+        self.key_schema[TableName] = (hash_key, range_key)
+        self.items.setdefault(TableName, {})
+        return {'TableDescription': {'TableName': TableName, 'TableStatus': 'ACTIVE'}}
+
+    def describe_table(self, TableName, **kwargs):
+        self._call('describe_table', TableName)
+        return {'Table': {'TableName': TableName, 'TableStatus': 'ACTIVE'}}
+
+    def describe_time_to_live(self, TableName, **kwargs):
+        self._call('describe_time_to_live', TableName)
+        return {'TimeToLiveDescription': self.ttl.get(TableName, {'TimeToLiveStatus': 'DISABLED'})}
+
+    def update_time_to_live(self, TableName, TimeToLiveSpecification, **kwargs):
+        self._call('update_time_to_live', TableName)
+        self.ttl[TableName] = {'TimeToLiveStatus': 'ENABLED' if TimeToLiveSpecification['Enabled'] else 'DISABLED',
+                               'AttributeName': TimeToLiveSpecification['AttributeName']}
+        return {'TimeToLiveSpecification': TimeToLiveSpecification}
+
+    def get_waiter(self, name):
+        # table_exists: new tables take table_ready_ms to become ACTIVE
+        fake = self
+
+        class Waiter:
+            def wait(self, TableName, **kwargs):
+                time.sleep(fake.table_ready_ms / 1000.0)
+                fake.describe_table(TableName=TableName)
+        return Waiter()
+
+    @staticmethod
+    def _value(typed):
+        if 'N' in typed:
+            from decimal import Decimal
+            return Decimal(typed['N'])
+        return next(iter(typed.values()))
+
+    def _key(self, table, item):
+        hash_key, range_key = self.key_schema[table]
+        return (self._value(item[hash_key]), self._value(item[range_key]) if range_key else None)
+
+    def _condition(self, item, expression, names, values):
+        # The condition subset the Lambda functions use: OR of ANDs of
+        # attribute_(not_)exists(a) and comparisons of an attribute with a
+        # value
+        if not expression:
+            return True
+        names = names or {}
+        for alternative in expression.split(' OR '):
+            holds = True
+            for term in alternative.split(' AND '):
+                term = term.strip()
+                function = term.partition('(')
+                if function[0] in ('attribute_exists', 'attribute_not_exists'):
+                    present = names.get(function[2].rstrip(')').strip(), function[2].rstrip(')').strip()) in item
+                    holds = present if function[0] == 'attribute_exists' else not present
+                else:
+                    name, op, value = term.split()
+                    name = names.get(name, name)
+                    if name not in item:
+                        holds = False
+                    else:
+                        current, other = self._value(item[name]), self._value(values[value])
+                        holds = {'=': current == other, '<>': current != other, '<': current < other,
+                                 '<=': current <= other, '>': current > other, '>=': current >= other}[op]
+                if not holds:
+                    break
+            if holds:
+                return True
+        return False
+
+    def _check(self, operation, item, kwargs):
+        # Raises ConditionalCheckFailedException like DynamoDB, with the old
+        # item when ReturnValuesOnConditionCheckFailure asks for it
+        if not self._condition(item or {}, kwargs.get('ConditionExpression'),
+                               kwargs.get('ExpressionAttributeNames'), kwargs.get('ExpressionAttributeValues')):
+            error = StubClientError('ConditionalCheckFailedException', operation)
+            if item and kwargs.get('ReturnValuesOnConditionCheckFailure') == 'ALL_OLD':
+                error.response['Item'] = dict(item)
+            raise error
+
+    def put_item(self, TableName, Item, **kwargs):
+        self._call('put_item', TableName)
+        key = self._key(TableName, Item)
+        with self._lock:
+            self._check('PutItem', self.items[TableName].get(key), kwargs)
+            self.items[TableName][key] = dict(Item)
+        return {}
+
+    def update_item(self, TableName, Key, UpdateExpression, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, **kwargs):
+        # SET clauses only, each "a = operand" or "a = operand +|- operand"
+        self._call('update_item', TableName)
+        names = ExpressionAttributeNames or {}
+        values = ExpressionAttributeValues or {}
+        if not UpdateExpression.startswith('SET '):
+            raise StubClientError('ValidationException', 'UpdateItem')
+        key = self._key(TableName, Key)
+        with self._lock:
+            old = self.items[TableName].get(key)
+            self._check('UpdateItem', old, {'ExpressionAttributeNames': names,
+                                            'ExpressionAttributeValues': values, **kwargs})
+            item = dict(old or Key)
+
+            def operand(token):
+                return self._value(values[token]) if token.startswith(':') else self._value(item[names.get(token, token)])
+            for assignment in UpdateExpression[4:].split(','):
+                target, _, expression = assignment.partition('=')
+                parts = expression.split()
+                value = operand(parts[0])
+                if len(parts) == 3:
+                    value = value + operand(parts[2]) if parts[1] == '+' else value - operand(parts[2])
+                if isinstance(value, str):
+                    item[names.get(target.strip(), target.strip())] = {'S': value}
+                else:
+                    item[names.get(target.strip(), target.strip())] = {'N': str(value)}
+            self.items[TableName][key] = item
+        return {}
+
+    def delete_item(self, TableName, Key, **kwargs):
+        self._call('delete_item', TableName)
+        key = self._key(TableName, Key)
+        with self._lock:
+            self._check('DeleteItem', self.items[TableName].get(key), kwargs)
+            self.items[TableName].pop(key, None)
+        return {}
+
+    def get_item(self, TableName, Key, ProjectionExpression=None, ExpressionAttributeNames=None, **kwargs):
+        self._call('get_item', TableName)
+        item = self.items[TableName].get(self._key(TableName, Key))
+        if item is None:
+            return {}
+        return {'Item': self._project(item, ProjectionExpression, ExpressionAttributeNames)}
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        for table, requests in RequestItems.items():
+            self._call('batch_write_item', table)
+            if len(requests) > 25:
+                raise StubClientError('ValidationException', 'BatchWriteItem')
+            with self._lock:
+                for request in requests:
+                    if 'PutRequest' in request:
+                        item = request['PutRequest']['Item']
+                        self.items[table][self._key(table, item)] = dict(item)
+                    else:
+                        self.items[table].pop(self._key(table, request['DeleteRequest']['Key']), None)
+        return {'UnprocessedItems': {}}
+
+    @staticmethod
+    def _project(item, expression, names):
+        if not expression:
+            return dict(item)
+        fields = [(names or {}).get(f.strip(), f.strip()) for f in expression.split(',')]
+        return {f: item[f] for f in fields if f in item}
+
+    def query(self, TableName, KeyConditionExpression, ExpressionAttributeValues, ExpressionAttributeNames=None,
+              ScanIndexForward=True, Limit=None, ExclusiveStartKey=None, ProjectionExpression=None, **kwargs):
+        import re
+        self._call('query', TableName)
+        names = ExpressionAttributeNames or {}
+        tests = []
+        for name, op, first, second in re.findall(
+                r'(#?\w+)\s*(=|>=|<=|<|>|BETWEEN)\s*(:\w+)(?:\s+AND\s+(:\w+))?', KeyConditionExpression):
+            attribute = names.get(name, name)
+            low = self._value(ExpressionAttributeValues[first])
+            high = self._value(ExpressionAttributeValues[second]) if second else None
+            tests.append((attribute, op, low, high))
+
+        def matches(item):
+            for attribute, op, low, high in tests:
+                if attribute not in item:
+                    return False
+                value = self._value(item[attribute])
+                if not {'=': value == low, '>=': value >= low, '<=': value <= low, '<': value < low,
+                        '>': value > low, 'BETWEEN': high is not None and low <= value <= high}[op]:
+                    return False
+            return True
+
+        with self._lock:
+            found = sorted((k, item) for k, item in self.items[TableName].items() if matches(item))
+        if not ScanIndexForward:
+            found.reverse()
+        if ExclusiveStartKey:
+            start = self._key(TableName, ExclusiveStartKey)
+            found = [(k, item) for k, item in found if (k > start if ScanIndexForward else k < start)]
+        response = {}
+        if Limit is not None and len(found) >= Limit:
+            # DynamoDB returns a LastEvaluatedKey whenever Limit stops the query
+            found = found[:Limit]
+            hash_key, range_key = self.key_schema[TableName]
+            last = found[-1][1]
+            response['LastEvaluatedKey'] = {k: last[k] for k in (hash_key, range_key) if k}
+        response['Items'] = [self._project(item, ProjectionExpression, names) for _, item in found]
+        response['Count'] = len(response['Items'])
+        return response
+
+
+class StubBedrockRuntime:
+    # Simulated latency is base_ms plus per_mb_ms for every MB of request body,
+    # a rough stand-in for upload time and image input tokens. Throttling is
+    # injected with max_concurrency (calls beyond it get ThrottlingException,
+    # like a concurrency quota) and throttle_rate (random throttles). Other
+    # faults: timeout_rate (the call hangs for timeout_ms, then raises
+    # ReadTimeoutError) and error_rate (InternalServerException). With
+    # fault_models set, faults only hit those model ids. Rates can be changed
+    # between calls to script an outage and its recovery. model_ms overrides
+    # base_ms per model id, and text may be a function (model_id, body) ->
+    # text to answer differently per model or image. latency_sigma spreads
+    # the base latency over a log-normal distribution with that median.
+    #
+    # Usage counts text at ~4 characters per token plus image_tokens per
+    # image. System blocks marked with cache_control (at least
+    # min_cache_tokens long) are cache writes on first use and cache reads
+    # afterwards, like Bedrock prompt caching; prefill_ms_per_ktok adds
+    # latency for every 1000 input tokens not read from the cache.
+    def __init__(self, base_ms=0, per_mb_ms=0, text='Stub analysis', output_tokens=300,
+                 max_concurrency=None, throttle_rate=0.0, seed=None, timeout_rate=0.0,
+                 timeout_ms=1000, error_rate=0.0, fault_models=None, model_ms=None,
+                 image_tokens=1500, min_cache_tokens=0, prefill_ms_per_ktok=0, latency_sigma=0.0):
+        self.base_ms = base_ms
+        self.latency_sigma = latency_sigma
+        self.per_mb_ms = per_mb_ms
+        self.text = text
+        self.output_tokens = output_tokens
+        self.max_concurrency = max_concurrency
+        self.throttle_rate = throttle_rate
+        self.timeout_rate = timeout_rate
+        self.timeout_ms = timeout_ms
+        self.error_rate = error_rate
+        self.fault_models = fault_models
+        self.model_ms = model_ms or {}
+        self.image_tokens = image_tokens
+        self.min_cache_tokens = min_cache_tokens
+        self.prefill_ms_per_ktok = prefill_ms_per_ktok
+        self.prompt_cache = set()
+        self.calls = Counter()
+        self.model_calls = Counter()
+        # (model_id, 'input' | 'output') -> tokens reported in usage
+        self.tokens = Counter()
+        self.request_bytes = []
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+
+    def _admit(self, operation, model_id):
+        with self._lock:
+            self.model_calls[model_id] += 1
+            faulty = self.fault_models is None or model_id in self.fault_models
+            if ((self.max_concurrency is not None and self.in_flight >= self.max_concurrency)
+                    or (faulty and self._random.random() < self.throttle_rate)):
+                self.calls['throttled'] += 1
+                raise StubClientError('ThrottlingException', operation)
+            timeout = faulty and self._random.random() < self.timeout_rate
+            error = faulty and not timeout and self._random.random() < self.error_rate
+        if timeout:
+            self.calls['timeouts'] += 1
+            time.sleep(self.timeout_ms / 1000.0)
+            raise ReadTimeoutError(f"Read timeout on endpoint URL for {operation}")
+        if error:
+            self.calls['errors'] += 1
+            raise StubClientError('InternalServerException', operation)
+        with self._lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def invoke_model(self, modelId, body, **kwargs):
+        with self._lock:
+            self.calls['invoke_model'] += 1
+            self.request_bytes.append(len(body))
+        self._admit('InvokeModel', modelId)
+        usage = self._usage(modelId, body)
+        try:
+            time.sleep(self._latency_ms(modelId, body, usage) / 1000.0)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+        response_body = {
+            'id': 'msg_stub',
+            'model': modelId,
+            'content': [{'type': 'text', 'text': self._text(modelId, body)}],
+            'stop_reason': 'end_turn',
+            'usage': usage
+        }
+        return {'body': io.BytesIO(json.dumps(response_body).encode('utf-8'))}
+
+    def invoke_model_with_response_stream(self, modelId, body, chunk_ms=20, chunks=20, **kwargs):
+        # Emits the text in `chunks` deltas; base latency is time to first token
+        with self._lock:
+            self.calls['invoke_model_with_response_stream'] += 1
+            self.request_bytes.append(len(body))
+        self._admit('InvokeModelWithResponseStream', modelId)
+        with self._lock:
+            self.in_flight -= 1
+        usage = self._usage(modelId, body)
+        text = self._text(modelId, body)
+        size = max(1, len(text) // chunks)
+        pieces = [text[i:i + size] for i in range(0, len(text), size)]
+
+        def events():
+            time.sleep(self._latency_ms(modelId, body, usage) / 1000.0)
+            yield self._chunk({'type': 'message_start', 'message': {
+                'model': modelId, 'usage': {**usage, 'output_tokens': 1}}})
+            for piece in pieces:
+                yield self._chunk({'type': 'content_block_delta', 'index': 0,
+                                   'delta': {'type': 'text_delta', 'text': piece}})
+                time.sleep(chunk_ms / 1000.0)
+            yield self._chunk({'type': 'message_delta', 'delta': {'stop_reason': 'end_turn'},
+                               'usage': {'output_tokens': self.output_tokens}})
+            yield self._chunk({'type': 'message_stop'})
+
+        return {'body': events()}
+
+    def _usage(self, model_id, body):
+        request = json.loads(body)
+        system = request.get('system') or []
+        if isinstance(system, str):
+            system = [{'type': 'text', 'text': system}]
+        text_chars = 0
+        images = 0
+        for message in request.get('messages', []):
+            for block in message.get('content', []):
+                if block.get('type') == 'image':
+                    images += 1
+                else:
+                    text_chars += len(block.get('text', ''))
+        usage = {'input_tokens': text_chars // 4 + images * self.image_tokens, 'output_tokens': self.output_tokens}
+        cached = 0
+        prefix = ''
+        for block in system:
+            prefix += block.get('text', '')
+            if block.get('cache_control') and len(prefix) // 4 >= self.min_cache_tokens:
+                cached = len(prefix) // 4
+        usage['input_tokens'] += len(prefix) // 4 - cached
+        if cached:
+            key = (model_id, prefix[:cached * 4])
+            with self._lock:
+                hit = key in self.prompt_cache
+                self.prompt_cache.add(key)
+            usage['cache_read_input_tokens' if hit else 'cache_creation_input_tokens'] = cached
+        with self._lock:
+            self.tokens[(model_id, 'input')] += usage['input_tokens']
+            self.tokens[(model_id, 'output')] += usage['output_tokens']
+            self.tokens[(model_id, 'cacheRead')] += usage.get('cache_read_input_tokens', 0)
+            self.tokens[(model_id, 'cacheWrite')] += usage.get('cache_creation_input_tokens', 0)
+        return usage
+
+    def _latency_ms(self, model_id, body, usage=None):
+        prefill = 0
+        if usage:
+            uncached = usage['input_tokens'] + usage.get('cache_creation_input_tokens', 0)
+            prefill = self.prefill_ms_per_ktok * uncached / 1000
+        base = self.model_ms.get(model_id, self.base_ms)
+        if self.latency_sigma:
+            with self._lock:
+                base *= self._random.lognormvariate(0, self.latency_sigma)
+        return base + self.per_mb_ms * len(body) / 1e6 + prefill
+
+    def _text(self, model_id, body):
+        return self.text(model_id, body) if callable(self.text) else self.text
+
+    @staticmethod
+    def _chunk(payload):
+        return {'chunk': {'bytes': json.dumps(payload).encode('utf-8')}}
+
+
+def hashed_embedding(text, dim=256):
+    # Stand-in for an embedding model: hashed word and character-trigram
+    # counts, L2-normalized. Deterministic, no model needed.
+    import hashlib
+    import math
+    import re
+    vector = [0.0] * dim
+    for word in re.findall(r'[a-z]+', text.lower()):
+        features = [word] + [word[i:i + 3] for i in range(len(word) - 2)]
+        for feature in features:
+            bucket = int(hashlib.md5(feature.encode('utf-8')).hexdigest(), 16) % dim
+            vector[bucket] += 1.0 if feature == word else 0.3
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+class StubKnowledgeBase:
+    # bedrock-agent-runtime stand-in: retrieve() ranks documents by cosine
+    # similarity of embed(query) and embed(document), after latency_ms
+    # (plus up to jitter_ms) to simulate the network round trip
+    def __init__(self, documents, latency_ms=0, jitter_ms=0, embed=hashed_embedding, seed=None):
+        self.documents = documents
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.embed = embed
+        self.vectors = [embed(f"{d['title']} {d['content']}") for d in documents]
+        self.calls = Counter()
+        self._random = random.Random(seed)
+
+    def retrieve(self, knowledgeBaseId, retrievalQuery, retrievalConfiguration=None, **kwargs):
+        self.calls['retrieve'] += 1
+        time.sleep((self.latency_ms + self._random.uniform(0, self.jitter_ms)) / 1000.0)
+        k = (retrievalConfiguration or {}).get('vectorSearchConfiguration', {}).get('numberOfResults', 5)
+        query = self.embed(retrievalQuery['text'])
+        scored = sorted(((sum(a * b for a, b in zip(query, vector)), i) for i, vector in enumerate(self.vectors)),
+                        reverse=True)[:k]
+        return {'retrievalResults': [{
+            'content': {'text': self.documents[i]['content']},
+            'location': {'type': 'S3', 's3Location': {'uri': f"s3://kb/guideline_{i + 1}.txt"}},
+            'metadata': {'title': self.documents[i]['title']},
+            'score': round(score, 4)
+        } for score, i in scored]}
+
+
+class StubLambda:
+    # Runs 'Event' invocations inline through the given handler
+    def __init__(self, handler=None):
+        self.handler = handler
+        self.calls = Counter()
+
+    def invoke(self, FunctionName, Payload, InvocationType='RequestResponse', **kwargs):
+        self.calls['invoke'] += 1
+        result = self.handler(json.loads(Payload), None) if self.handler else None
+        return {'StatusCode': 202 if InvocationType == 'Event' else 200,
+                'Payload': io.BytesIO(json.dumps(result).encode('utf-8'))}
+
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda_functions')
+
+DEFAULT_ENV = {
+    'IMAGES_BUCKET': 'bench-images',
+    'FEEDBACK_BUCKET': 'bench-feedback',
+    'AGENT_ID': 'bench-agent',
+    'AGENT_ALIAS_ID': 'bench-alias',
+    'AWS_DEFAULT_REGION': 'us-west-2',
+    # One model call per image unless a benchmark measures routing itself
+    'MODEL_ROUTING': 'single',
+    # Admission control needs its table; bench_admission.py turns it on
+    # against a FakeDynamoDB
+    'ADMISSION_ENABLED': 'false'
+}
+
+
+def import_lambda(name, env=None):
+    # Import a handler module from lambda_functions/ with the environment it
+    # expects; callers then swap its clients for stubs
+    import importlib
+    import sys
+    for key, value in {**DEFAULT_ENV, **(env or {})}.items():
+        os.environ.setdefault(key, value)
+    if LAMBDA_DIR not in sys.path:
+        sys.path.insert(0, LAMBDA_DIR)
+    return importlib.import_module(name)
+
+
+class StubSQS:
+    # SQS stand-in: messages sent here can be drained as Lambda SQS events
+    def __init__(self):
+        self.messages = []
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        self._next_id = 0
+
+    def send_message(self, QueueUrl, MessageBody, **kwargs):
+        with self._lock:
+            self.calls['send_message'] += 1
+            self._next_id += 1
+            message_id = f"msg-{self._next_id}"
+            self.messages.append({'messageId': message_id, 'body': MessageBody, 'receiveCount': 0})
+        return {'MessageId': message_id}
+
+    def receive_event(self, batch_size=10):
+        # Next batch in the shape of a Lambda SQS event; messages stay queued
+        # until acknowledged with ack(), like a visibility timeout
+        with self._lock:
+            batch = self.messages[:batch_size]
+            for message in batch:
+                message['receiveCount'] += 1
+        return {'Records': [{
+            'messageId': m['messageId'],
+            'body': m['body'],
+            'attributes': {'ApproximateReceiveCount': str(m['receiveCount'])},
+            'eventSource': 'aws:sqs'
+        } for m in batch]}
+
+    def ack(self, event, response):
+        # Deletes every message of the batch that was not reported as failed
+        failed = {f['itemIdentifier'] for f in response.get('batchItemFailures', [])}
+        done = {r['messageId'] for r in event['Records']} - failed
+        with self._lock:
+            self.messages = [m for m in self.messages if m['messageId'] not in done]
+        return len(done)
+
+
+class FakeControlPlane:
+    # Control-plane stand-in for the setup scripts: SQS queues, Bedrock
+    # agent versions, knowledge bases and aliases, STS, API Gateway v2 and
+    # Lambda permissions and event source mappings of one in-memory account.
+    # client(service) returns that service's client; calls are counted per
+    # (service, operation) and each takes latency_ms, like a round trip to a
+    # regional endpoint. S3 and DynamoDB are FakeS3 and FakeDynamoDB.
+    def __init__(self, latency_ms=0, account='000000000000', region='us-west-2'):
+        self.latency_ms = latency_ms
+        self.account = account
+        self.region = region
+        self.calls = Counter()
+        self.queues = {}
+        self.agent_versions = [{'agentVersion': '1', 'status': 'PREPARED'}]
+        self.agent_knowledge_bases = set()
+        self.agent_aliases = {}
+        self.apis = {}
+        self.policies = {}
+        self.event_source_mappings = []
+        self._lock = threading.Lock()
+        self._next_id = 0
+
+    def client(self, service):
+        return _FakeService(self, service)
+
+    def _call(self, service, operation):
+        with self._lock:
+            self.calls[(service, operation)] += 1
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0)
+
+    def _id(self, prefix=''):
+        with self._lock:
+            self._next_id += 1
+            return f"{prefix}{self._next_id:06d}"
+
+    # sqs
+    def sqs_get_queue_url(self, QueueName, **kwargs):
+        if QueueName not in self.queues:
+            raise StubClientError('AWS.SimpleQueueService.NonExistentQueue', 'GetQueueUrl')
+        return {'QueueUrl': self.queues[QueueName]['QueueUrl']}
+
+    def sqs_create_queue(self, QueueName, Attributes=None, **kwargs):
+        with self._lock:
+            queue = self.queues.setdefault(QueueName, {
+                'QueueUrl': f"https://sqs.{self.region}.amazonaws.com/{self.account}/{QueueName}",
+                'QueueArn': f"arn:aws:sqs:{self.region}:{self.account}:{QueueName}",
+                'Attributes': dict(Attributes or {})
+            })
+        return {'QueueUrl': queue['QueueUrl']}
+
+    def sqs_get_queue_attributes(self, QueueUrl, AttributeNames=(), **kwargs):
+        queue = next(q for q in self.queues.values() if q['QueueUrl'] == QueueUrl)
+        return {'Attributes': {'QueueArn': queue['QueueArn'], **queue['Attributes']}}
+
+    # bedrock-agent
+    def bedrock_agent_list_agent_versions(self, agentId, **kwargs):
+        return {'agentVersionSummaries': list(self.agent_versions)}
+
+    def bedrock_agent_prepare_agent(self, agentId, **kwargs):
+        return {'agentId': agentId, 'agentStatus': 'PREPARING'}
+
+    def bedrock_agent_list_agent_knowledge_bases(self, agentId, agentVersion, **kwargs):
+        return {'agentKnowledgeBaseSummaries': [
+            {'knowledgeBaseId': kb} for (agent, version, kb) in self.agent_knowledge_bases
+            if (agent, version) == (agentId, agentVersion)]}
+
+    def bedrock_agent_associate_agent_knowledge_base(self, agentId, agentVersion, knowledgeBaseId, **kwargs):
+        self.agent_knowledge_bases.add((agentId, agentVersion, knowledgeBaseId))
+        return {}
+
+    def bedrock_agent_list_agent_aliases(self, agentId, **kwargs):
+        return {'agentAliasSummaries': [{'agentAliasName': name, 'agentAliasId': alias_id}
+                                        for name, alias_id in self.agent_aliases.items()]}
+
+    def bedrock_agent_create_agent_alias(self, agentId, agentAliasName, **kwargs):
+        self.agent_aliases[agentAliasName] = self._id('ALIAS')
+        return {'agentAlias': {'agentAliasId': self.agent_aliases[agentAliasName]}}
+
+    # sts
+    def sts_get_caller_identity(self, **kwargs):
+        return {'Account': self.account}
+
+    # apigatewayv2
+    def apigatewayv2_get_apis(self, **kwargs):
+        return {'Items': [{'ApiId': api_id, 'Name': api['Name'], 'CorsConfiguration': api['cors']}
+                          for api_id, api in self.apis.items()]}
+
+    def apigatewayv2_create_api(self, Name, CorsConfiguration=None, **kwargs):
+        api_id = self._id('api')
+        self.apis[api_id] = {'Name': Name, 'cors': CorsConfiguration or {}, 'integrations': {}, 'routes': {},
+                             'stages': set()}
+        return {'ApiId': api_id}
+
+    def apigatewayv2_update_api(self, ApiId, CorsConfiguration=None, **kwargs):
+        if CorsConfiguration is not None:
+            self.apis[ApiId]['cors'] = CorsConfiguration
+        return {'ApiId': ApiId}
+
+    def apigatewayv2_get_integrations(self, ApiId, **kwargs):
+        return {'Items': [{'IntegrationId': integration_id, 'IntegrationUri': uri}
+                          for integration_id, uri in self.apis[ApiId]['integrations'].items()]}
+
+    def apigatewayv2_create_integration(self, ApiId, IntegrationUri, **kwargs):
+        integration_id = self._id('int')
+        self.apis[ApiId]['integrations'][integration_id] = IntegrationUri
+        return {'IntegrationId': integration_id}
+
+    def apigatewayv2_get_routes(self, ApiId, **kwargs):
+        return {'Items': [dict(route) for route in self.apis[ApiId]['routes'].values()]}
+
+    def apigatewayv2_create_route(self, ApiId, RouteKey, Target=None, **kwargs):
+        routes = self.apis[ApiId]['routes']
+        if any(route['RouteKey'] == RouteKey for route in routes.values()):
+            raise StubClientError('ConflictException', 'CreateRoute')
+        route_id = self._id('route')
+        routes[route_id] = {'RouteId': route_id, 'RouteKey': RouteKey, 'Target': Target}
+        return {'RouteId': route_id}
+
+    def apigatewayv2_update_route(self, ApiId, RouteId, Target=None, **kwargs):
+        self.apis[ApiId]['routes'][RouteId]['Target'] = Target
+        return {'RouteId': RouteId}
+
+    def apigatewayv2_get_stages(self, ApiId, **kwargs):
+        return {'Items': [{'StageName': name} for name in self.apis[ApiId]['stages']]}
+
+    def apigatewayv2_create_stage(self, ApiId, StageName, **kwargs):
+        self.apis[ApiId]['stages'].add(StageName)
+        return {'StageName': StageName}
+
+    # lambda
+    def lambda_get_policy(self, FunctionName, **kwargs):
+        if not self.policies.get(FunctionName):
+            raise StubClientError('ResourceNotFoundException', 'GetPolicy')
+        return {'Policy': json.dumps({'Statement': [{'Sid': sid} for sid in self.policies[FunctionName]]})}
+
+    def lambda_add_permission(self, FunctionName, StatementId, **kwargs):
+        with self._lock:
+            statements = self.policies.setdefault(FunctionName, set())
+            if StatementId in statements:
+                raise StubClientError('ResourceConflictException', 'AddPermission')
+            statements.add(StatementId)
+        return {}
+
+    def lambda_list_event_source_mappings(self, EventSourceArn=None, FunctionName=None, **kwargs):
+        return {'EventSourceMappings': [m for m in self.event_source_mappings
+                                        if m['EventSourceArn'] == EventSourceArn
+                                        and m['FunctionArn'] == FunctionName]}
+
+    def lambda_create_event_source_mapping(self, EventSourceArn, FunctionName, **kwargs):
+        mapping = {'UUID': self._id('esm'), 'EventSourceArn': EventSourceArn, 'FunctionArn': FunctionName}
+        self.event_source_mappings.append(mapping)
+        return mapping
+
+
+class _FakeService:
+    # client.operation(...) -> FakeControlPlane.<service>_<operation>(...)
+    def __init__(self, cloud, service):
+        self.cloud = cloud
+        self.service = service
+
+    def __getattr__(self, operation):
+        handler = getattr(self.cloud, f"{self.service.replace('-', '_')}_{operation}")
+
+        def call(**kwargs):
+            self.cloud._call(self.service, operation)
+            return handler(**kwargs)
+        return call
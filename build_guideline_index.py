@@ -0,0 +1,60 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+
+# Share the index format with the Lambda functions
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lambda_functions')
+sys.path.insert(0, LAMBDA_DIR)
+import guideline_index
+
+# Builds the BM25 index of the nutrition guidelines that process_image
+# searches in-process (GUIDELINE_RETRIEVAL=local), and writes it next to the
+# Lambda code so it ships in the deployment package. Run it whenever the
+# guidelines change. The corpus is nutrition_guidelines.json (the documents
+# setup_aws_resources.py uploads to the knowledge base bucket), or the .txt
+# documents in that bucket with --bucket.
+def load_from_bucket(bucket, prefix=''):
+    import boto3
+    s3 = boto3.client('s3')
+    documents = []
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+        for item in page.get('Contents', []):
+            if not item['Key'].endswith('.txt'):
+                continue
+            obj = s3.get_object(Bucket=bucket, Key=item['Key'])
+            documents.append({
+                'title': obj.get('Metadata', {}).get('title') or item['Key'],
+                'content': obj['Body'].read().decode('utf-8')
+            })
+    return documents
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the in-Lambda nutrition guideline index')
+    parser.add_argument('--corpus', default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                         'nutrition_guidelines.json'))
+    parser.add_argument('--bucket', help='Read the .txt documents of this knowledge base bucket instead')
+    parser.add_argument('--output', default=os.path.join(LAMBDA_DIR, 'guideline_index.json'))
+    args = parser.parse_args()
+
+    if args.bucket:
+        documents = load_from_bucket(args.bucket)
+    else:
+        with open(args.corpus, encoding='utf-8') as f:
+            documents = json.load(f)
+    documents.sort(key=lambda d: d['title'])
+
+    # Content hash as version: identical corpora give identical artifacts
+    corpus = json.dumps(documents, sort_keys=True).encode('utf-8')
+    version = hashlib.sha256(corpus).hexdigest()[:12]
+    index = guideline_index.build_index(documents, version)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(index, f, separators=(',', ':'), sort_keys=True)
+    print(f"Indexed {len(documents)} documents as {len(index['passages'])} passages, "
+          f"{len(index['postings'])} terms, version {version}: "
+          f"{os.path.getsize(args.output)} bytes written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import boto3
+import json
+import os
+import sys
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+# Share the segment format with the Lambda functions
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lambda_functions'))
+import feedback_segments
+
+# Initialize clients
+s3 = boto3.client('s3')
+
+# Rolls each user's meal records older than --older-than-days into monthly
+# segment files (see lambda_functions/feedback_segments.py) and deletes the
+# small objects they replace. History reads merge segments with the recent
+# records, so this can run at any time, e.g. nightly; a user saving meals
+# meanwhile is handled by the index's conditional write, and a re-run picks
+# up whatever a previous one skipped.
+def list_users(feedback_bucket):
+    # Top-level prefixes; the ones starting with _ are caches and job state
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=feedback_bucket, Delimiter='/'):
+        for prefix in page.get('CommonPrefixes', []):
+            user_id = prefix['Prefix'].rstrip('/')
+            if not user_id.startswith('_'):
+                yield user_id
+
+def main():
+    parser = argparse.ArgumentParser(description='Compact older meal records into per-user segment files')
+    parser.add_argument('--feedback-bucket', default='healthy-meal-feedback-bucket')
+    parser.add_argument('--older-than-days', type=int, default=feedback_segments.COMPACT_AFTER_DAYS)
+    parser.add_argument('--user', action='append', help='Only compact this user (repeatable)')
+    parser.add_argument('--workers', type=int, default=8, help='Concurrent record reads per user')
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    cutoff = (datetime.utcnow() - timedelta(days=args.older_than_days)).isoformat()
+    totals = {'users': 0, 'compacted': 0, 'segments': 0, 'deleted': 0, 'failed': 0}
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        for user_id in args.user or list_users(args.feedback_bucket):
+            try:
+                summary = feedback_segments.compact_user(s3, args.feedback_bucket, user_id, cutoff,
+                                                         executor, args.dry_run)
+            except Exception as e:
+                totals['failed'] += 1
+                print(f"Error compacting {user_id}: {e}")
+                continue
+            totals['users'] += 1
+            for field in ('compacted', 'segments', 'deleted'):
+                totals[field] += summary[field]
+            if summary['compacted']:
+                print(json.dumps(summary))
+
+    print(f"\n{'Would compact' if args.dry_run else 'Compacted'}: {json.dumps(totals)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import random
+import threading
+import time
+
+import history_index
+
+# Concurrency limit for calls to a throttled service (Bedrock), adjusted
+# the way TCP adjusts its window: every success raises the limit by a
+# fraction of a slot, every throttle halves it and the call is retried
+# after a jittered exponential backoff. A batch then settles near the
+# throughput the account's quota allows instead of hammering it.
+
+# Error codes that mean "slow down" rather than "this request is wrong"
+THROTTLE_CODES = ('ThrottlingException', 'TooManyRequestsException', 'ServiceUnavailableException',
+                  'ModelNotReadyException', 'RequestLimitExceeded', 'ProvisionedThroughputExceededException')
+
+
+def is_throttle(e):
+    return history_index.error_code(e) in THROTTLE_CODES
+
+
+class AdaptiveLimiter:
+    def __init__(self, max_concurrency, min_concurrency=1, base_delay=0.5, max_delay=20.0, max_attempts=6):
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.limit = float(max_concurrency)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.in_flight = 0
+        self.throttles = 0
+        self.retries = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout=None):
+        # Takes a slot; False if none freed up within timeout seconds
+        end = time.monotonic() + timeout if timeout is not None else None
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                remaining = end - time.monotonic() if end is not None else None
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            self.in_flight += 1
+            return True
+
+    def release(self, throttled):
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self.throttles += 1
+                self.limit = max(float(self.min_concurrency), self.limit / 2)
+            else:
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+    def backoff(self, attempt):
+        # Full jitter: uniform in [0, base * 2^attempt], capped
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, fn, *args, **kwargs):
+        # One call within the limit, no retry; a throttle lowers the limit
+        self.acquire()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            self.release(is_throttle(e))
+            raise
+        self.release(False)
+        return result
+
+    def record_retry(self):
+        # For callers that retry around call() themselves (model_invoker)
+        with self._cond:
+            self.retries += 1
+
+    def run(self, fn, *args, **kwargs):
+        # Calls fn within the limit, retrying throttled calls
+        for attempt in range(self.max_attempts):
+            try:
+                return self.call(fn, *args, **kwargs)
+            except Exception as e:
+                if not is_throttle(e) or attempt == self.max_attempts - 1:
+                    raise
+                self.record_retry()
+                time.sleep(self.backoff(attempt))
+
+    def stats(self):
+        with self._cond:
+            return {
+                'concurrencyLimit': round(self.limit, 2),
+                'throttles': self.throttles,
+                'retries': self.retries
+            }
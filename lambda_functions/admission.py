@@ -0,0 +1,355 @@
+import os
+import random
+import threading
+import time
+
+import aws_clients
+import history_index
+import model_invoker
+
+# Admission control for /analyze-meal, enforced before any work is done:
+#
+#   per user    a token bucket of USER_BURST tokens refilled at
+#               USER_RATE_PER_MINUTE; an analysis costs one token (a batch
+#               one per item), and an empty bucket is a 429 with the time
+#               until the next token as Retry-After
+#   global      at most MAX_MODEL_IN_FLIGHT requests or jobs holding model
+#               calls across every container; a request waits up to
+#               ADMISSION_MAX_WAIT_MS for a slot, then gets a 429. Jobs
+#               (POST /analysis, streamed requests, upload events) pay the
+#               user's token when submitted and take their slot in the
+#               worker, around the model work (hold)
+#
+# Both live in ADMISSION_TABLE (partition key pk, sort key sk), so every
+# container sees the same counters, and only need conditional writes: no
+# read-modify-write races, no transactions. DYNAMODB_ENDPOINT_URL points
+# the client at DynamoDB Local; benchmarks use stubs.FakeDynamoDB.
+#
+# The bucket is stored as its theoretical arrival time (GCRA): the instant
+# it will be full again. A request is admitted while that instant is at
+# most a full bucket ahead of now, and moves it by its cost. An idle user
+# takes one UpdateItem, a user inside a burst two.
+#
+# A global slot is a lease item (sk slot#NN) that expires after the
+# invocation, so a timed-out or crashed invocation can't leak capacity. A
+# model call abandoned at the deadline (model_invoker) is still running on
+# Bedrock: the slot is released once that call returns, and the lease
+# outlasts the deadline by the client's read timeout to cover it.
+# Slots are claimed with a conditional PutItem on a random slot, and only
+# when that one is taken does the request read the slots with one Query.
+#
+# The limiter fails open: if the table can't be reached, requests are
+# admitted and the decision is logged as 'unavailable'.
+ENABLED = os.environ.get('ADMISSION_ENABLED', 'true').lower() == 'true'
+ADMISSION_TABLE = os.environ.get('ADMISSION_TABLE', 'healthy-meal-admission')
+USER_RATE_PER_MINUTE = float(os.environ.get('USER_RATE_PER_MINUTE', '6'))
+USER_BURST = int(os.environ.get('USER_BURST', '10'))
+MAX_MODEL_IN_FLIGHT = int(os.environ.get('MAX_MODEL_IN_FLIGHT', '16'))
+ADMISSION_MAX_WAIT_MS = int(os.environ.get('ADMISSION_MAX_WAIT_MS', '2000'))
+ADMISSION_POLL_MS = int(os.environ.get('ADMISSION_POLL_MS', '100'))
+# Retry-After when every slot stays busy for the whole wait
+OVER_CAPACITY_RETRY_SECONDS = int(os.environ.get('OVER_CAPACITY_RETRY_SECONDS', '2'))
+# Analysis jobs (queue worker, upload events, streamed requests) have no
+# client waiting on the response, so they wait longer for a slot
+ADMISSION_JOB_MAX_WAIT_MS = int(os.environ.get('ADMISSION_JOB_MAX_WAIT_MS', '20000'))
+
+GLOBAL_KEY = 'inflight'
+
+dynamodb = aws_clients.lazy(
+    'dynamodb',
+    prewarm=ENABLED,
+    endpoint_url=os.environ.get('DYNAMODB_ENDPOINT_URL') or None,
+    connect_timeout=2,
+    read_timeout=2,
+    retries={'max_attempts': 2}
+)
+
+# Per-container decision counters, like analysis_cache.stats
+stats = {
+    'admitted': 0,
+    'rateLimited': 0,
+    'overCapacity': 0,
+    'unavailable': 0
+}
+_stats_lock = threading.Lock()
+
+
+class AdmissionRejected(Exception):
+    # Raised by admit(); callers map it to a 429 with Retry-After
+    def __init__(self, message, reason, retry_after=1):
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after = max(1, int(retry_after + 0.999))
+
+
+def is_conflict(e):
+    return history_index.error_code(e) == 'ConditionalCheckFailedException'
+
+
+class CounterStore:
+    # Token buckets and lease slots in one DynamoDB table. Times are epoch
+    # milliseconds; ttl (epoch seconds) lets DynamoDB TTL delete idle items.
+    def __init__(self, dynamodb, table):
+        self.dynamodb = dynamodb
+        self.table = table
+
+    def _update(self, key, update, condition, values):
+        return self.dynamodb.update_item(
+            TableName=self.table,
+            Key={'pk': {'S': key}, 'sk': {'S': 'bucket'}},
+            UpdateExpression=update,
+            ConditionExpression=condition,
+            ExpressionAttributeNames={'#tat': 'tat', '#ttl': 'ttl'},
+            ExpressionAttributeValues={name: {'N': str(value)} for name, value in values.items()},
+            ReturnValuesOnConditionCheckFailure='ALL_OLD'
+        )
+
+    def take(self, key, cost, rate_per_minute, burst, now_ms=None):
+        # Takes cost tokens from the bucket at key; returns 0 when admitted,
+        # otherwise the milliseconds until there are enough
+        now = int(now_ms if now_ms is not None else time.time() * 1000)
+        interval = 60000.0 / rate_per_minute
+        cost = min(cost, burst)
+        limit = now + int((burst - cost) * interval)
+        step = int(cost * interval)
+        ttl = (now + int(burst * interval)) // 1000 + 60
+        for _ in range(2):
+            # Bucket idle long enough to be full: restart from now
+            try:
+                self._update(key, 'SET #tat = :tat, #ttl = :ttl',
+                             'attribute_not_exists(#tat) OR #tat <= :now',
+                             {':tat': now + step, ':ttl': ttl, ':now': now})
+                return 0
+            except Exception as e:
+                if not is_conflict(e):
+                    raise
+            # Inside a burst: admitted while a full bucket ahead at most
+            try:
+                self._update(key, 'SET #tat = #tat + :step, #ttl = :ttl',
+                             '#tat > :now AND #tat <= :limit',
+                             {':step': step, ':ttl': ttl, ':now': now, ':limit': limit})
+                return 0
+            except Exception as e:
+                if not is_conflict(e):
+                    raise
+                tat = int(e.response.get('Item', {}).get('tat', {}).get('N', limit + interval))
+            if tat > now:
+                return tat - limit
+            # The bucket refilled between the two writes
+        return int(interval)
+
+    def refund(self, key, cost, rate_per_minute, burst):
+        # Gives back tokens take() charged to a request that was then
+        # turned away for lack of a global slot
+        step = int(min(cost, burst) * 60000.0 / rate_per_minute)
+        try:
+            self.dynamodb.update_item(
+                TableName=self.table,
+                Key={'pk': {'S': key}, 'sk': {'S': 'bucket'}},
+                UpdateExpression='SET #tat = #tat - :step',
+                ConditionExpression='attribute_exists(#tat)',
+                ExpressionAttributeNames={'#tat': 'tat'},
+                ExpressionAttributeValues={':step': {'N': str(step)}}
+            )
+        except Exception as e:
+            if not is_conflict(e):
+                raise
+
+    def claim(self, slot, owner, lease_until, now):
+        # Conditional put on a free or expired slot; False if it is taken
+        try:
+            self.dynamodb.put_item(
+                TableName=self.table,
+                Item={'pk': {'S': GLOBAL_KEY}, 'sk': {'S': f"slot#{slot:04d}"}, 'owner': {'S': owner},
+                      'leaseUntil': {'N': str(lease_until)}, 'ttl': {'N': str(lease_until // 1000 + 60)}},
+                ConditionExpression='attribute_not_exists(#lease) OR #lease < :now',
+                ExpressionAttributeNames={'#lease': 'leaseUntil'},
+                ExpressionAttributeValues={':now': {'N': str(now)}}
+            )
+            return True
+        except Exception as e:
+            if not is_conflict(e):
+                raise
+            return False
+
+    def busy_slots(self, now):
+        # Slots held by a live lease, from one Query
+        response = self.dynamodb.query(
+            TableName=self.table,
+            KeyConditionExpression='#pk = :pk',
+            ExpressionAttributeNames={'#pk': 'pk', '#sk': 'sk', '#lease': 'leaseUntil'},
+            ExpressionAttributeValues={':pk': {'S': GLOBAL_KEY}},
+            ProjectionExpression='#sk, #lease',
+            ConsistentRead=True
+        )
+        return {int(item['sk']['S'].split('#')[1]) for item in response.get('Items', [])
+                if int(item['leaseUntil']['N']) >= now}
+
+    def release(self, slot, owner):
+        # Only the lease's owner frees it; an expired lease may already be
+        # someone else's
+        try:
+            self.dynamodb.delete_item(
+                TableName=self.table,
+                Key={'pk': {'S': GLOBAL_KEY}, 'sk': {'S': f"slot#{slot:04d}"}},
+                ConditionExpression='#owner = :owner',
+                ExpressionAttributeNames={'#owner': 'owner'},
+                ExpressionAttributeValues={':owner': {'S': owner}}
+            )
+        except Exception as e:
+            if not is_conflict(e):
+                raise
+
+    def acquire(self, count, capacity, owner, lease_ms, max_wait_ms, poll_ms):
+        # Claims count slots out of capacity. Returns (slots, waited_ms);
+        # slots is empty when they didn't free up within max_wait_ms.
+        start = time.monotonic()
+        # Usually a random slot is free, which saves the Query
+        candidates = [random.randrange(capacity)] if count == 1 else None
+        while True:
+            now = int(time.time() * 1000)
+            crowded = False
+            if candidates is None:
+                busy = self.busy_slots(now)
+                candidates = [slot for slot in range(capacity) if slot not in busy]
+                random.shuffle(candidates)
+                crowded = len(candidates) < count
+            held = []
+            for slot in candidates:
+                if len(held) == count:
+                    break
+                if self.claim(slot, owner, now + lease_ms, now):
+                    held.append(slot)
+            waited = (time.monotonic() - start) * 1000
+            if len(held) == count:
+                return held, waited
+            # Never wait holding part of the slots: two batches doing that
+            # could starve each other
+            for slot in held:
+                self.release(slot, owner)
+            if waited >= max_wait_ms:
+                return [], waited
+            if crowded:
+                time.sleep(min(poll_ms, max_wait_ms - waited) / 1000.0)
+            # Otherwise other requests won the free slots: look again
+            candidates = None
+
+
+store = CounterStore(dynamodb, ADMISSION_TABLE)
+
+
+class Ticket:
+    # Slots held by an admitted request; release() frees them
+    def __init__(self, owner=None, slots=()):
+        self.owner = owner
+        self.slots = list(slots)
+
+    def release(self, pending=()):
+        # pending: threads of model calls abandoned at the deadline
+        # (Deadline.pending()); the slots stay held until they finish
+        pending = [thread for thread in pending if thread.is_alive()]
+        if pending and self.slots:
+            threading.Thread(target=self._release_after, args=(pending,), name='admission-release',
+                             daemon=True).start()
+            return
+        slots, self.slots = self.slots, []
+        for slot in slots:
+            try:
+                store.release(slot, self.owner)
+            except Exception as e:
+                # The lease expires on its own
+                print(f"Could not release admission slot {slot}: {e}")
+
+    def _release_after(self, pending):
+        for thread in pending:
+            thread.join()
+        self.release()
+
+
+def count(decision):
+    with _stats_lock:
+        stats[decision] += 1
+
+
+def lease_ms(context=None):
+    # A slot is held until neither the invocation nor a model call it
+    # abandoned at the deadline can still be running
+    return (int(model_invoker.deadline_for(context).budget_ms) + model_invoker.MODEL_DEADLINE_MARGIN_MS
+            + model_invoker.MODEL_READ_TIMEOUT_SECONDS * 1000)
+
+
+def _owner(context):
+    # Unique per request even when request ids repeat (local runs)
+    return f"{getattr(context, 'aws_request_id', None) or 'local'}:{random.getrandbits(48):012x}"
+
+
+def admit(user_id, metrics, cost=1, slots=1, context=None):
+    # Checks the user's bucket, then claims slots global slots (0 when the
+    # model runs elsewhere, e.g. a queued job). Returns a Ticket to release
+    # when the request is done; raises AdmissionRejected.
+    if not ENABLED:
+        metrics.set_property('admission', 'disabled')
+        return Ticket()
+    owner = _owner(context)
+    try:
+        with metrics.stage('admission'):
+            wait_ms = store.take(f"user#{user_id}", cost, USER_RATE_PER_MINUTE, USER_BURST)
+            held, queued_ms = ([], 0.0)
+            if not wait_ms and slots:
+                held, queued_ms = store.acquire(min(slots, MAX_MODEL_IN_FLIGHT), MAX_MODEL_IN_FLIGHT, owner,
+                                                lease_ms(context), ADMISSION_MAX_WAIT_MS, ADMISSION_POLL_MS)
+    except Exception as e:
+        print(f"Admission check failed, admitting: {e}")
+        count('unavailable')
+        metrics.set_property('admission', 'unavailable')
+        return Ticket()
+
+    metrics.set('admissionQueueMs', queued_ms, 'Milliseconds')
+    metrics.set('rateLimited', int(bool(wait_ms)))
+    metrics.set('overCapacity', int(not wait_ms and bool(slots) and not held))
+    if wait_ms:
+        count('rateLimited')
+        metrics.set_property('admission', 'rateLimited')
+        raise AdmissionRejected(f"Rate limit exceeded for {user_id}", 'rateLimited', wait_ms / 1000.0)
+    if slots and not held:
+        # Not served, so not charged
+        try:
+            store.refund(f"user#{user_id}", cost, USER_RATE_PER_MINUTE, USER_BURST)
+        except Exception as e:
+            print(f"Could not refund rate limit tokens for {user_id}: {e}")
+        count('overCapacity')
+        metrics.set_property('admission', 'overCapacity')
+        raise AdmissionRejected('Too many analyses in progress', 'overCapacity', OVER_CAPACITY_RETRY_SECONDS)
+    count('admitted')
+    metrics.set_property('admission', 'admitted')
+    return Ticket(owner, held)
+
+
+def hold(metrics, context=None):
+    # One global slot for an analysis job, whose user was charged when it
+    # was submitted. Returns a Ticket to release when the model work is
+    # done; raises AdmissionRejected when no slot frees up within
+    # ADMISSION_JOB_MAX_WAIT_MS. Fails open like admit().
+    if not ENABLED:
+        metrics.set_property('admission', 'disabled')
+        return Ticket()
+    owner = _owner(context)
+    try:
+        with metrics.stage('admission'):
+            held, queued_ms = store.acquire(1, MAX_MODEL_IN_FLIGHT, owner, lease_ms(context),
+                                            ADMISSION_JOB_MAX_WAIT_MS, ADMISSION_POLL_MS)
+    except Exception as e:
+        print(f"Admission check failed, admitting: {e}")
+        count('unavailable')
+        metrics.set_property('admission', 'unavailable')
+        return Ticket()
+
+    metrics.set('admissionQueueMs', queued_ms, 'Milliseconds')
+    metrics.set('overCapacity', int(not held))
+    if not held:
+        count('overCapacity')
+        metrics.set_property('admission', 'overCapacity')
+        raise AdmissionRejected('Too many analyses in progress', 'overCapacity', OVER_CAPACITY_RETRY_SECONDS)
+    count('admitted')
+    metrics.set_property('admission', 'admitted')
+    return Ticket(owner, held)
@@ -0,0 +1,96 @@
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+
+import history_index
+
+# Cache of model analyses keyed by sha256(image bytes + model id + prompt
+# version). A small in-process LRU serves warm containers; S3 is the shared
+# tier. Entries carry their own expiry so a stale prompt/model never leaks.
+CACHE_PREFIX = os.environ.get('ANALYSIS_CACHE_PREFIX', '_analysis_cache/')
+CACHE_TTL_SECONDS = int(os.environ.get('ANALYSIS_CACHE_TTL_SECONDS', str(7 * 24 * 3600)))
+LRU_SIZE = int(os.environ.get('ANALYSIS_CACHE_LRU_SIZE', '128'))
+ENABLED = os.environ.get('ANALYSIS_CACHE_ENABLED', 'true').lower() == 'true'
+
+_lru = OrderedDict()
+
+# Per-container counters, returned with each response
+stats = {
+    'memoryHits': 0,
+    'storeHits': 0,
+    'misses': 0
+}
+
+
+def cache_key(image_content, model_id, prompt_version):
+    digest = hashlib.sha256()
+    digest.update(image_content)
+    digest.update(b'\0')
+    digest.update(model_id.encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(str(prompt_version).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _object_key(key):
+    return f"{CACHE_PREFIX}{key}.json"
+
+
+def _remember(key, entry):
+    _lru[key] = entry
+    _lru.move_to_end(key)
+    while len(_lru) > LRU_SIZE:
+        _lru.popitem(last=False)
+
+
+def get(s3, bucket, key):
+    # Returns the cached analysis dict, or None on a miss
+    if not ENABLED:
+        return None
+    now = time.time()
+
+    entry = _lru.get(key)
+    if entry is not None:
+        if entry['expiresAt'] > now:
+            _lru.move_to_end(key)
+            stats['memoryHits'] += 1
+            return entry['analysis']
+        del _lru[key]
+
+    try:
+        obj = s3.get_object(Bucket=bucket, Key=_object_key(key))
+        entry = json.loads(obj['Body'].read().decode('utf-8'))
+    except Exception as e:
+        if not history_index.is_missing(e):
+            # The cache must never fail a request
+            print(f"Analysis cache read failed: {e}")
+        entry = None
+
+    if entry is None or entry.get('expiresAt', 0) <= now:
+        stats['misses'] += 1
+        return None
+
+    _remember(key, entry)
+    stats['storeHits'] += 1
+    return entry['analysis']
+
+
+def put(s3, bucket, key, analysis):
+    if not ENABLED:
+        return
+    entry = {
+        'expiresAt': time.time() + CACHE_TTL_SECONDS,
+        'analysis': analysis
+    }
+    _remember(key, entry)
+    try:
+        s3.put_object(
+            Bucket=bucket,
+            Key=_object_key(key),
+            Body=json.dumps(entry),
+            ContentType='application/json'
+        )
+    except Exception as e:
+        print(f"Analysis cache write failed: {e}")
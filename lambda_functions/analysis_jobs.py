@@ -0,0 +1,76 @@
+import json
+import os
+import uuid
+from datetime import datetime
+
+import history_index
+
+# Job records for analyses that run outside the request that submitted them.
+# Jobs are handed to a worker through an SQS queue (or an async invocation
+# when no queue is configured). The client polls GET /analysis/{jobId}, which
+# reads the record back; while a streaming analysis runs, the record carries
+# the text generated so far.
+JOBS_PREFIX = os.environ.get('ANALYSIS_JOBS_PREFIX', '_jobs/')
+
+# Job lifecycle
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPLETE = 'complete'
+FAILED = 'failed'
+
+
+def job_key(job_id):
+    return f"{JOBS_PREFIX}{job_id}.json"
+
+
+def put_job(s3, bucket, job, create_only=False):
+    # Each job has a single writer at a time, so records are written whole.
+    # create_only fails (history_index.is_conflict) if the job exists.
+    job['updatedAt'] = datetime.now().isoformat()
+    params = {
+        'Bucket': bucket,
+        'Key': job_key(job['jobId']),
+        'Body': json.dumps(job),
+        'ContentType': 'application/json'
+    }
+    if create_only:
+        params['IfNoneMatch'] = '*'
+    s3.put_object(**params)
+    return job
+
+
+def get_job(s3, bucket, job_id):
+    try:
+        obj = s3.get_object(Bucket=bucket, Key=job_key(job_id))
+    except Exception as e:
+        if history_index.is_missing(e):
+            return None
+        raise
+    return json.loads(obj['Body'].read().decode('utf-8'))
+
+
+def create_job(s3, bucket, user_id, image_id, image_key, media_type, timestamp, stream=False, job_id=None,
+               detail='auto'):
+    # A caller-chosen job_id may repeat (redelivered S3 events): the job is
+    # then only created if it doesn't exist yet
+    return put_job(s3, bucket, {
+        'jobId': job_id or str(uuid.uuid4()),
+        'userId': user_id,
+        'imageId': image_id,
+        'imageKey': image_key,
+        'imageContentType': media_type,
+        'timestamp': timestamp,
+        'stream': stream,
+        'detail': detail,
+        'status': QUEUED,
+        'partialText': '',
+        'createdAt': datetime.now().isoformat()
+    }, create_only=job_id is not None)
+
+
+def enqueue(sqs, queue_url, job):
+    # Works with SQS or any stand-in exposing send_message
+    sqs.send_message(
+        QueueUrl=queue_url,
+        MessageBody=json.dumps({'jobId': job['jobId']})
+    )
@@ -0,0 +1,165 @@
+import json
+import math
+import re
+
+# Turns a model analysis into typed fields stored beside the text:
+#
+#   {"ingredients": ["brown rice", ...],
+#    "scores": {"nutrition": 7, "balance": 6, "health": 7, "sustainability": 8},
+#    "alternatives": [{"replace": "white rice", "with": "quinoa", "reason": "..."}]}
+#
+# The prompt asks for the readable analysis first (it is what streaming
+# clients watch arrive) and then a fenced ```json block with these fields.
+# The block is validated and removed from the text. Responses without a
+# usable block (older prompt versions, the model ignoring the format) fall
+# back to reading scores and lists out of the prose.
+
+SCORE_FIELDS = ('nutrition', 'balance', 'health', 'sustainability')
+MIN_SCORE = 1
+MAX_SCORE = 10
+
+# Appended to the analysis prompt
+OUTPUT_INSTRUCTIONS = """
+            After the analysis, end your response with a JSON code block (```json) in exactly this shape:
+            {"ingredients": ["<food or ingredient>", ...],
+             "scores": {"nutrition": <1-10>, "balance": <1-10>, "health": <1-10>, "sustainability": <1-10>},
+             "alternatives": [{"replace": "<ingredient>", "with": "<alternative>", "reason": "<short fact>"}, ...]}
+            Scores are integers. Do not write anything after the JSON block.
+            """
+
+_JSON_BLOCK = re.compile(r'```json\s*(\{.*?\})\s*```', re.DOTALL)
+# Start of a JSON block that may still be streaming in
+_JSON_FENCE = re.compile(r'```json', re.IGNORECASE)
+
+# Prose fallback: 'Nutrition score: 7/10', '**Balance**: 6', 'Health - 7 out
+# of 10'. The label must be right before the number, and it only counts as a
+# score when the label says score/rating, the number is out of 10, or it
+# ends the line: 'Health benefits: 3 servings of vegetables' is not one.
+_SCORE_PATTERNS = {
+    field: re.compile(rf'\b{stem}\w*(\s+(?:score|rating))?(?:\*\*)?\s*(?:[:=\-–—]|\bis\b)?\s*(?:\*\*)?\s*'
+                      rf'(\d{{1,2}}(?:\.\d)?)(?!\d|\.\d|\s*%)(\s*(?:/\s*10\b|out of 10\b))?(\s*(?:\*\*)?[.,;]?\s*$)?',
+                      re.IGNORECASE | re.MULTILINE)
+    for field, stem in (('nutrition', 'nutrition'), ('balance', 'balance'),
+                        ('health', 'health'), ('sustainability', 'sustainab'))
+}
+_HEADING = re.compile(r'^\s*(?:#+\s*|\d+\.\s*|\*\*)?([A-Z][A-Za-z &]+?)(?:\*\*)?:?\s*$')
+_BULLET = re.compile(r'^\s*(?:[-*•]|\d+\.)\s+(.+?)\s*$')
+
+
+def visible_text(text):
+    # The readable part of a (possibly partial) response, without the
+    # trailing JSON block
+    match = _JSON_FENCE.search(text)
+    return text[:match.start()].rstrip() if match else text
+
+
+def _score(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    # inf and nan can't be rounded (1e999 parses as inf)
+    if not math.isfinite(value):
+        return None
+    score = round(value)
+    return score if MIN_SCORE <= score <= MAX_SCORE else None
+
+
+def _strings(values, limit=50):
+    if not isinstance(values, list):
+        return []
+    return [str(v).strip() for v in values[:limit] if isinstance(v, (str, int, float)) and str(v).strip()]
+
+
+def validate(data):
+    # Returns the typed fields, or None if data doesn't have the expected shape
+    if not isinstance(data, dict) or not isinstance(data.get('scores'), dict):
+        return None
+    scores = {field: _score(data['scores'].get(field)) for field in SCORE_FIELDS}
+    if all(score is None for score in scores.values()):
+        return None
+
+    alternatives = []
+    for alternative in data.get('alternatives') or []:
+        if isinstance(alternative, dict) and alternative.get('with'):
+            alternatives.append({
+                'replace': str(alternative.get('replace') or '').strip(),
+                'with': str(alternative['with']).strip(),
+                'reason': str(alternative.get('reason') or '').strip()
+            })
+        elif isinstance(alternative, str) and alternative.strip():
+            alternatives.append({'replace': '', 'with': alternative.strip(), 'reason': ''})
+    return {
+        'ingredients': _strings(data.get('ingredients')),
+        'scores': scores,
+        'alternatives': alternatives
+    }
+
+
+def _sections(text):
+    # {heading (lowercase): [bullet text, ...]}
+    sections = {}
+    current = None
+    for line in text.splitlines():
+        heading = _HEADING.match(line)
+        if heading and not _BULLET.match(line):
+            current = heading.group(1).strip().lower()
+            sections.setdefault(current, [])
+            continue
+        bullet = _BULLET.match(line)
+        if bullet and current is not None:
+            sections[current].append(bullet.group(1).replace('**', '').strip())
+    return sections
+
+
+def parse_prose(text):
+    scores = {}
+    for field, pattern in _SCORE_PATTERNS.items():
+        scores[field] = None
+        for match in pattern.finditer(text):
+            labeled, value, out_of_ten, line_end = match.groups()
+            if labeled or out_of_ten or line_end is not None:
+                scores[field] = _score(value)
+                break
+
+    ingredients = []
+    alternatives = []
+    for heading, bullets in _sections(text).items():
+        if 'identif' in heading or 'ingredient' in heading:
+            ingredients.extend(bullets)
+        elif 'alternative' in heading or 'improve' in heading or 'suggest' in heading:
+            alternatives.extend({'replace': '', 'with': b, 'reason': ''} for b in bullets)
+    return {
+        'ingredients': ingredients[:50],
+        'scores': scores,
+        'alternatives': alternatives[:50]
+    }
+
+
+def json_block(text):
+    # The last fenced JSON object in text, unvalidated (None if there's none)
+    for match in reversed(list(_JSON_BLOCK.finditer(text or ''))):
+        try:
+            data = json.loads(match.group(1))
+        except ValueError:
+            continue
+        if isinstance(data, dict):
+            return data
+    return None
+
+
+def parse(text):
+    # Returns (readable text, typed fields). fields['format'] is 'json' when
+    # the structured block was used, 'prose' for the fallback.
+    text = text or ''
+    for match in reversed(list(_JSON_BLOCK.finditer(text))):
+        try:
+            fields = validate(json.loads(match.group(1)))
+        except ValueError:
+            fields = None
+        if fields is not None:
+            readable = (text[:match.start()] + text[match.end():]).strip()
+            return readable, {**fields, 'format': 'json'}
+
+    readable = visible_text(text)
+    return readable, {**parse_prose(readable), 'format': 'prose'}
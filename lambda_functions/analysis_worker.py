@@ -0,0 +1,52 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+import aws_clients
+import instrumentation
+import meal_analysis
+
+# Consumes analysis jobs from the SQS queue (event source mapping with
+# ReportBatchItemFailures). Failed messages are reported individually so the
+# rest of the batch is not redelivered; a job is marked failed for good once
+# it has been received MAX_ATTEMPTS times.
+MAX_ATTEMPTS = int(os.environ.get('ANALYSIS_MAX_ATTEMPTS', '3'))
+
+# Jobs in one batch are analyzed concurrently, bounded to spare model throughput
+WORKER_CONCURRENCY = int(os.environ.get('ANALYSIS_WORKER_CONCURRENCY', '4'))
+executor = ThreadPoolExecutor(max_workers=WORKER_CONCURRENCY)
+
+def process_record(record):
+    job_id = json.loads(record['body'])['jobId']
+    receive_count = int(record.get('attributes', {}).get('ApproximateReceiveCount', '1'))
+    meal_analysis.run_job(job_id, final_attempt=receive_count >= MAX_ATTEMPTS)
+
+def lambda_handler(event, context):
+    if aws_clients.is_warmup(event):
+        return aws_clients.warmup_response()
+
+    # Direct asynchronous invocation (no queue configured)
+    if event.get('analysisJob'):
+        meal_analysis.run_job(event['analysisJob']['jobId'])
+        return {'jobId': event['analysisJob']['jobId']}
+    
+    metrics = instrumentation.RequestMetrics('analysis_worker', context)
+    records = event.get('Records', [])
+    futures = [(record, executor.submit(process_record, record)) for record in records]
+    failures = []
+    for record, future in futures:
+        try:
+            future.result()
+        except Exception as e:
+            print(f"Job message {record.get('messageId')} failed: {e}")
+            failures.append({'itemIdentifier': record['messageId']})
+    
+    metrics.set('messages', len(records))
+    metrics.set('failedMessages', len(failures))
+    metrics.emit()
+    return {'batchItemFailures': failures}
+
+
+# With provisioned concurrency, init runs ahead of traffic: build clients now
+if aws_clients.PREWARM_ON_INIT:
+    aws_clients.warm()
@@ -0,0 +1,99 @@
+import json
+import os
+import threading
+
+import instrumentation
+
+# Lazily built, memoized AWS clients shared by every module in the container.
+#
+# Importing boto3 and constructing clients is most of a cold start, and not
+# every invocation needs every client (a history request never touches
+# Bedrock, a diagnostics call is the only user of the control-plane client).
+# Modules declare their clients at import time with lazy(); the real client
+# is built on first use and reused by warm invocations. Modules asking for
+# the same service and configuration share one client, and so one
+# connection pool.
+
+REGION = os.environ.get('AWS_CLIENT_REGION', 'us-west-2')
+# Connections kept open per client, shared by concurrent threads
+DEFAULT_POOL_CONNECTIONS = int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', '10'))
+# TCP keep-alive stops idle pooled connections from being dropped between
+# warm invocations
+TCP_KEEPALIVE = os.environ.get('AWS_TCP_KEEPALIVE', 'true').lower() == 'true'
+# Build every declared client during init instead of on first use. Worth it
+# when init runs ahead of traffic (provisioned concurrency, SnapStart).
+PREWARM_ON_INIT = os.environ.get('PREWARM_CLIENTS', 'false').lower() == 'true'
+
+_clients = {}
+_declared = []
+_lock = threading.Lock()
+
+
+def client(service, endpoint_url=None, **config):
+    # Memoized client for service and botocore Config options. endpoint_url
+    # points a client at a local stand-in (e.g. DynamoDB Local).
+    options = {'max_pool_connections': DEFAULT_POOL_CONNECTIONS, 'tcp_keepalive': TCP_KEEPALIVE, **config}
+    key = (service, endpoint_url, json.dumps(options, sort_keys=True))
+    existing = _clients.get(key)
+    if existing is not None:
+        return existing
+    with _lock:
+        if key not in _clients:
+            import boto3
+            from botocore.config import Config
+            _clients[key] = instrumentation.instrument_client(
+                boto3.client(service, region_name=REGION, endpoint_url=endpoint_url, config=Config(**options))
+            )
+        return _clients[key]
+
+
+class LazyClient:
+    # Stands in for a client until it is first used
+    def __init__(self, service, config):
+        self.service = service
+        self.config = config
+
+    def get(self):
+        return client(self.service, **self.config)
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+
+def lazy(service, prewarm=True, **config):
+    declared = LazyClient(service, config)
+    if prewarm:
+        _declared.append(declared)
+    return declared
+
+
+def warm():
+    # Builds every client declared for pre-warming
+    for declared in _declared:
+        declared.get()
+    return len(_clients)
+
+
+def is_warmup(event):
+    # Scheduled pre-warm pings ({"warmup": true}) build the clients and
+    # return before any real work
+    if isinstance(event, dict) and event.get('warmup'):
+        print(json.dumps({'warmup': True, 'clients': warm()}))
+        return True
+    return False
+
+
+def warmup_response():
+    return {
+        'statusCode': 200,
+        'body': json.dumps({'warmup': True, 'clients': len(_clients)})
+    }
+
+
+# SnapStart: build the clients before the snapshot is taken, so restored
+# environments start with them in memory
+try:
+    from snapshot_restore_py import register_before_snapshot
+    register_before_snapshot(warm)
+except ImportError:
+    pass
@@ -0,0 +1,126 @@
+import os
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import adaptive_limiter
+import image_utils
+import instrumentation
+import meal_analysis
+import model_invoker
+
+# Batch mode of /analyze-meal (also routed as POST /analyze-meals): a day of
+# meals or a camera-roll import in one request,
+#
+#   {"userId": "...", "items": [{"image": "data:image/jpeg;base64,..."},
+#                               {"imageKey": "uploads/..."}, ...]}
+#
+# Items are decoded, stored and analyzed concurrently. Model calls go
+# through an adaptive limiter that backs off when Bedrock throttles, all
+# within the request's deadline, and the feedback records of the whole
+# batch are persisted in one step.
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', '20'))
+# Upper bound on concurrent model calls; throttling lowers it dynamically
+BATCH_MODEL_CONCURRENCY = int(os.environ.get('BATCH_MODEL_CONCURRENCY', '4'))
+# Items in flight (decode, image put, cache lookup, waiting for the model)
+BATCH_ITEM_CONCURRENCY = int(os.environ.get('BATCH_ITEM_CONCURRENCY', '8'))
+
+# Shared across warm invocations, so a container remembers recent throttling
+limiter = adaptive_limiter.AdaptiveLimiter(BATCH_MODEL_CONCURRENCY)
+executor = ThreadPoolExecutor(max_workers=BATCH_ITEM_CONCURRENCY)
+
+
+def parse_items(items):
+    if not isinstance(items, list) or not items:
+        raise ValueError("items must be a non-empty list")
+    if len(items) > BATCH_MAX_ITEMS:
+        raise ValueError(f"A batch holds at most {BATCH_MAX_ITEMS} items")
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not (item.get('image') or item.get('imageKey')):
+            raise ValueError(f"Item {index} needs an image or an imageKey")
+    return items
+
+
+def analyze_item(user_id, index, item, deadline=None, detail='auto'):
+    # Returns the per-item result; errors are reported, not raised
+    metrics = instrumentation.RequestMetrics('process_image_batch_item', activate=False)
+    metrics.set_property('userId', user_id)
+    try:
+        if item.get('imageKey'):
+            with metrics.stage('imageGet'):
+                _, image_id, media_type, image_content, timestamp = meal_analysis.load_upload(item['imageKey'], user_id)
+            image_key = item['imageKey']
+        else:
+            with metrics.stage('decode'):
+                media_type, image_content = image_utils.parse_data_url(item['image'])
+            with metrics.stage('imagePut'):
+                image_id, image_key, timestamp = meal_analysis.store_image(user_id, image_content, media_type)
+        metrics.set_property('mediaType', media_type)
+
+        result = meal_analysis.analyze_image(user_id, image_id, image_key, image_content, media_type,
+                                             timestamp, metrics, limiter=limiter, persist=False,
+                                             deadline=deadline,
+                                             detail=meal_analysis.model_router.parse_detail(item.get('detail', detail)))
+        return {
+            'index': index,
+            'success': True,
+            'imageId': image_id,
+            'imageKey': image_key,
+            'feedback': result['feedback'],
+            'analysis': result['analysis'],
+            'cacheHit': result['cacheHit'],
+            'similarMatch': result['similarMatch'],
+            'routing': result['routing'],
+            'record': result['record']
+        }
+    except Exception as e:
+        print(f"Batch item {index} failed: {str(e)}")
+        print(f"Traceback: {traceback.format_exc()}")
+        metrics.fail(e)
+        # Items the model couldn't serve in time are worth resubmitting
+        return {'index': index, 'success': False, 'error': str(e),
+                'retryable': isinstance(e, model_invoker.ModelUnavailableError)}
+    finally:
+        metrics.emit()
+
+
+def unique_timestamps(records):
+    # Items stored in the same instant would share a history sort key
+    seen = set()
+    for record in sorted(records, key=lambda r: r['timestamp']):
+        moment = datetime.fromisoformat(record['timestamp'])
+        while moment.isoformat() in seen:
+            moment += timedelta(microseconds=1)
+        record['timestamp'] = moment.isoformat()
+        seen.add(record['timestamp'])
+
+
+def analyze_batch(user_id, items, metrics, deadline=None, detail='auto'):
+    items = parse_items(items)
+    deadline = deadline or model_invoker.deadline_for()
+    metrics.set('batchItems', len(items))
+
+    with metrics.stage('analyze'):
+        results = list(executor.map(lambda pair: analyze_item(user_id, *pair, deadline, detail), enumerate(items)))
+
+    # One persistence step for every successful item; if it fails the whole
+    # request fails, and a retry is served from the analysis cache
+    records = [r.pop('record') for r in results if r['success']]
+    if records:
+        unique_timestamps(records)
+        with metrics.stage('persist'):
+            meal_analysis.save_feedback_batch(records, executor)
+
+    succeeded = len(records)
+    metrics.set('batchSucceeded', succeeded)
+    metrics.set('batchFailed', len(results) - succeeded)
+    throttling = limiter.stats()
+    metrics.set('modelThrottles', throttling['throttles'])
+    return {
+        'success': True,
+        'userId': user_id,
+        'results': results,
+        'succeeded': succeeded,
+        'failed': len(results) - succeeded,
+        'throttling': throttling
+    }
@@ -0,0 +1,92 @@
+import json
+import traceback
+import uuid
+import os
+
+import aws_clients
+import image_utils
+
+# POST /upload-url: hands the client a presigned POST so the photo goes
+# straight to IMAGES_BUCKET instead of through API Gateway as base64 JSON.
+# The client then sends the returned imageKey to /analyze-meal or /analysis.
+
+# S3 client, built on first use (SigV4 is required for presigned POST)
+s3 = aws_clients.lazy(
+    's3',
+    signature_version='s3v4',
+    connect_timeout=5,
+    read_timeout=5,
+    retries={'max_attempts': 2}
+)
+
+# Get environment variables
+IMAGES_BUCKET = os.environ['IMAGES_BUCKET']
+UPLOAD_URL_TTL_SECONDS = int(os.environ.get('UPLOAD_URL_TTL_SECONDS', '300'))
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', str(20 * 1024 * 1024)))
+
+# Set when the bucket notifies process_image about new uploads, in which case
+# the client only has to poll GET /analysis/{imageId}
+UPLOAD_AUTO_ANALYZE = os.environ.get('UPLOAD_AUTO_ANALYZE', 'false').lower() == 'true'
+
+def respond(status_code, body):
+    return {
+        'statusCode': status_code,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Cache-Control': 'no-store',
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Headers': '*',
+            'Access-Control-Allow-Methods': 'OPTIONS,POST'
+        },
+        'body': json.dumps(body)
+    }
+
+def lambda_handler(event, context):
+    if aws_clients.is_warmup(event):
+        return aws_clients.warmup_response()
+
+    try:
+        body = json.loads(event.get('body') or '{}')
+        user_id = body.get('userId', 'anonymous')
+        content_type = (body.get('contentType') or 'image/jpeg').lower()
+        if content_type == 'image/jpg':
+            content_type = 'image/jpeg'
+        
+        if content_type not in image_utils.EXTENSIONS:
+            return respond(400, {'success': False, 'error': f"Unsupported content type: {content_type}"})
+        
+        image_id = str(uuid.uuid4())
+        image_key = image_utils.upload_key(user_id, image_id, content_type)
+        
+        # The policy pins the key, the content type and a size limit
+        presigned = s3.generate_presigned_post(
+            Bucket=IMAGES_BUCKET,
+            Key=image_key,
+            Fields={'Content-Type': content_type},
+            Conditions=[
+                {'Content-Type': content_type},
+                ['content-length-range', 1, MAX_UPLOAD_BYTES]
+            ],
+            ExpiresIn=UPLOAD_URL_TTL_SECONDS
+        )
+        
+        return respond(200, {
+            'success': True,
+            'imageId': image_id,
+            'imageKey': image_key,
+            'url': presigned['url'],
+            'fields': presigned['fields'],
+            'maxBytes': MAX_UPLOAD_BYTES,
+            'expiresIn': UPLOAD_URL_TTL_SECONDS,
+            'autoAnalyze': UPLOAD_AUTO_ANALYZE
+        })
+    
+    except Exception as e:
+        print(f"Error creating upload URL: {str(e)}")
+        print(f"Traceback: {traceback.format_exc()}")
+        return respond(500, {'success': False, 'error': str(e)})
+
+
+# With provisioned concurrency, init runs ahead of traffic: build clients now
+if aws_clients.PREWARM_ON_INIT:
+    aws_clients.warm()
@@ -0,0 +1,214 @@
+import gzip
+import hashlib
+import json
+import os
+
+import history_index
+
+# Compaction of a user's older meal records into segment files. Every meal
+# is saved as its own small object ({user_id}/{image_id}_feedback.json),
+# so reading a long history costs one GET per meal. compact_feedback.py
+# rolls the records older than COMPACT_AFTER_DAYS into one segment per
+# user and month:
+#
+#   {user_id}/_segments/{YYYY-MM}-{content hash}.jsonl.gz
+#
+# A segment is JSON Lines, oldest first, in blocks of SEGMENT_BLOCK_RECORDS
+# records. Each block is a separate gzip member, so a block can be read on
+# its own with a ranged GET, and the whole file still decompresses as one
+# gzip stream for analytics. The last member is a footer line,
+# {"_segment": {...}}, listing every block's byte range and records.
+#
+# The history index is the manifest: a compacted record's entry names its
+# segment and block ({"imageId", "timestamp", "segment", "block": [offset,
+# length]}) instead of its object key. Readers (meal_store.S3MealStore) then
+# fetch a page with one ranged GET per block plus one GET per recent record.
+#
+# The index switches over with a conditional write after the segment is
+# stored, and only then are the small objects deleted. A month that gets
+# more records is rewritten as a new segment; the old one is deleted once
+# the index no longer names it.
+SEGMENT_PREFIX = '_segments/'
+SEGMENT_SUFFIX = '.jsonl.gz'
+BLOCK_RECORDS = int(os.environ.get('SEGMENT_BLOCK_RECORDS', '32'))
+COMPACT_AFTER_DAYS = int(os.environ.get('COMPACT_AFTER_DAYS', '30'))
+FOOTER_FIELD = '_segment'
+MAX_COMMIT_ATTEMPTS = 5
+# delete_objects takes at most 1000 keys per request
+DELETE_BATCH_SIZE = 1000
+
+
+def partition(timestamp):
+    # Records are partitioned by month: '2024-03-05T12:00:00' -> '2024-03'
+    return timestamp[:7]
+
+
+def segment_key(user_id, month, body):
+    return f"{user_id}/{SEGMENT_PREFIX}{month}-{hashlib.sha256(body).hexdigest()[:16]}{SEGMENT_SUFFIX}"
+
+
+def is_segment_key(key):
+    return f"/{SEGMENT_PREFIX}" in key and key.endswith(SEGMENT_SUFFIX)
+
+
+def _member(rows):
+    # mtime=0 keeps identical records byte-identical, so a repeated
+    # compaction produces the same segment key
+    body = ''.join(json.dumps(row, sort_keys=True) + '\n' for row in rows)
+    return gzip.compress(body.encode('utf-8'), mtime=0)
+
+
+def build_segment(records):
+    # Returns (body, blocks); blocks carry their byte range and the
+    # (imageId, timestamp) of each record
+    records = sorted(records, key=lambda r: (r['timestamp'], r['imageId']))
+    parts = []
+    blocks = []
+    offset = 0
+    for i in range(0, len(records), BLOCK_RECORDS):
+        rows = records[i:i + BLOCK_RECORDS]
+        data = _member(rows)
+        blocks.append({
+            'offset': offset,
+            'length': len(data),
+            'records': [[r['imageId'], r['timestamp']] for r in rows]
+        })
+        parts.append(data)
+        offset += len(data)
+    parts.append(_member([{FOOTER_FIELD: {'version': 1, 'records': len(records), 'blocks': blocks}}]))
+    return b''.join(parts), blocks
+
+
+def index_entries(key, blocks):
+    return [{'imageId': image_id, 'timestamp': timestamp, 'segment': key,
+             'block': [block['offset'], block['length']]}
+            for block in blocks for image_id, timestamp in block['records']]
+
+
+def _parse(data):
+    return [json.loads(line) for line in gzip.decompress(data).decode('utf-8').splitlines() if line.strip()]
+
+
+def read_block(s3, bucket, key, offset, length):
+    # Records of one block, from a ranged GET; [] if the segment is gone
+    try:
+        obj = s3.get_object(Bucket=bucket, Key=key, Range=f"bytes={offset}-{offset + length - 1}")
+    except Exception as e:
+        if history_index.is_missing(e):
+            print(f"Segment missing for index entry: {key}")
+            return []
+        raise
+    return _parse(obj['Body'].read())
+
+
+def read_segment(s3, bucket, key):
+    # (records, footer) of a whole segment
+    obj = s3.get_object(Bucket=bucket, Key=key)
+    rows = _parse(obj['Body'].read())
+    footer = rows.pop()[FOOTER_FIELD] if rows and FOOTER_FIELD in rows[-1] else None
+    return rows, footer
+
+
+def segment_entries(s3, bucket, key):
+    # Index entries for a segment, from its footer (rebuilding an index)
+    _, footer = read_segment(s3, bucket, key)
+    return index_entries(key, footer['blocks']) if footer else []
+
+
+def _fetch(s3, bucket, key):
+    try:
+        obj = s3.get_object(Bucket=bucket, Key=key)
+    except Exception as e:
+        if history_index.is_missing(e):
+            return None
+        raise
+    return json.loads(obj['Body'].read().decode('utf-8'))
+
+
+def _delete(s3, bucket, keys):
+    for i in range(0, len(keys), DELETE_BATCH_SIZE):
+        response = s3.delete_objects(Bucket=bucket, Delete={
+            'Objects': [{'Key': key} for key in keys[i:i + DELETE_BATCH_SIZE]],
+            'Quiet': True
+        })
+        for error in response.get('Errors', []):
+            print(f"Could not delete {error.get('Key')}: {error.get('Message')}")
+
+
+def compact_user(s3, bucket, user_id, cutoff, executor=None, dry_run=False):
+    # Moves the user's records older than cutoff (an ISO 8601 timestamp)
+    # into monthly segments. Returns a summary; safe to re-run, and to run
+    # while meals are being saved.
+    summary = {'userId': user_id, 'compacted': 0, 'segments': 0, 'deleted': 0}
+    entries, etag = history_index.read_index_with_etag(s3, bucket, user_id)
+    if not entries:
+        return summary
+
+    due = {}
+    for entry in entries:
+        if 'key' in entry and entry['timestamp'] < cutoff:
+            due.setdefault(partition(entry['timestamp']), []).append(entry)
+    summary['months'] = sorted(due)
+    summary['compacted'] = sum(len(month_entries) for month_entries in due.values())
+    if dry_run or not due:
+        return summary
+
+    run = executor.map if executor else map
+    replaced = {}
+    expected = {}
+    obsolete = []
+    written = []
+    for month, month_entries in sorted(due.items()):
+        # A month compacted before is merged with its new records
+        compacted = [e for e in entries if 'segment' in e and partition(e['timestamp']) == month]
+        old_segments = sorted({e['segment'] for e in compacted})
+        records = {}
+        for key in old_segments:
+            for record in read_segment(s3, bucket, key)[0]:
+                records[record['imageId']] = record
+        fetched = list(run(lambda e: _fetch(s3, bucket, e['key']), month_entries))
+        for entry, record in zip(month_entries, fetched):
+            if record is None:
+                # Left in the index as it is
+                continue
+            # The index is authoritative for ordering fields
+            record['imageId'] = entry['imageId']
+            record['timestamp'] = entry['timestamp']
+            records[entry['imageId']] = record
+            expected[entry['imageId']] = entry
+            obsolete.append(entry['key'])
+        for entry in compacted:
+            expected[entry['imageId']] = entry
+
+        body, blocks = build_segment(list(records.values()))
+        key = segment_key(user_id, month, body)
+        s3.put_object(Bucket=bucket, Key=key, Body=body, ContentType='application/x-ndjson')
+        written.append(key)
+        for entry in index_entries(key, blocks):
+            replaced[entry['imageId']] = entry
+        obsolete += [old for old in old_segments if old != key]
+
+    # Meals saved meanwhile only append to the index: re-apply on top of
+    # them. If an entry we compacted changed, leave it to the next run.
+    for attempt in range(MAX_COMMIT_ATTEMPTS):
+        current = {e['imageId']: e for e in entries}
+        if any(current.get(image_id) != entry for image_id, entry in expected.items()):
+            print(f"History index of {user_id} changed under compaction, skipping")
+            live = {e.get('segment') for e in entries}
+            _delete(s3, bucket, [key for key in written if key not in live])
+            return {**summary, 'compacted': 0, 'segments': 0, 'conflict': True}
+        try:
+            history_index.replace_index(s3, bucket, user_id, [replaced.get(e['imageId'], e) for e in entries], etag)
+            break
+        except Exception as e:
+            if not history_index.is_conflict(e):
+                raise
+            entries, etag = history_index.read_index_with_etag(s3, bucket, user_id)
+            entries = entries or []
+    else:
+        raise RuntimeError(f"Could not update history index for {user_id}")
+
+    _delete(s3, bucket, obsolete)
+    summary['segments'] = len(written)
+    summary['deleted'] = len(obsolete)
+    return summary
@@ -0,0 +1,73 @@
+import json
+import traceback
+import os
+
+import analysis_jobs
+import aws_clients
+
+# S3 client, built on first use
+s3 = aws_clients.lazy('s3', connect_timeout=5, read_timeout=5, retries={'max_attempts': 2})
+
+# Get environment variables
+FEEDBACK_BUCKET = os.environ['FEEDBACK_BUCKET']
+JOBS_BUCKET = os.environ.get('JOBS_BUCKET', FEEDBACK_BUCKET)
+
+# Suggested client polling interval while a job is still running
+POLL_INTERVAL_MS = int(os.environ.get('ANALYSIS_POLL_INTERVAL_MS', '1000'))
+
+def respond(status_code, body):
+    return {
+        'statusCode': status_code,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Cache-Control': 'no-store',
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Headers': '*',
+            'Access-Control-Allow-Methods': 'OPTIONS,GET'
+        },
+        'body': json.dumps(body)
+    }
+
+def lambda_handler(event, context):
+    if aws_clients.is_warmup(event):
+        return aws_clients.warmup_response()
+
+    try:
+        job_id = (event.get('pathParameters') or {}).get('jobId')
+        if not job_id:
+            return respond(400, {'success': False, 'error': 'Missing jobId'})
+        
+        job = analysis_jobs.get_job(s3, JOBS_BUCKET, job_id)
+        if job is None:
+            return respond(404, {'success': False, 'error': f"Unknown job: {job_id}"})
+        
+        body = {
+            'success': True,
+            'jobId': job_id,
+            'status': job['status'],
+            'imageId': job.get('imageId'),
+            'partialText': job.get('partialText', ''),
+            'updatedAt': job.get('updatedAt')
+        }
+        if job['status'] == analysis_jobs.COMPLETE:
+            body['feedback'] = job.get('feedback')
+            body['analysis'] = job.get('analysis')
+            body['routing'] = job.get('routing')
+            body['cacheHit'] = job.get('cacheHit')
+            body['similarMatch'] = job.get('similarMatch')
+            body['timeToFirstTokenMs'] = job.get('timeToFirstTokenMs')
+        elif job['status'] == analysis_jobs.FAILED:
+            body['error'] = job.get('error')
+        else:
+            body['pollAfterMs'] = POLL_INTERVAL_MS
+        return respond(200, body)
+    
+    except Exception as e:
+        print(f"Error fetching analysis status: {str(e)}")
+        print(f"Traceback: {traceback.format_exc()}")
+        return respond(500, {'success': False, 'error': str(e)})
+
+
+# With provisioned concurrency, init runs ahead of traffic: build clients now
+if aws_clients.PREWARM_ON_INIT:
+    aws_clients.warm()
@@ -0,0 +1,162 @@
+import json
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+import aws_clients
+import instrumentation
+import meal_stats
+import meal_store
+
+# GET /meal-stats/{userId}: daily, weekly or monthly averages of the four
+# scores and the most frequent ingredients, served from the rollups that
+# are updated as each meal is saved (meal_stats).
+#
+# Repair mode, by direct invocation only: {"repairStats": {"userId": "..."}}
+# rebuilds a user's rollups from their raw history.
+
+# Get environment variables
+FEEDBACK_BUCKET = os.environ['FEEDBACK_BUCKET']
+DEFAULT_TOP_INGREDIENTS = int(os.environ.get('STATS_TOP_INGREDIENTS', '10'))
+MAX_TOP_INGREDIENTS = 50
+FETCH_CONCURRENCY = int(os.environ.get('HISTORY_FETCH_CONCURRENCY', '16'))
+
+# Clients, built on first use
+s3 = aws_clients.lazy(
+    's3',
+    connect_timeout=5,
+    read_timeout=5,
+    retries={'max_attempts': 2},
+    max_pool_connections=FETCH_CONCURRENCY
+)
+dynamodb = aws_clients.lazy(
+    'dynamodb',
+    prewarm=False,
+    endpoint_url=meal_store.DYNAMODB_ENDPOINT_URL,
+    connect_timeout=5,
+    read_timeout=5,
+    retries={'max_attempts': 3}
+)
+
+# Raw records are only read when rebuilding rollups
+executor = ThreadPoolExecutor(max_workers=FETCH_CONCURRENCY)
+
+
+def respond(status_code, body):
+    return {
+        'statusCode': status_code,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Headers': '*',
+            'Access-Control-Allow-Methods': 'OPTIONS,GET'
+        },
+        'body': json.dumps(body)
+    }
+
+
+def parse_period(value):
+    period = (value or 'day').lower()
+    if period not in meal_stats.PERIODS:
+        raise ValueError(f"Invalid period: {value} (expected day, week or month)")
+    return period
+
+
+def parse_bound(value, name, period):
+    # from/to are ISO dates, inclusive; they select the period buckets that
+    # contain them
+    if not value:
+        return None
+    try:
+        return meal_stats.period_keys(value)[period]
+    except ValueError:
+        raise ValueError(f"Invalid {name}: {value} (expected an ISO 8601 date)")
+
+
+def parse_top(value):
+    if value is None:
+        return DEFAULT_TOP_INGREDIENTS
+    try:
+        top = int(value)
+    except ValueError:
+        raise ValueError(f"Invalid top: {value}")
+    if top < 0:
+        raise ValueError(f"Invalid top: {value}")
+    return min(top, MAX_TOP_INGREDIENTS)
+
+
+def load_stats(user_id, metrics):
+    stats = meal_stats.read_stats(s3, FEEDBACK_BUCKET, user_id)
+    if stats is None:
+        # Meals saved before rollups existed: build them once from history
+        print(f"No meal stats for user {user_id}, building from history")
+        with metrics.stage('recompute'):
+            store = meal_store.reader(s3, FEEDBACK_BUCKET, dynamodb, executor)
+            stats = meal_stats.build_missing(s3, FEEDBACK_BUCKET, store, user_id)
+    return stats
+
+
+def repair(user_id):
+    store = meal_store.reader(s3, FEEDBACK_BUCKET, dynamodb, executor)
+    return meal_stats.recompute(s3, FEEDBACK_BUCKET, store, user_id)
+
+
+def lambda_handler(event, context):
+    if aws_clients.is_warmup(event):
+        return aws_clients.warmup_response()
+
+    if event.get('repairStats'):
+        user_id = event['repairStats']['userId']
+        stats = repair(user_id)
+        print(f"Recomputed meal stats for {user_id}: {stats['meals']} meals")
+        return {'userId': user_id, 'meals': stats['meals']}
+
+    metrics = instrumentation.RequestMetrics('get_meal_stats', context)
+    try:
+        response = handle_request(event, metrics)
+        metrics.set_property('statusCode', response['statusCode'])
+        metrics.set_bytes('responseBytes', len(response['body']))
+        return response
+    finally:
+        metrics.emit()
+
+
+def handle_request(event, metrics):
+    try:
+        user_id = (event.get('pathParameters') or {}).get('userId') or 'anonymous'
+        query = event.get('queryStringParameters') or {}
+        period = parse_period(query.get('period'))
+        start = parse_bound(query.get('from'), 'from', period)
+        end = parse_bound(query.get('to'), 'to', period)
+        top = parse_top(query.get('top'))
+        metrics.set_property('userId', user_id)
+        metrics.set_property('period', period)
+
+        with metrics.stage('load'):
+            stats = load_stats(user_id, metrics)
+        with metrics.stage('summarize'):
+            buckets = meal_stats.summarize(stats, period, start, end, top)
+        metrics.set('buckets', len(buckets))
+
+        return respond(200, {
+            'success': True,
+            'userId': user_id,
+            'period': period,
+            'totalMeals': stats['meals'],
+            'buckets': buckets
+        })
+
+    except ValueError as e:
+        metrics.fail(e)
+        return respond(400, {'success': False, 'error': str(e)})
+
+    except Exception as e:
+        print(f"Error fetching meal stats: {str(e)}")
+        print(f"Traceback: {traceback.format_exc()}")
+        metrics.fail(e)
+        return respond(500, {'success': False, 'error': str(e)})
+
+
+# With provisioned concurrency, init runs ahead of traffic: build clients now
+if aws_clients.PREWARM_ON_INIT:
+    aws_clients.warm()
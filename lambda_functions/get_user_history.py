@@ -1,86 +1,278 @@
 import json
-import boto3
-from botocore.config import Config
+import traceback
+import base64
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 import os
 
-# Initialize S3 client with proper config
-s3 = boto3.client('s3', region_name='us-west-2', config=Config(
-    connect_timeout=5,
-    read_timeout=5,
-    retries={'max_attempts': 2}
-))
+import aws_clients
+import http_cache
+import instrumentation
+import meal_store
 
 # Get environment variables
 FEEDBACK_BUCKET = os.environ['FEEDBACK_BUCKET']
+IMAGES_BUCKET = os.environ.get('IMAGES_BUCKET')
+IMAGE_URL_TTL_SECONDS = int(os.environ.get('IMAGE_URL_TTL_SECONDS', '3600'))
+DEFAULT_PAGE_SIZE = int(os.environ.get('HISTORY_PAGE_SIZE', '50'))
+MAX_PAGE_SIZE = int(os.environ.get('HISTORY_MAX_PAGE_SIZE', '200'))
+FETCH_CONCURRENCY = int(os.environ.get('HISTORY_FETCH_CONCURRENCY', '16'))
+# Seconds a client may reuse a history page without revalidating it; 0
+# means revalidate every time (If-None-Match, answered with a bodiless 304
+# while no meal was added)
+CACHE_MAX_AGE = int(os.environ.get('HISTORY_CACHE_MAX_AGE', '0'))
+
+# S3 client, built on first use (pool sized for the page fetches)
+s3 = aws_clients.lazy(
+    's3',
+    connect_timeout=5,
+    read_timeout=5,
+    retries={'max_attempts': 2},
+    max_pool_connections=FETCH_CONCURRENCY
+)
+
+# Meal history table, when meal_store reads from DynamoDB
+dynamodb = aws_clients.lazy(
+    'dynamodb',
+    prewarm=meal_store.MEAL_STORE == 'dynamodb',
+    endpoint_url=meal_store.DYNAMODB_ENDPOINT_URL,
+    connect_timeout=5,
+    read_timeout=5,
+    retries={'max_attempts': 3}
+)
+
+INCLUDE_IMAGES_MODES = ('full', 'thumb', 'none')
+FIELDS_MODES = ('all', 'metadata')
+
+# Shared across warm invocations
+executor = ThreadPoolExecutor(max_workers=FETCH_CONCURRENCY)
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': '*',
+    'Access-Control-Allow-Methods': 'OPTIONS,GET',
+    'Access-Control-Expose-Headers': 'ETag'
+}
+
+
+def encode_token(cursor):
+    timestamp, image_id = cursor
+    token = json.dumps({'t': timestamp, 'i': image_id})
+    return base64.urlsafe_b64encode(token.encode('utf-8')).decode('ascii')
+
+
+def decode_token(token):
+    try:
+        cursor = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+        return cursor['t'], cursor['i']
+    except Exception:
+        raise ValueError("Invalid nextToken")
+
+
+def parse_limit(value):
+    if value is None:
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError(f"Invalid limit: {value}")
+    if limit < 1:
+        raise ValueError(f"Invalid limit: {value}")
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def parse_include_images(value):
+    mode = (value or 'thumb').lower()
+    if mode not in INCLUDE_IMAGES_MODES:
+        raise ValueError(f"Invalid includeImages: {value} (expected full, thumb or none)")
+    return mode
+
+
+def parse_time(value, name):
+    # from/to accept an ISO 8601 date or date-time; from is inclusive, to is
+    # exclusive (to=2024-02-01 ends with January)
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value).isoformat()
+    except ValueError:
+        raise ValueError(f"Invalid {name}: {value} (expected an ISO 8601 date or time)")
+
+
+def parse_fields(value):
+    fields = (value or 'all').lower()
+    if fields not in FIELDS_MODES:
+        raise ValueError(f"Invalid fields: {value} (expected all or metadata)")
+    return fields
+
+
+def image_url(image_key):
+    # Presigning is a local signature, no request to S3
+    return s3.generate_presigned_url(
+        'get_object',
+        Params={'Bucket': IMAGES_BUCKET, 'Key': image_key},
+        ExpiresIn=IMAGE_URL_TTL_SECONDS
+    )
+
+
+def load_image_base64(feedback_data):
+    # Records written before images moved to IMAGES_BUCKET carry it inline
+    if feedback_data.get('imageBase64'):
+        return feedback_data['imageBase64']
+    image_obj = s3.get_object(Bucket=IMAGES_BUCKET, Key=feedback_data['imageKey'])
+    content_type = feedback_data.get('imageContentType', 'image/jpeg')
+    encoded = base64.b64encode(image_obj['Body'].read()).decode('ascii')
+    return f"data:{content_type};base64,{encoded}"
+
+
+def url_epoch(include_images):
+    # Image URLs in a page expire after IMAGE_URL_TTL_SECONDS, so a cached
+    # page may only be revalidated for half of that: the epoch is part of
+    # the ETag and starts a new version every TTL/2 seconds
+    if include_images == 'none' or not IMAGES_BUCKET:
+        return None
+    return int(time.time() // max(1, IMAGE_URL_TTL_SECONDS // 2))
+
+
+def max_age(include_images):
+    if url_epoch(include_images) is None:
+        return CACHE_MAX_AGE
+    return min(CACHE_MAX_AGE, IMAGE_URL_TTL_SECONDS // 2)
+
+
+def to_item(feedback_data, include_images):
+    item = {
+        'id': feedback_data.get('imageId', ''),
+        'timestamp': feedback_data.get('timestamp', ''),
+        'imageKey': feedback_data.get('imageKey')
+    }
+    # Text and typed analysis fields, as far as the query projected them
+    for field in ('feedback', 'scores', 'ingredients', 'alternatives'):
+        if feedback_data.get(field) is not None:
+            item[field] = feedback_data[field]
+    if include_images == 'none':
+        return item
+
+    if feedback_data.get('imageKey') and IMAGES_BUCKET:
+        item['imageUrl'] = image_url(feedback_data['imageKey'])
+    if include_images == 'thumb':
+        if 'thumbnailBase64' in feedback_data:
+            item['thumbnailBase64'] = feedback_data['thumbnailBase64']
+    else:
+        # Full images inline; the page limit bounds the response size
+        item['imageBase64'] = load_image_base64(feedback_data)
+    return item
+
 
 def lambda_handler(event, context):
+    if aws_clients.is_warmup(event):
+        return aws_clients.warmup_response()
+
+    metrics = instrumentation.RequestMetrics('get_user_history', context)
+    try:
+        response = handle_request(event, metrics)
+        metrics.set_property('statusCode', response['statusCode'])
+        metrics.set_bytes('responseBytes', len(response['body']))
+        return response
+    finally:
+        metrics.emit()
+
+
+def handle_request(event, metrics):
     try:
         # Get user ID from path parameters
-        user_id = event.get('pathParameters', {}).get('userId')
+        user_id = (event.get('pathParameters') or {}).get('userId')
         if not user_id:
             user_id = 'anonymous'  # Default user ID if not provided
-        
-        print(f"Fetching history for user: {user_id}")
-        
-        # List objects in the feedback bucket with user_id prefix
-        response = s3.list_objects_v2(
-            Bucket=FEEDBACK_BUCKET,
-            Prefix=f"{user_id}/"
-        )
-        
-        # Extract feedback files
-        history_items = []
-        if 'Contents' in response:
-            for item in response['Contents']:
-                if item['Key'].endswith('_feedback.json'):
-                    # Get the feedback file content
-                    feedback_obj = s3.get_object(
-                        Bucket=FEEDBACK_BUCKET,
-                        Key=item['Key']
-                    )
-                    feedback_data = json.loads(feedback_obj['Body'].read().decode('utf-8'))
-                    
-                    # Add to history items (now including the base64 image)
-                    history_items.append({
-                        'id': feedback_data.get('imageId', ''),
-                        'timestamp': feedback_data.get('timestamp', ''),
-                        'feedback': feedback_data.get('feedback', ''),
-                        'imageBase64': feedback_data.get('imageBase64', ''),  # Use base64 data instead of URL
-                    })
-        
-        # Sort by timestamp (newest first)
-        history_items.sort(key=lambda x: x['timestamp'], reverse=True)
-        
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Headers': '*',
-                'Access-Control-Allow-Methods': 'OPTIONS,GET'
-            },
-            'body': json.dumps({
+
+        query = event.get('queryStringParameters') or {}
+        limit = parse_limit(query.get('limit'))
+        token = query.get('nextToken')
+        include_images = parse_include_images(query.get('includeImages'))
+        metadata_only = parse_fields(query.get('fields')) == 'metadata'
+        start = parse_time(query.get('from'), 'from')
+        end = parse_time(query.get('to'), 'to')
+
+        metrics.set_property('userId', user_id)
+        metrics.set_property('includeImages', include_images)
+        metrics.set_property('mealStore', meal_store.MEAL_STORE)
+
+        # The page is a function of the user's latest meal and the query:
+        # a client holding it gets a 304 before any record is fetched
+        store = meal_store.reader(s3, FEEDBACK_BUCKET, dynamodb, executor)
+        with metrics.stage('version'):
+            version = store.version(user_id)
+        etag = None
+        headers = {'Content-Type': 'application/json', **CORS_HEADERS,
+                   'Cache-Control': http_cache.cache_control(max_age(include_images)),
+                   'Vary': 'Accept-Encoding'}
+        if version:
+            etag = http_cache.etag(store.name, version, user_id, sorted(query.items()), url_epoch(include_images))
+            headers['ETag'] = etag
+            matched = http_cache.matching_tag(http_cache.header(event, 'if-none-match'), etag)
+            if matched:
+                metrics.set('notModified', 1)
+                return {'statusCode': 304, 'headers': {**headers, 'ETag': matched}, 'body': ''}
+        metrics.set('notModified', 0)
+
+        with metrics.stage('query'):
+            records, next_cursor = store.query(
+                user_id,
+                start=start,
+                end=end,
+                cursor=decode_token(token) if token else None,
+                limit=limit,
+                metadata_only=metadata_only
+            )
+        metrics.set('records', len(records))
+
+        # Image URLs are local signatures; full images are fetched
+        # concurrently, keeping the page order
+        with metrics.stage('images'):
+            history_items = list(executor.map(lambda r: to_item(r, include_images), records))
+
+        with metrics.stage('serialize'):
+            body = json.dumps({
                 'success': True,
                 'userId': user_id,
-                'historyItems': history_items
+                'historyItems': history_items,
+                'nextToken': encode_token(next_cursor) if next_cursor else None
+            })
+
+        metrics.set_bytes('uncompressedBytes', len(body))
+        encoding = http_cache.negotiate(http_cache.header(event, 'accept-encoding'))
+        with metrics.stage('compress'):
+            response = http_cache.encode({'statusCode': 200, 'headers': headers, 'body': body}, encoding)
+        metrics.set_property('contentEncoding', response['headers'].get('Content-Encoding', 'identity'))
+        return response
+
+    except ValueError as e:
+        metrics.fail(e)
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', **CORS_HEADERS},
+            'body': json.dumps({
+                'success': False,
+                'error': str(e)
             })
         }
-    
+
     except Exception as e:
         print(f"Error fetching user history: {str(e)}")
-        import traceback
         print(f"Traceback: {traceback.format_exc()}")
-        
+        metrics.fail(e)
+
         return {
             'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Headers': '*',
-                'Access-Control-Allow-Methods': 'OPTIONS,GET'
-            },
+            'headers': {'Content-Type': 'application/json', **CORS_HEADERS},
             'body': json.dumps({
                 'success': False,
                 'error': str(e)
             })
-        }
\ No newline at end of file
+        }
+
+
+# With provisioned concurrency, init runs ahead of traffic: build clients now
+if aws_clients.PREWARM_ON_INIT:
+    aws_clients.warm()
@@ -0,0 +1,191 @@
+import json
+import math
+import os
+import re
+from collections import Counter
+
+import aws_clients
+
+# Retrieval of nutrition guideline passages to ground the analysis prompt.
+# The corpus is small and rarely changes, so by default it is searched
+# in-process: build_guideline_index.py turns it into a BM25 index at deploy
+# time (guideline_index.json, shipped with the function) and the index is
+# loaded once per container. GUIDELINE_RETRIEVAL=kb queries the Bedrock
+# knowledge base instead, and 'off' disables retrieval.
+#
+# Artifact: {"version": ..., "k1": 1.2, "b": 0.75,
+#            "passages": [{"title": ..., "text": ...}, ...],
+#            "lengths": [tokens per passage],
+#            "postings": {term: [[passage, term frequency], ...]}}
+INDEX_PATH = os.environ.get('GUIDELINE_INDEX_PATH',
+                            os.path.join(os.path.dirname(os.path.abspath(__file__)), 'guideline_index.json'))
+RETRIEVAL_MODE = os.environ.get('GUIDELINE_RETRIEVAL', 'local').lower()
+KNOWLEDGE_BASE_ID = os.environ.get('KNOWLEDGE_BASE_ID', 'EA6O5SVHWD')
+TOP_K = int(os.environ.get('GUIDELINE_TOP_K', '3'))
+# Query used before anything is known about the meal
+DEFAULT_QUERY = os.environ.get(
+    'GUIDELINE_QUERY', 'balanced healthy plate vegetables whole grains protein healthy fats portion sizes')
+
+# Passages are cut at this many words when the index is built
+PASSAGE_WORDS = 120
+K1 = 1.2
+B = 0.75
+
+STOPWORDS = frozenset(
+    'a an and are as at be by for from has have in is it its of on or that the this to with like '
+    'should include limit choose your you per more'.split())
+
+bedrock_agent_runtime = aws_clients.lazy('bedrock-agent-runtime', prewarm=RETRIEVAL_MODE == 'kb',
+                                         connect_timeout=2, read_timeout=5, retries={'max_attempts': 2})
+
+_index = None
+# Recent results by (mode, query, k); most requests use DEFAULT_QUERY
+_results = {}
+RESULT_CACHE_SIZE = 256
+
+
+def tokenize(text):
+    tokens = []
+    for token in re.findall(r'[a-z0-9]+', text.lower()):
+        if token in STOPWORDS or len(token) < 2:
+            continue
+        # Crude plural folding: 'vegetables' and 'vegetable' match
+        if len(token) > 4 and token.endswith('s') and not token.endswith('ss'):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def split_passages(title, text, max_words=PASSAGE_WORDS):
+    # Paragraph-sized passages of at most max_words, each keeping its title
+    lines = [' '.join(line.split()) for line in text.strip().splitlines() if line.strip()]
+    passages = []
+    current = []
+    for line in lines:
+        if current and len(' '.join(current + [line]).split()) > max_words:
+            passages.append({'title': title, 'text': '\n'.join(current)})
+            current = []
+        current.append(line)
+    if current:
+        passages.append({'title': title, 'text': '\n'.join(current)})
+    return passages
+
+
+def build_index(documents, version):
+    # documents: [{"title": ..., "content": ...}]; runs at deploy time
+    passages = []
+    for document in documents:
+        passages.extend(split_passages(document['title'], document['content']))
+    lengths = []
+    postings = {}
+    for number, passage in enumerate(passages):
+        counts = Counter(tokenize(f"{passage['title']} {passage['text']}"))
+        lengths.append(sum(counts.values()))
+        for term, frequency in sorted(counts.items()):
+            postings.setdefault(term, []).append([number, frequency])
+    return {
+        'version': version,
+        'k1': K1,
+        'b': B,
+        'passages': passages,
+        'lengths': lengths,
+        'postings': postings
+    }
+
+
+def load(path=None):
+    # Reads the index once per container; None if there isn't one
+    global _index
+    if _index is None or path:
+        try:
+            with open(path or INDEX_PATH, encoding='utf-8') as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            print(f"No guideline index at {path or INDEX_PATH}; retrieval disabled")
+            _index = False
+            return None
+        count = len(index['passages'])
+        index['avgLength'] = sum(index['lengths']) / count if count else 0
+        index['idf'] = {term: math.log(1 + (count - len(p) + 0.5) / (len(p) + 0.5))
+                        for term, p in index['postings'].items()}
+        _index = index
+    return _index or None
+
+
+def search(index, query, k=TOP_K):
+    # BM25 over the index; returns [{"title", "text", "score"}], best first
+    scores = {}
+    k1, b = index['k1'], index['b']
+    for term in set(tokenize(query)):
+        idf = index['idf'].get(term)
+        if idf is None:
+            continue
+        for number, frequency in index['postings'][term]:
+            norm = k1 * (1 - b + b * index['lengths'][number] / (index['avgLength'] or 1))
+            scores[number] = scores.get(number, 0.0) + idf * frequency * (k1 + 1) / (frequency + norm)
+    best = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:k]
+    return [{**index['passages'][number], 'score': round(score, 4)} for number, score in best]
+
+
+def search_kb(query, k=TOP_K):
+    # Remote path: the Bedrock knowledge base's vector search
+    response = bedrock_agent_runtime.retrieve(
+        knowledgeBaseId=KNOWLEDGE_BASE_ID,
+        retrievalQuery={'text': query},
+        retrievalConfiguration={'vectorSearchConfiguration': {'numberOfResults': k}}
+    )
+    passages = []
+    for result in response.get('retrievalResults', []):
+        metadata = result.get('metadata') or {}
+        location = result.get('location', {}).get('s3Location', {}).get('uri', '')
+        passages.append({
+            'title': metadata.get('title') or location.rsplit('/', 1)[-1],
+            'text': result.get('content', {}).get('text', ''),
+            'score': result.get('score')
+        })
+    return passages
+
+
+def version():
+    # Part of the analysis cache key: new guidelines mean new analyses
+    if RETRIEVAL_MODE == 'local':
+        index = load()
+        return index['version'] if index else 'none'
+    return RETRIEVAL_MODE
+
+
+def retrieve(query=None, k=TOP_K):
+    # Top-k passages for the query; retrieval problems never fail a request
+    query = query or DEFAULT_QUERY
+    key = (RETRIEVAL_MODE, query, k)
+    if key in _results:
+        return _results[key]
+    try:
+        if RETRIEVAL_MODE == 'local':
+            index = load()
+            passages = search(index, query, k) if index else []
+        elif RETRIEVAL_MODE == 'kb':
+            passages = search_kb(query, k)
+        else:
+            return []
+    except Exception as e:
+        print(f"Guideline retrieval failed: {e}")
+        return []
+    if len(_results) >= RESULT_CACHE_SIZE:
+        _results.pop(next(iter(_results)))
+    _results[key] = passages
+    return passages
+
+
+def prompt_context(passages):
+    # Text placed before the analysis prompt
+    if not passages:
+        return ''
+    sections = '\n\n'.join(f"[{p['title']}]\n{p['text']}" for p in passages)
+    return ("Base your assessment on these nutrition guidelines where they apply:\n\n"
+            f"{sections}\n")
+
+
+# The index is small; read it during init rather than on the first request
+if RETRIEVAL_MODE == 'local':
+    load()
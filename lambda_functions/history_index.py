@@ -0,0 +1,182 @@
+import json
+from datetime import timezone
+
+# Per-user append-only index of feedback records, stored next to them in the
+# feedback bucket as JSON Lines: {user_id}/_index.jsonl
+# Each line is {"imageId": ..., "timestamp": ..., "key": ...}, or for a
+# record compacted into a segment file (feedback_segments)
+# {"imageId": ..., "timestamp": ..., "segment": ..., "block": [offset, length]}
+INDEX_NAME = '_index.jsonl'
+FEEDBACK_SUFFIX = '_feedback.json'
+
+# Concurrent writers (two uploads finishing at once) are resolved with S3
+# conditional writes; the loser re-reads the index and tries again.
+MAX_APPEND_ATTEMPTS = 5
+
+
+def index_key(user_id):
+    return f"{user_id}/{INDEX_NAME}"
+
+
+def feedback_key(user_id, image_id):
+    return f"{user_id}/{image_id}{FEEDBACK_SUFFIX}"
+
+
+def error_code(e):
+    return getattr(e, 'response', {}).get('Error', {}).get('Code', '')
+
+
+def is_missing(e):
+    return error_code(e) in ('NoSuchKey', '404', 'NotFound')
+
+
+def is_conflict(e):
+    # A conditional write lost to a concurrent writer
+    return error_code(e) in ('PreconditionFailed', 'ConditionalRequestConflict', '412', '409')
+
+
+def _parse_lines(raw):
+    entries = []
+    for line in raw.splitlines():
+        line = line.strip()
+        if line:
+            entries.append(json.loads(line))
+    return entries
+
+
+def _read_raw(s3, bucket, user_id):
+    # Returns (body, etag), or (None, None) if the user has no index yet
+    try:
+        obj = s3.get_object(Bucket=bucket, Key=index_key(user_id))
+    except Exception as e:
+        if is_missing(e):
+            return None, None
+        raise
+    return obj['Body'].read().decode('utf-8'), obj.get('ETag')
+
+
+def read_index(s3, bucket, user_id):
+    return read_index_with_etag(s3, bucket, user_id)[0]
+
+
+def read_index_with_etag(s3, bucket, user_id):
+    # (entries, etag); the ETag changes with every append
+    raw, etag = _read_raw(s3, bucket, user_id)
+    if raw is None:
+        return None, None
+    return _parse_lines(raw), etag
+
+
+def _write_raw(s3, bucket, user_id, body, etag):
+    params = {
+        'Bucket': bucket,
+        'Key': index_key(user_id),
+        'Body': body.encode('utf-8'),
+        'ContentType': 'application/x-ndjson'
+    }
+    if etag:
+        params['IfMatch'] = etag
+    else:
+        params['IfNoneMatch'] = '*'
+    s3.put_object(**params)
+
+
+def append_entries(s3, bucket, user_id, entries):
+    lines = ''.join(json.dumps(entry) + '\n' for entry in entries)
+    for attempt in range(MAX_APPEND_ATTEMPTS):
+        raw, etag = _read_raw(s3, bucket, user_id)
+        if raw is None:
+            # First indexed write for this user: seed the index with any
+            # records that already exist so they don't drop out of history
+            new_ids = {entry['imageId'] for entry in entries}
+            existing = [e for e in build_index_from_listing(s3, bucket, user_id)
+                        if e['imageId'] not in new_ids]
+            raw = ''.join(json.dumps(entry) + '\n' for entry in existing)
+        try:
+            _write_raw(s3, bucket, user_id, raw + lines, etag)
+            return
+        except Exception as e:
+            if not is_conflict(e):
+                raise
+            print(f"Index write conflict for {user_id}, retrying (attempt {attempt + 1})")
+    raise RuntimeError(f"Could not append to history index for {user_id}")
+
+
+def append_entry(s3, bucket, user_id, image_id, timestamp):
+    append_entries(s3, bucket, user_id, [{
+        'imageId': image_id,
+        'timestamp': timestamp,
+        'key': feedback_key(user_id, image_id)
+    }])
+
+
+def _record_timestamp(s3, bucket, item):
+    # The record's own timestamp; rewrites (migrate_feedback_images.py)
+    # move LastModified, so it is only used for records without one.
+    # None if the record is gone.
+    try:
+        obj = s3.get_object(Bucket=bucket, Key=item['Key'])
+    except Exception as e:
+        if is_missing(e):
+            return None
+        raise
+    try:
+        timestamp = json.loads(obj['Body'].read().decode('utf-8')).get('timestamp')
+    except ValueError:
+        timestamp = None
+    if isinstance(timestamp, str) and timestamp:
+        return timestamp
+    return item['LastModified'].astimezone(timezone.utc).replace(tzinfo=None).isoformat()
+
+
+def build_index_from_listing(s3, bucket, user_id, executor=None):
+    # Fallback for users whose records predate the index: walk every page of
+    # the listing (list_objects_v2 caps each page at 1000 keys) and read each
+    # record's timestamp, concurrently when given an executor. Records
+    # already compacted are listed from their segment's footer.
+    import feedback_segments
+    entries = []
+    items = []
+    params = {'Bucket': bucket, 'Prefix': f"{user_id}/"}
+    while True:
+        response = s3.list_objects_v2(**params)
+        for item in response.get('Contents', []):
+            key = item['Key']
+            if feedback_segments.is_segment_key(key):
+                entries.extend(feedback_segments.segment_entries(s3, bucket, key))
+            elif key.endswith(FEEDBACK_SUFFIX):
+                items.append(item)
+        if not response.get('IsTruncated'):
+            break
+        params['ContinuationToken'] = response['NextContinuationToken']
+
+    run = executor.map if executor else map
+    for item, timestamp in zip(items, run(lambda item: _record_timestamp(s3, bucket, item), items)):
+        if timestamp is None:
+            continue
+        key = item['Key']
+        entries.append({
+            'imageId': key[len(user_id) + 1:-len(FEEDBACK_SUFFIX)],
+            'timestamp': timestamp,
+            'key': key
+        })
+
+    # A compaction in progress leaves a record in two places; keep one
+    entries = list({entry['imageId']: entry for entry in entries}.values())
+    entries.sort(key=lambda e: (e['timestamp'], e['imageId']))
+    return entries
+
+
+def write_index(s3, bucket, user_id, entries):
+    # Only creates the index; a concurrent append that got there first wins
+    body = ''.join(json.dumps(entry) + '\n' for entry in entries)
+    try:
+        _write_raw(s3, bucket, user_id, body, None)
+    except Exception as e:
+        print(f"Could not write history index for {user_id}: {e}")
+
+
+def replace_index(s3, bucket, user_id, entries, etag):
+    # Rewrites the whole index (compaction); raises on a conflict, which
+    # is_conflict() tells apart, if it changed since it was read with etag
+    _write_raw(s3, bucket, user_id, ''.join(json.dumps(entry) + '\n' for entry in entries), etag)
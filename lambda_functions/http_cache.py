@@ -0,0 +1,120 @@
+import base64
+import gzip
+import hashlib
+import json
+import os
+
+# Conditional requests and compressed bodies for API Gateway responses.
+#
+# An ETag names a version of a resource; a client that sends it back in
+# If-None-Match gets a bodiless 304 while the version is unchanged. The
+# tag sent with a compressed body carries the encoding as a suffix
+# ("<hash>-gzip"), as the compressed bytes are a different representation,
+# and matching ignores the suffix, so a client keeps revalidating the same
+# version whichever encoding it cached.
+#
+# Bodies are compressed with brotli when the client accepts it and the
+# module is installed (it isn't part of the Lambda runtime), otherwise
+# gzip, and returned base64-encoded with isBase64Encoded, which API Gateway
+# decodes to binary for the client.
+
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '1024'))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', '6'))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', '5'))
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ENCODINGS = ('br', 'gzip') if brotli else ('gzip',)
+
+
+def header(event, name):
+    # Request header value; HTTP API events use lowercase names, REST API
+    # events keep the client's case
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def etag(*parts):
+    # Strong validator from the parts that determine the representation
+    digest = hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode('utf-8'))
+    return f'"{digest.hexdigest()[:32]}"'
+
+
+def _base(tag):
+    tag = tag.strip()
+    if tag.startswith('W/'):
+        tag = tag[2:]
+    for encoding in ('br', 'gzip'):
+        if tag.endswith(f'-{encoding}"'):
+            return tag[:-len(encoding) - 2] + '"'
+    return tag
+
+
+def matching_tag(if_none_match, current):
+    # The tag of If-None-Match naming the current version (weak comparison,
+    # as If-None-Match uses), or None
+    if not if_none_match:
+        return None
+    if if_none_match.strip() == '*':
+        return current
+    for tag in if_none_match.split(','):
+        if _base(tag) == current:
+            return tag.strip()
+    return None
+
+
+def negotiate(accept_encoding):
+    # Best supported encoding the client accepts, or None for identity
+    accepted = {}
+    for part in (accept_encoding or '').split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name:
+            accepted[name.strip().lower()] = quality
+    for encoding in ENCODINGS:
+        if accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+
+def compress(body, encoding):
+    data = body.encode('utf-8')
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    # mtime=0 keeps the output identical for identical bodies
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def encode(response, encoding):
+    # Compresses a response's body when worth it; the ETag gets the
+    # encoding suffix
+    if not encoding or len(response['body']) < COMPRESS_MIN_BYTES:
+        return response
+    headers = dict(response['headers'])
+    headers['Content-Encoding'] = encoding
+    if headers.get('ETag'):
+        headers['ETag'] = headers['ETag'][:-1] + f'-{encoding}"'
+    return {
+        **response,
+        'headers': headers,
+        'body': base64.b64encode(compress(response['body'], encoding)).decode('ascii'),
+        'isBase64Encoded': True
+    }
+
+
+def cache_control(max_age):
+    # Per-user data: browsers may keep it, shared caches may not. Without a
+    # max-age the client revalidates every time (cheap with a 304).
+    return f"private, max-age={max_age}" if max_age > 0 else 'private, no-cache'
@@ -0,0 +1,163 @@
+import base64
+import io
+import os
+
+# Pillow is optional: it is provided by a Lambda layer in production. Without
+# it we still store and analyze the original image, just without a thumbnail
+# or downscaling.
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+# HEIC/HEIF (iPhone default) decoding needs the pillow-heif plugin
+if Image is not None:
+    try:
+        from pillow_heif import register_heif_opener
+        register_heif_opener()
+    except ImportError:
+        pass
+
+THUMBNAIL_MAX_EDGE = int(os.environ.get('THUMBNAIL_MAX_EDGE', '256'))
+THUMBNAIL_QUALITY = int(os.environ.get('THUMBNAIL_QUALITY', '70'))
+
+# Downscaling before model invocation. Beyond ~1568px on the long edge the
+# model resizes the image itself, so larger uploads only cost bytes and time.
+PREPROCESS_ENABLED = os.environ.get('MODEL_IMAGE_PREPROCESS', 'true').lower() == 'true'
+MODEL_IMAGE_MAX_EDGE = int(os.environ.get('MODEL_IMAGE_MAX_EDGE', '1568'))
+MODEL_IMAGE_FORMAT = os.environ.get('MODEL_IMAGE_FORMAT', 'jpeg').lower()
+MODEL_IMAGE_QUALITY = int(os.environ.get('MODEL_IMAGE_QUALITY', '85'))
+
+# Media types the model accepts as-is
+MODEL_MEDIA_TYPES = ('image/jpeg', 'image/png', 'image/gif', 'image/webp')
+
+EXTENSIONS = {
+    'image/jpeg': 'jpg',
+    'image/jpg': 'jpg',
+    'image/png': 'png',
+    'image/gif': 'gif',
+    'image/webp': 'webp',
+    'image/heic': 'heic',
+    'image/heif': 'heif'
+}
+
+
+def parse_data_url(image_data):
+    # 'data:image/png;base64,iVBOR...' -> ('image/png', b'...')
+    if not image_data or not isinstance(image_data, str):
+        raise ValueError(f"Invalid image data type: {type(image_data)}")
+
+    if not image_data.startswith('data:image/'):
+        raise ValueError("Image data doesn't have the expected MIME prefix")
+
+    if ',' not in image_data:
+        raise ValueError("Image data doesn't contain the expected base64 separator")
+
+    header, encoded = image_data.split(',', 1)
+    media_type = header[len('data:'):].split(';')[0].strip().lower()
+    if media_type == 'image/jpg':
+        media_type = 'image/jpeg'
+    return media_type, base64.b64decode(encoded)
+
+
+def extension_for(media_type):
+    return EXTENSIONS.get(media_type, 'bin')
+
+
+def image_key(user_id, image_id, media_type):
+    return f"{user_id}/{image_id}.{extension_for(media_type)}"
+
+
+# Images uploaded directly by clients through a presigned POST land under
+# their own prefix, so S3 notifications can target them alone
+UPLOADS_PREFIX = 'uploads/'
+
+
+def upload_key(user_id, image_id, media_type):
+    return f"{UPLOADS_PREFIX}{image_key(user_id, image_id, media_type)}"
+
+
+def parse_upload_key(key):
+    # 'uploads/{user_id}/{image_id}.{ext}' -> (user_id, image_id, media_type)
+    if not key.startswith(UPLOADS_PREFIX):
+        raise ValueError(f"Not an upload key: {key}")
+    user_id, _, filename = key[len(UPLOADS_PREFIX):].rpartition('/')
+    image_id, _, extension = filename.rpartition('.')
+    if not user_id or not image_id:
+        raise ValueError(f"Malformed upload key: {key}")
+    media_type = next((t for t, ext in EXTENSIONS.items() if ext == extension.lower()), None)
+    return user_id, image_id, media_type
+
+
+def make_thumbnail(image_content, max_edge=None):
+    # Returns a small JPEG data URL, or None if it can't be generated
+    if Image is None:
+        return None
+    max_edge = max_edge or THUMBNAIL_MAX_EDGE
+    try:
+        with Image.open(io.BytesIO(image_content)) as img:
+            # Let the JPEG decoder downscale while decoding (much cheaper)
+            img.draft('RGB', (max_edge, max_edge))
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((max_edge, max_edge))
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+            out = io.BytesIO()
+            img.save(out, format='JPEG', quality=THUMBNAIL_QUALITY, optimize=True)
+    except Exception as e:
+        print(f"Could not generate thumbnail: {e}")
+        return None
+    return 'data:image/jpeg;base64,' + base64.b64encode(out.getvalue()).decode('ascii')
+
+
+def prepare_for_model(image_content, media_type):
+    # Returns (bytes, media_type, info) to send to the model: downscaled to
+    # MODEL_IMAGE_MAX_EDGE and re-encoded when that makes the image smaller,
+    # otherwise the original bytes with their real media type
+    info = {
+        'originalBytes': len(image_content),
+        'originalType': media_type,
+        'resized': False
+    }
+
+    if not PREPROCESS_ENABLED or Image is None:
+        if media_type not in MODEL_MEDIA_TYPES:
+            raise ValueError(f"Unsupported image type for analysis: {media_type}")
+        info['sentBytes'] = len(image_content)
+        return image_content, media_type, info
+
+    with Image.open(io.BytesIO(image_content)) as img:
+        info['originalSize'] = list(img.size)
+        needs_resize = max(img.size) > MODEL_IMAGE_MAX_EDGE
+        if not needs_resize and media_type in MODEL_MEDIA_TYPES:
+            info['sentBytes'] = len(image_content)
+            return image_content, media_type, info
+
+        if needs_resize:
+            img.draft('RGB', (MODEL_IMAGE_MAX_EDGE, MODEL_IMAGE_MAX_EDGE))
+        # Phone photos are often stored sideways with an EXIF rotation flag
+        img = ImageOps.exif_transpose(img)
+        if needs_resize:
+            img.thumbnail((MODEL_IMAGE_MAX_EDGE, MODEL_IMAGE_MAX_EDGE))
+            info['resized'] = True
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        info['sentSize'] = list(img.size)
+
+        out = io.BytesIO()
+        if MODEL_IMAGE_FORMAT == 'webp':
+            img.save(out, format='WEBP', quality=MODEL_IMAGE_QUALITY)
+            sent_type = 'image/webp'
+        else:
+            img.save(out, format='JPEG', quality=MODEL_IMAGE_QUALITY, optimize=True)
+            sent_type = 'image/jpeg'
+
+    sent = out.getvalue()
+    if len(sent) >= len(image_content) and media_type in MODEL_MEDIA_TYPES:
+        # Re-encoding didn't help (already well compressed), keep the original
+        info['sentBytes'] = len(image_content)
+        info['resized'] = False
+        return image_content, media_type, info
+
+    info['sentBytes'] = len(sent)
+    return sent, sent_type, info
@@ -0,0 +1,127 @@
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# Per-request instrumentation shared by the Lambda handlers. Each request
+# emits a single structured JSON log line in CloudWatch Embedded Metric
+# Format, so the numbers become metrics without extra API calls:
+#
+#   {"_aws": {...}, "function": "process_image", "coldStart": false,
+#    "decodeMs": 12.1, "modelMs": 8123.4, "s3Calls": 4, "inputTokens": 1602, ...}
+
+NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'SLAAAI')
+# Fraction of requests that are logged; cold starts and errors always are
+SAMPLE_RATE = float(os.environ.get('METRICS_SAMPLE_RATE', '1.0'))
+
+_cold_start = True
+_current = None
+
+
+class RequestMetrics:
+    def __init__(self, function_name, context=None, activate=True):
+        global _cold_start, _current
+        self.function_name = function_name
+        self.start = time.perf_counter()
+        self.cold_start = _cold_start and activate
+        if activate:
+            _cold_start = False
+        self.values = {}
+        self.units = {}
+        self.properties = {}
+        self.error = None
+        self._lock = threading.Lock()
+        if context is not None:
+            self.properties['requestId'] = getattr(context, 'aws_request_id', None)
+        # AWS client calls are attributed to the active request
+        if activate:
+            _current = self
+
+    @contextmanager
+    def stage(self, name):
+        # Times a named stage; repeated stages accumulate
+        stage_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(f"{name}Ms", (time.perf_counter() - stage_start) * 1000, 'Milliseconds')
+
+    def add(self, name, value=1, unit='Count'):
+        with self._lock:
+            self.values[name] = self.values.get(name, 0) + value
+            self.units[name] = unit
+
+    def set(self, name, value, unit='Count'):
+        with self._lock:
+            self.values[name] = value
+            self.units[name] = unit
+
+    def set_bytes(self, name, value):
+        self.set(name, value, 'Bytes')
+
+    def set_property(self, name, value):
+        # Logged for querying, but not published as a metric
+        self.properties[name] = value
+
+    def add_usage(self, usage, prefix=''):
+        # Token usage from a Claude response body ('usage' field); a prefix
+        # such as 'fast' records it as fastInputTokens etc.
+        for field, name in (('input_tokens', 'inputTokens'),
+                            ('output_tokens', 'outputTokens'),
+                            ('cache_read_input_tokens', 'cacheReadInputTokens'),
+                            ('cache_creation_input_tokens', 'cacheWriteInputTokens')):
+            if usage and usage.get(field):
+                self.add(prefix + name[0].upper() + name[1:] if prefix else name, usage[field])
+
+    def fail(self, error):
+        self.error = str(error)
+
+    def as_record(self):
+        record = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': NAMESPACE,
+                    'Dimensions': [['function']],
+                    'Metrics': [{'Name': name, 'Unit': unit} for name, unit in self.units.items()]
+                }]
+            },
+            'function': self.function_name,
+            'coldStart': self.cold_start,
+            **self.properties
+        }
+        for name, value in self.values.items():
+            record[name] = round(value, 1) if isinstance(value, float) else value
+        if self.error:
+            record['error'] = self.error
+        return record
+
+    def emit(self):
+        global _current
+        self.set('totalMs', (time.perf_counter() - self.start) * 1000, 'Milliseconds')
+        if _current is self:
+            _current = None
+        if self.cold_start or self.error or random.random() < SAMPLE_RATE:
+            print(json.dumps(self.as_record()))
+
+
+def current():
+    return _current
+
+
+def _count_call(event_name, **kwargs):
+    # event_name is 'before-call.<service>.<Operation>'
+    metrics = _current
+    if metrics is not None:
+        service = event_name.split('.')[1].split('-')
+        metrics.add(service[0] + ''.join(part.title() for part in service[1:]) + 'Calls')
+
+
+def instrument_client(client):
+    # Counts AWS API calls made through this client against the active request
+    events = getattr(getattr(client, 'meta', None), 'events', None)
+    if events is not None:
+        events.register('before-call', _count_call)
+    return client
@@ -0,0 +1,564 @@
+import json
+import base64
+import uuid
+import time
+import traceback
+from datetime import datetime
+import os
+
+import admission
+import analysis_cache
+import analysis_parser
+import analysis_jobs
+import guideline_index
+import history_index
+import aws_clients
+import image_utils
+import instrumentation
+import meal_stats
+import meal_store
+import model_invoker
+import model_router
+import prompts
+import similarity_index
+
+# Meal analysis shared by the synchronous process_image handler and the
+# asynchronous workers: model invocation, caching and persistence.
+
+# Clients are built on first use (see aws_clients)
+s3 = aws_clients.lazy('s3', connect_timeout=5, read_timeout=5, retries={'max_attempts': 2})
+
+# Runtime client for model invocation. Retries are left to model_invoker,
+# which fits them into the request's deadline and abandons an attempt still
+# running when it ends; the read timeout bounds how long an abandoned call
+# keeps its connection.
+bedrock_runtime = aws_clients.lazy(
+    'bedrock-runtime',
+    connect_timeout=5,
+    read_timeout=model_invoker.MODEL_READ_TIMEOUT_SECONDS,
+    retries={'total_max_attempts': 1}
+)
+
+# Job hand-off: an SQS queue consumed by analysis_worker, or, without a
+# queue, an asynchronous invocation of the worker (or of the caller itself)
+sqs = aws_clients.lazy('sqs')
+lambda_client = aws_clients.lazy('lambda')
+
+# Meal history table, when meal_store uses DynamoDB
+dynamodb = aws_clients.lazy(
+    'dynamodb',
+    prewarm=meal_store.MEAL_STORE == 'dynamodb' or meal_store.DUAL_WRITE,
+    endpoint_url=meal_store.DYNAMODB_ENDPOINT_URL,
+    connect_timeout=5,
+    read_timeout=5,
+    retries={'max_attempts': 3}
+)
+
+# Get environment variables
+IMAGES_BUCKET = os.environ['IMAGES_BUCKET']
+FEEDBACK_BUCKET = os.environ['FEEDBACK_BUCKET']
+ANALYSIS_CACHE_BUCKET = os.environ.get('ANALYSIS_CACHE_BUCKET', FEEDBACK_BUCKET)
+JOBS_BUCKET = os.environ.get('JOBS_BUCKET', FEEDBACK_BUCKET)
+ANALYSIS_QUEUE_URL = os.environ.get('ANALYSIS_QUEUE_URL')
+ANALYSIS_WORKER_FUNCTION = os.environ.get('ANALYSIS_WORKER_FUNCTION')
+
+# Largest image accepted from a direct upload
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', str(20 * 1024 * 1024)))
+
+# Incremental nutrition rollups served by GET /meal-stats
+MEAL_STATS_ENABLED = os.environ.get('MEAL_STATS_ENABLED', 'true').lower() == 'true'
+
+# Streaming jobs flush partial text to the job record this often
+STREAM_FLUSH_INTERVAL_MS = int(os.environ.get('STREAM_FLUSH_INTERVAL_MS', '500'))
+
+# Model to invoke; must be one the account has access to
+MODEL_ID = os.environ.get('MODEL_ID', 'anthropic.claude-3-5-sonnet-20241022-v2:0')
+
+def elapsed_ms(start):
+    return round((time.perf_counter() - start) * 1000, 1)
+
+
+def build_model_body(model_image, model_media_type, prompt_name='analysis', context='', model_id=''):
+    # Static instructions (and guideline context) go in the system prompt,
+    # ahead of the image, so they form a prefix Bedrock can cache (see prompts)
+    prompt = prompts.get(prompt_name)
+    return json.dumps({
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": prompt['maxTokens'],
+        "system": prompts.system_blocks(prompt_name, context, model_id),
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "image",
+                        "source": {
+                            "type": "base64",
+                            "media_type": model_media_type,
+                            "data": base64.b64encode(model_image).decode('ascii')
+                        }
+                    },
+                    {
+                        "type": "text",
+                        "text": prompt['user']
+                    }
+                ]
+            }
+        ]
+    })
+
+
+def body_builder(model_image, model_media_type, prompt_name, context=''):
+    # model_id -> request body, built once per model: whether cache_control
+    # is sent depends on the model (a fallback may differ from the primary)
+    bodies = {}
+
+    def body_for(model_id):
+        if model_id not in bodies:
+            bodies[model_id] = build_model_body(model_image, model_media_type, prompt_name, context, model_id)
+        return bodies[model_id]
+    return body_for
+
+
+def extract_text(response_body):
+    # Claude 3 response format is different
+    if 'content' in response_body:
+        return response_body['content'][0]['text']
+    return response_body.get('completion', '')
+
+
+def invoke_model(model_body, model_id=None):
+    # Returns the text and the token usage reported by the model
+    response = bedrock_runtime.invoke_model(
+        modelId=model_id or MODEL_ID,
+        body=model_body
+    )
+    response_body = json.loads(response['body'].read())
+    return extract_text(response_body), response_body.get('usage', {})
+
+
+def invoke_streaming(model_body, on_text, model_id=None):
+    # Calls on_text(text_so_far) as deltas arrive; returns the full text, the
+    # time to first token in ms and the token usage
+    start = time.perf_counter()
+    response = bedrock_runtime.invoke_model_with_response_stream(
+        modelId=model_id or MODEL_ID,
+        body=model_body
+    )
+    parts = []
+    ttft_ms = None
+    usage = {}
+    for event in response['body']:
+        chunk = event.get('chunk')
+        if not chunk:
+            continue
+        payload = json.loads(chunk['bytes'])
+        if payload.get('type') == 'message_start':
+            usage.update(payload.get('message', {}).get('usage', {}))
+        elif payload.get('type') == 'message_delta':
+            usage.update(payload.get('usage', {}))
+        elif payload.get('type') == 'content_block_delta':
+            text = payload.get('delta', {}).get('text', '')
+            if not text:
+                continue
+            if ttft_ms is None:
+                ttft_ms = elapsed_ms(start)
+            parts.append(text)
+            on_text(''.join(parts))
+    return ''.join(parts), ttft_ms, usage
+
+
+def call_model(body_for, model_id, deadline, limiter=None, on_text=None, fallback_model_id=None):
+    # One model tier through model_invoker; body_for(model_id) gives the
+    # request body. Returns (text, usage, ttft_ms, invocation). Streaming
+    # clients only see the readable part, not the JSON block; a retried or
+    # escalated stream starts over.
+    if on_text:
+        # Only the current attempt reports text: an attempt abandoned at
+        # the deadline may still be streaming
+        latest = [0]
+
+        def attempt(m):
+            latest[0] += 1
+            number = latest[0]
+            return invoke_streaming(
+                body_for(m), lambda t: number == latest[0] and on_text(analysis_parser.visible_text(t)), m)
+
+        try:
+            (text, ttft_ms, usage), invocation = model_invoker.invoke(
+                attempt, model_id, deadline, fallback_model_id, limiter)
+        finally:
+            latest[0] += 1
+        return text, usage, ttft_ms, invocation
+    (text, usage), invocation = model_invoker.invoke(
+        lambda m: invoke_model(body_for(m), m), model_id, deadline, fallback_model_id, limiter)
+    return text, usage, None, invocation
+
+
+def record_budget(metrics, prompt_name, context, image_size, model_id, body):
+    # Estimated token budget of a model call, next to the actual usage
+    budget = prompts.budget(prompt_name, context, image_size, model_id)
+    metrics.set_bytes('modelRequestBytes', len(body))
+    metrics.add('estimatedInputTokens', budget['inputTokens'])
+    metrics.set('maxOutputTokens', budget['maxOutputTokens'])
+    metrics.set('promptCacheEligible', int(budget['cacheEligible']))
+    return budget
+
+
+def run_model(model_image, model_media_type, route, metrics, deadline, limiter=None, on_text=None,
+              guidelines=None, image_size=None):
+    # Runs the routed tiers (model_router) and returns (text, ttft_ms,
+    # invocation, routing). guidelines are the retrieved passages added to
+    # the system prompt.
+    routing = {'route': route, 'tier': 'full', 'escalationReason': None}
+    if route == 'tiered':
+        context = guideline_index.prompt_context(guidelines)
+        fast_body = body_builder(model_image, model_media_type, 'analysis-fast', context)
+        record_budget(metrics, 'analysis-fast', context, image_size, model_router.FAST_MODEL_ID,
+                      fast_body(model_router.FAST_MODEL_ID))
+        try:
+            with metrics.stage('modelFast'):
+                # The full model is the fast tier's fallback
+                text, usage, ttft_ms, invocation = call_model(
+                    fast_body, model_router.FAST_MODEL_ID, deadline, limiter, on_text, fallback_model_id='')
+            metrics.add_usage(usage)
+            metrics.add_usage(usage, 'fast')
+            fast_analysis = analysis_parser.parse(text)[1]
+            reason = model_router.escalation_reason(text, fast_analysis)
+        except model_invoker.ModelUnavailableError as e:
+            print(f"Fast model unavailable, escalating: {e}")
+            reason = 'fastUnavailable'
+        except ValueError:
+            # The request itself is at fault; the full model would fail too
+            raise
+        except Exception as e:
+            # e.g. AccessDenied or ValidationException when FAST_MODEL_ID
+            # isn't enabled in this account or region: the full model can
+            # still answer
+            print(f"Fast model failed ({history_index.error_code(e) or type(e).__name__}), escalating: {e}")
+            reason = 'fastError'
+        metrics.set('escalated', int(reason is not None))
+        if reason is None:
+            routing['tier'] = 'fast'
+            model_router.count('fast')
+            return text, ttft_ms, invocation, routing
+        print(f"Escalating to {MODEL_ID}: {reason}")
+        metrics.set_property('escalationReason', reason)
+        routing['escalationReason'] = reason
+        model_router.count('escalated')
+        if reason not in ('fastUnavailable', 'fastError') and fast_analysis['ingredients']:
+            # The fast tier's ingredients make a better retrieval query
+            with metrics.stage('retrieve'):
+                guidelines = guideline_index.retrieve(' '.join(fast_analysis['ingredients'])) or guidelines
+    else:
+        model_router.count('single')
+
+    context = guideline_index.prompt_context(guidelines)
+    model_body = body_builder(model_image, model_media_type, 'analysis', context)
+    record_budget(metrics, 'analysis', context, image_size, MODEL_ID, model_body(MODEL_ID))
+    with metrics.stage('modelFull'):
+        text, usage, ttft_ms, invocation = call_model(model_body, MODEL_ID, deadline, limiter, on_text)
+    metrics.add_usage(usage)
+    metrics.add_usage(usage, 'full')
+    return text, ttft_ms, invocation, routing
+
+
+def build_record(user_id, image_id, image_key, media_type, thumbnail, timestamp, agent_response, cache_hit,
+                 analysis=None, similar=None):
+    # Feedback record with a reference to the stored image and a small
+    # thumbnail instead of the full base64 data. The parsed analysis is
+    # stored as typed fields beside the text. similar names the earlier
+    # meal whose analysis was reused.
+    analysis = analysis or {}
+    return {
+        'userId': user_id,
+        'imageId': image_id,
+        'imageKey': image_key,
+        'imageContentType': media_type,
+        'thumbnailBase64': thumbnail,
+        'timestamp': timestamp,
+        'feedback': agent_response,
+        'ingredients': analysis.get('ingredients'),
+        'scores': analysis.get('scores'),
+        'alternatives': analysis.get('alternatives'),
+        'analysisFormat': analysis.get('format'),
+        'cacheHit': cache_hit,
+        'similarTo': similar['imageId'] if similar else None
+    }
+
+
+def save_feedback(user_id, image_id, image_key, media_type, thumbnail, timestamp, agent_response, cache_hit,
+                  analysis=None, similar=None):
+    feedback_data = build_record(user_id, image_id, image_key, media_type, thumbnail, timestamp,
+                                 agent_response, cache_hit, analysis, similar)
+    meal_store.save(feedback_data, s3, FEEDBACK_BUCKET, dynamodb)
+    update_stats(user_id, [feedback_data])
+    return feedback_data
+
+
+def save_feedback_batch(records, executor=None):
+    # Persists the records of a batch together: one history index append
+    # (or batch_write_item) and one rollup update per user
+    meal_store.save_many(records, s3, FEEDBACK_BUCKET, dynamodb, executor)
+    by_user = {}
+    for record in records:
+        by_user.setdefault(record['userId'], []).append(record)
+    for user_id, user_records in by_user.items():
+        update_stats(user_id, user_records)
+
+
+def update_stats(user_id, records):
+    # Fold the meals into the user's daily/weekly/monthly rollups; a failure
+    # here is repaired by recomputing them (get_meal_stats repair mode)
+    if not MEAL_STATS_ENABLED:
+        return
+    try:
+        meal_stats.record_meals(s3, FEEDBACK_BUCKET, user_id, records,
+                                store=meal_store.reader(s3, FEEDBACK_BUCKET, dynamodb))
+    except Exception as e:
+        print(f"Error updating meal stats for {user_id}: {e}")
+
+
+def store_image(user_id, image_content, media_type):
+    # Store the original bytes once; feedback records only reference them
+    image_id = str(uuid.uuid4())
+    timestamp = datetime.now().isoformat()
+    image_key = image_utils.image_key(user_id, image_id, media_type)
+    s3.put_object(
+        Bucket=IMAGES_BUCKET,
+        Key=image_key,
+        Body=image_content,
+        ContentType=media_type
+    )
+    return image_id, image_key, timestamp
+
+
+def load_upload(image_key, user_id=None):
+    # Reads an image the client uploaded to IMAGES_BUCKET through a presigned
+    # POST; the bytes come straight from S3 instead of a base64 request body
+    key_user_id, image_id, media_type = image_utils.parse_upload_key(image_key)
+    if user_id is not None and key_user_id != user_id:
+        raise ValueError("imageKey does not belong to this user")
+
+    image_obj = s3.get_object(Bucket=IMAGES_BUCKET, Key=image_key)
+    if image_obj.get('ContentLength', 0) > MAX_UPLOAD_BYTES:
+        raise ValueError(f"Uploaded image is larger than {MAX_UPLOAD_BYTES} bytes")
+    media_type = image_obj.get('ContentType') or media_type
+    if not media_type or not media_type.startswith('image/'):
+        raise ValueError(f"Uploaded object is not an image: {media_type}")
+
+    image_content = image_obj['Body'].read()
+    timestamp = datetime.now().isoformat()
+    return key_user_id, image_id, media_type, image_content, timestamp
+
+
+def submit_job(user_id, image_id, image_key, media_type, timestamp, stream, context, detail='auto'):
+    job = analysis_jobs.create_job(s3, JOBS_BUCKET, user_id, image_id, image_key,
+                                   media_type, timestamp, stream, detail=detail)
+    if ANALYSIS_QUEUE_URL:
+        analysis_jobs.enqueue(sqs, ANALYSIS_QUEUE_URL, job)
+    else:
+        lambda_client.invoke(
+            FunctionName=ANALYSIS_WORKER_FUNCTION or context.invoked_function_arn,
+            InvocationType='Event',
+            Payload=json.dumps({'analysisJob': {'jobId': job['jobId']}})
+        )
+    print(f"Submitted analysis job {job['jobId']} for user {user_id}")
+    return job
+
+
+def analyze_image(user_id, image_id, image_key, image_content, media_type, timestamp,
+                  metrics, on_text=None, limiter=None, persist=True, deadline=None, detail='auto'):
+    # Runs the analysis for an image already stored in IMAGES_BUCKET and
+    # persists the feedback record. Passing on_text streams the model output.
+    # Model calls are routed by model_router (detail='detailed' skips the
+    # fast tier) and go through model_invoker within the deadline
+    # (model_invoker.Deadline); a limiter (adaptive_limiter) also bounds
+    # their concurrency. With persist=False the record is returned for
+    # save_feedback_batch.
+    metrics.set_bytes('imageBytes', len(image_content))
+
+    with metrics.stage('thumbnail'):
+        thumbnail = image_utils.make_thumbnail(image_content)
+
+    route = model_router.route(detail, MODEL_ID)
+    metrics.set_property('route', route)
+    prompt_version = prompts.version('analysis')
+    if route == 'tiered':
+        prompt_version += '+' + prompts.version('analysis-fast')
+    metrics.set_property('promptVersion', prompt_version)
+
+    # Identical image + model(s) + prompt + guidelines means an identical analysis
+    cache_model_id = model_router.cache_model_id(route, MODEL_ID)
+    cache_version = f"{prompt_version}:{guideline_index.version()}"
+    with metrics.stage('cacheLookup'):
+        cache_key = analysis_cache.cache_key(image_content, cache_model_id, cache_version)
+        cached = analysis_cache.get(s3, ANALYSIS_CACHE_BUCKET, cache_key)
+
+    # A near-duplicate of an earlier upload of the same user
+    # (similarity_index) is served from the analysis cache entry of that meal
+    image_hash = None
+    similar = None
+    index_snapshot = None
+    if cached is None and similarity_index.ENABLED and analysis_cache.ENABLED:
+        with metrics.stage('similarityLookup'):
+            image_hash = similarity_index.perceptual_hash(image_content)
+            if image_hash is not None:
+                try:
+                    similar, similar_distance, index_snapshot = similarity_index.find(
+                        s3, ANALYSIS_CACHE_BUCKET, user_id, image_hash, f"{cache_model_id}:{cache_version}")
+                except Exception as e:
+                    print(f"Similarity lookup failed: {e}")
+                if similar:
+                    cached = analysis_cache.get(s3, ANALYSIS_CACHE_BUCKET, similar['cacheKey'])
+        if similar and cached is not None:
+            metrics.set('similarityDistance', similar_distance)
+            similar = {'imageId': similar['imageId'], 'distance': similar_distance}
+        else:
+            similar = None
+        metrics.set('similarityHit', int(similar is not None))
+    cache_hit = cached is not None
+    metrics.set('cacheHit', int(cache_hit))
+
+    ttft_ms = None
+    if cache_hit:
+        agent_response = cached['feedback']
+        analysis = cached.get('analysis') or analysis_parser.parse(agent_response)[1]
+        routing = cached.get('routing')
+    else:
+        # Downscale/re-encode before sending; the stored original is untouched
+        with metrics.stage('preprocess'):
+            model_image, model_media_type, image_info = image_utils.prepare_for_model(image_content, media_type)
+        metrics.set_bytes('sentImageBytes', image_info['sentBytes'])
+
+        # Nutrition guidelines for the prompt, searched in-process by default
+        with metrics.stage('retrieve'):
+            guidelines = guideline_index.retrieve()
+        metrics.set('guidelinePassages', len(guidelines))
+
+        with metrics.stage('model'):
+            model_text, ttft_ms, invocation, routing = run_model(
+                model_image, model_media_type, route, metrics, deadline, limiter, on_text, guidelines,
+                image_info.get('sentSize') or image_info.get('originalSize'))
+        if on_text:
+            metrics.set('timeToFirstTokenMs', ttft_ms or 0, 'Milliseconds')
+        metrics.set_property('modelTier', routing['tier'])
+        metrics.set_property('modelId', invocation['modelId'])
+        metrics.set('modelAttempts', invocation['attempts'])
+        metrics.set('modelRetries', invocation['retries'])
+        metrics.set('modelFallback', int(invocation['fallback']))
+
+        with metrics.stage('parse'):
+            agent_response, analysis = analysis_parser.parse(model_text)
+        metrics.set('structuredOutput', int(analysis['format'] == 'json'))
+
+        # A fallback model's answer is served but not cached under the
+        # primary model's key
+        if not invocation['fallback']:
+            analysis_cache.put(s3, ANALYSIS_CACHE_BUCKET, cache_key, {
+                'feedback': agent_response,
+                'analysis': analysis,
+                'modelId': invocation['modelId'],
+                'routing': routing,
+                'promptVersion': prompt_version
+            })
+            if image_hash is not None:
+                similarity_index.add(s3, ANALYSIS_CACHE_BUCKET, user_id, image_hash, image_id, cache_key,
+                                     f"{cache_model_id}:{cache_version}", index_snapshot)
+
+    result = {
+        'feedback': agent_response,
+        'analysis': analysis,
+        'cacheHit': cache_hit,
+        'similarMatch': similar,
+        'routing': routing,
+        'timeToFirstTokenMs': ttft_ms
+    }
+    if persist:
+        with metrics.stage('persist'):
+            save_feedback(user_id, image_id, image_key, media_type, thumbnail,
+                          timestamp, agent_response, cache_hit, analysis, similar)
+    else:
+        result['record'] = build_record(user_id, image_id, image_key, media_type, thumbnail,
+                                        timestamp, agent_response, cache_hit, analysis, similar)
+    return result
+
+
+def run_job(job_id, final_attempt=True):
+    # Executes a submitted analysis job and records the outcome on the job.
+    # Returns True when the job is finished (complete, or failed for good);
+    # with final_attempt=False an error is re-raised so the caller can retry.
+    job = analysis_jobs.get_job(s3, JOBS_BUCKET, job_id)
+    if job is None:
+        print(f"Analysis job {job_id} not found")
+        return True
+    if job['status'] in (analysis_jobs.COMPLETE, analysis_jobs.FAILED):
+        # Duplicate delivery of a job that already finished
+        print(f"Analysis job {job_id} already {job['status']}")
+        return True
+
+    # Jobs can run concurrently within one invocation, so each gets its own
+    # metrics line instead of the invocation's
+    metrics = instrumentation.RequestMetrics('analysis_job', activate=False)
+    metrics.set_property('jobId', job_id)
+    job_start = time.perf_counter()
+    job['status'] = analysis_jobs.RUNNING
+    job['attempts'] = job.get('attempts', 0) + 1
+    analysis_jobs.put_job(s3, JOBS_BUCKET, job)
+    ticket = None
+    deadline = None
+    try:
+        image_obj = s3.get_object(Bucket=IMAGES_BUCKET, Key=job['imageKey'])
+        image_content = image_obj['Body'].read()
+
+        on_text = None
+        if job.get('stream'):
+            last_flush = [time.perf_counter()]
+
+            def on_text(text):
+                # Throttle job record writes; the client polls at a similar rate
+                if (time.perf_counter() - last_flush[0]) * 1000 < STREAM_FLUSH_INTERVAL_MS:
+                    return
+                last_flush[0] = time.perf_counter()
+                job['partialText'] = text
+                analysis_jobs.put_job(s3, JOBS_BUCKET, job)
+
+        # Jobs count against the global model concurrency cap like
+        # synchronous requests. The deadline starts once the slot is held,
+        # so the slot's lease outlasts it.
+        ticket = admission.hold(metrics)
+        deadline = model_invoker.deadline_for()
+        result = analyze_image(job['userId'], job['imageId'], job['imageKey'], image_content,
+                               job['imageContentType'], job['timestamp'], metrics, on_text,
+                               deadline=deadline, detail=job.get('detail', 'auto'))
+
+        job.update({
+            'status': analysis_jobs.COMPLETE,
+            'partialText': result['feedback'],
+            'feedback': result['feedback'],
+            'analysis': result['analysis'],
+            'cacheHit': result['cacheHit'],
+            'similarMatch': result['similarMatch'],
+            'routing': result['routing'],
+            'timeToFirstTokenMs': result['timeToFirstTokenMs'],
+            'totalMs': elapsed_ms(job_start)
+        })
+        analysis_jobs.put_job(s3, JOBS_BUCKET, job)
+        metrics.emit()
+        return True
+
+    except Exception as e:
+        print(f"Analysis job {job_id} failed: {str(e)}")
+        print(f"Traceback: {traceback.format_exc()}")
+        job['error'] = str(e)
+        job['status'] = analysis_jobs.FAILED if final_attempt else analysis_jobs.QUEUED
+        analysis_jobs.put_job(s3, JOBS_BUCKET, job)
+        metrics.fail(e)
+        metrics.emit()
+        if not final_attempt:
+            raise
+        return True
+    finally:
+        if ticket:
+            # Held on while a model call abandoned at the deadline runs
+            ticket.release(deadline.pending() if deadline else ())
@@ -0,0 +1,246 @@
+import json
+from datetime import datetime
+
+import history_index
+import analysis_parser
+
+# Per-user nutrition rollups, stored next to the history index as
+# {user_id}/_stats.json. Each saved meal is folded into its day, ISO week
+# and month bucket, so GET /meal-stats never reads raw history:
+#
+#   {"periods": {"day": {"2024-01-05": bucket}, "week": {"2024-W01": bucket},
+#                "month": {"2024-01": bucket}},
+#    "meals": 123, "recent": [imageId, ...]}
+#
+#   bucket = {"meals": 3,
+#             "scores": {"nutrition": {"sum": 21, "count": 3}, ...},
+#             "ingredients": {"brown rice": 2, ...}}
+#
+# Sums and counts (not averages) keep updates exact. Concurrent updates are
+# resolved with S3 conditional writes, like the history index.
+#
+# Saving a meal never reads the user's history: a new user's rollups are
+# created from their first meals, and a user who has history but no
+# rollups is skipped. Their rollups are seeded in bulk by
+# backfill_meal_store.py --target stats, or by the first GET /meal-stats
+# (build_missing); recompute() rebuilds and replaces them as a repair path.
+STATS_NAME = '_stats.json'
+PERIODS = ('day', 'week', 'month')
+
+# Image ids of the last updates, so a retried job isn't counted twice
+RECENT_IDS = 200
+# Ingredient counters kept per bucket; the least frequent are dropped
+MAX_INGREDIENTS = 200
+MAX_UPDATE_ATTEMPTS = 5
+# Newest records checked after seeding for meals saved meanwhile (at most
+# RECENT_IDS, the ids a seeded document remembers)
+CATCH_UP_PAGE = 20
+
+
+def stats_key(user_id):
+    return f"{user_id}/{STATS_NAME}"
+
+
+def period_keys(timestamp):
+    moment = datetime.fromisoformat(timestamp)
+    year, week, _ = moment.isocalendar()
+    return {
+        'day': moment.strftime('%Y-%m-%d'),
+        'week': f"{year}-W{week:02d}",
+        'month': moment.strftime('%Y-%m')
+    }
+
+
+def empty_stats():
+    return {'periods': {period: {} for period in PERIODS}, 'meals': 0, 'recent': []}
+
+
+def _normalize(ingredient):
+    return ' '.join(str(ingredient).lower().split())
+
+
+def _add_to_bucket(bucket, record):
+    bucket['meals'] = bucket.get('meals', 0) + 1
+    scores = bucket.setdefault('scores', {})
+    for field, score in (record.get('scores') or {}).items():
+        if score is None:
+            continue
+        totals = scores.setdefault(field, {'sum': 0, 'count': 0})
+        totals['sum'] += score
+        totals['count'] += 1
+    ingredients = bucket.setdefault('ingredients', {})
+    for ingredient in {_normalize(i) for i in record.get('ingredients') or [] if str(i).strip()}:
+        ingredients[ingredient] = ingredients.get(ingredient, 0) + 1
+    if len(ingredients) > MAX_INGREDIENTS:
+        kept = sorted(ingredients.items(), key=lambda item: -item[1])[:MAX_INGREDIENTS]
+        bucket['ingredients'] = dict(kept)
+
+
+def add_meal(stats, record):
+    # Folds one meal record into the rollups (in place)
+    try:
+        keys = period_keys(record['timestamp'])
+    except (KeyError, TypeError, ValueError):
+        print(f"Skipping meal without a usable timestamp: {record.get('imageId')}")
+        return stats
+    for period, key in keys.items():
+        _add_to_bucket(stats['periods'][period].setdefault(key, {}), record)
+    stats['meals'] += 1
+    if record.get('imageId'):
+        stats['recent'] = (stats['recent'] + [record['imageId']])[-RECENT_IDS:]
+    return stats
+
+
+def _read(s3, bucket, user_id):
+    # Returns (stats, etag), or (None, None) if the user has no rollups yet
+    try:
+        obj = s3.get_object(Bucket=bucket, Key=stats_key(user_id))
+    except Exception as e:
+        if history_index.is_missing(e):
+            return None, None
+        raise
+    return json.loads(obj['Body'].read().decode('utf-8')), obj.get('ETag')
+
+
+def _write(s3, bucket, user_id, stats, etag):
+    params = {
+        'Bucket': bucket,
+        'Key': stats_key(user_id),
+        'Body': json.dumps(stats).encode('utf-8'),
+        'ContentType': 'application/json'
+    }
+    if etag:
+        params['IfMatch'] = etag
+    else:
+        params['IfNoneMatch'] = '*'
+    s3.put_object(**params)
+
+
+def read_stats(s3, bucket, user_id):
+    stats, _ = _read(s3, bucket, user_id)
+    return stats
+
+
+def build(records):
+    # Oldest first, so 'recent' ends up holding the newest meals
+    stats = empty_stats()
+    for record in sorted(records, key=lambda r: str(r.get('timestamp'))):
+        add_meal(stats, record)
+    return stats
+
+
+def all_records(store, user_id, page_size=200):
+    # Every raw record of a user, newest first, through the meal store
+    cursor = None
+    while True:
+        records, cursor = store.query(user_id, cursor=cursor, limit=page_size)
+        for record in records:
+            yield record
+        if not cursor:
+            return
+
+
+def record_meal(s3, bucket, record, store=None):
+    return record_meals(s3, bucket, record['userId'], [record], store)
+
+
+def _first_meals(store, user_id, records):
+    # True when the user's history holds nothing but these meals; one page
+    # of metadata, however long the history is
+    if store is None:
+        return True
+    image_ids = {r.get('imageId') for r in records}
+    page, cursor = store.query(user_id, limit=len(image_ids) + 1, metadata_only=True)
+    return not cursor and all(r.get('imageId') in image_ids for r in page)
+
+
+def record_meals(s3, bucket, user_id, records, store=None):
+    # Incremental update for meals saved together: one read-modify-write.
+    # Returns the rollups, or None for a user with older meals and no
+    # rollups yet (see above).
+    for attempt in range(MAX_UPDATE_ATTEMPTS):
+        stats, etag = _read(s3, bucket, user_id)
+        if stats is None:
+            if not _first_meals(store, user_id, records):
+                print(f"No meal stats for {user_id} yet; left to the backfill or the first read")
+                return None
+            stats = empty_stats()
+        # Meals already counted (a duplicate delivery) are skipped
+        counted = set(stats['recent'])
+        new_records = [r for r in records if r.get('imageId') not in counted]
+        if not new_records and etag:
+            return stats
+        for record in new_records:
+            add_meal(stats, record)
+        try:
+            _write(s3, bucket, user_id, stats, etag)
+            return stats
+        except Exception as e:
+            if not history_index.is_conflict(e):
+                raise
+            print(f"Stats write conflict for {user_id}, retrying (attempt {attempt + 1})")
+    raise RuntimeError(f"Could not update meal stats for {user_id}")
+
+
+def seed(s3, bucket, user_id, records, store=None):
+    # Creates a user's rollups from all of their records, only if they
+    # still don't exist, so a meal being recorded at the same time
+    # (record_meals) isn't overwritten. Users without meals get empty
+    # rollups and nothing is stored.
+    stats = build(records)
+    if not stats['meals']:
+        return stats
+    try:
+        _write(s3, bucket, user_id, stats, None)
+    except Exception as e:
+        if not history_index.is_conflict(e):
+            raise
+        # Built meanwhile by someone else
+        return read_stats(s3, bucket, user_id) or stats
+    if store is None:
+        return stats
+    # Meals saved while the records were read were skipped by record_meals
+    # (no rollups yet): they are the newest, so one page finds them
+    page, _ = store.query(user_id, limit=CATCH_UP_PAGE)
+    missed = [r for r in page if r.get('imageId') not in stats['recent']]
+    return record_meals(s3, bucket, user_id, missed, store) if missed else stats
+
+
+def build_missing(s3, bucket, store, user_id):
+    # First read for a user without rollups
+    return seed(s3, bucket, user_id, all_records(store, user_id), store)
+
+
+def recompute(s3, bucket, store, user_id):
+    # Repair mode: rebuild the rollups from every raw record and replace
+    # whatever is stored
+    stats = build(all_records(store, user_id))
+    s3.put_object(
+        Bucket=bucket,
+        Key=stats_key(user_id),
+        Body=json.dumps(stats).encode('utf-8'),
+        ContentType='application/json'
+    )
+    return stats
+
+
+def summarize(stats, period, start=None, end=None, top=10):
+    # API view of one period's buckets, oldest first: average scores and
+    # the most frequent ingredients. start/end are inclusive period keys.
+    buckets = []
+    for key in sorted(stats['periods'].get(period, {})):
+        if (start and key < start) or (end and key > end):
+            continue
+        bucket = stats['periods'][period][key]
+        scores = {}
+        for field in analysis_parser.SCORE_FIELDS:
+            totals = bucket.get('scores', {}).get(field)
+            scores[field] = round(totals['sum'] / totals['count'], 2) if totals and totals['count'] else None
+        ingredients = sorted(bucket.get('ingredients', {}).items(), key=lambda item: (-item[1], item[0]))
+        buckets.append({
+            'period': key,
+            'meals': bucket.get('meals', 0),
+            'scores': scores,
+            'topIngredients': [{'name': name, 'count': count} for name, count in ingredients[:top]]
+        })
+    return buckets
@@ -0,0 +1,333 @@
+import json
+import os
+from decimal import Decimal
+
+import feedback_segments
+import history_index
+
+# Meal history storage behind one interface, with two backends:
+#
+#   's3'        one JSON record per meal in FEEDBACK_BUCKET/{user_id}/, found
+#               through the per-user history index (history_index); older
+#               records are compacted into monthly segment files
+#               (feedback_segments) and read from there
+#   'dynamodb'  one item per meal in MEALS_TABLE, partition key userId and
+#               sort key timestamp, so time ranges and newest-first pages
+#               are served by a single Query
+#
+# MEAL_STORE picks the backend history is read from and written to.
+# MEAL_STORE_DUAL_WRITE also writes every meal to the other backend, which
+# keeps both complete while existing records are backfilled
+# (backfill_meal_store.py) and reads are switched over.
+MEAL_STORE = os.environ.get('MEAL_STORE', 's3').lower()
+DUAL_WRITE = os.environ.get('MEAL_STORE_DUAL_WRITE', 'false').lower() == 'true'
+MEALS_TABLE = os.environ.get('MEALS_TABLE', 'healthy-meal-history')
+# Point the DynamoDB client at DynamoDB Local (or another stand-in)
+DYNAMODB_ENDPOINT_URL = os.environ.get('DYNAMODB_ENDPOINT_URL') or None
+
+BACKENDS = ('s3', 'dynamodb')
+
+# Fields returned by a metadata-only query: everything but the analysis
+# text, lists and the thumbnail, which make up nearly all of a record's
+# size. The numeric scores stay, for dashboards and trends.
+METADATA_FIELDS = ('userId', 'imageId', 'timestamp', 'imageKey', 'imageContentType', 'cacheHit', 'scores')
+
+# batch_write_item takes at most 25 items per request
+BATCH_WRITE_SIZE = 25
+MAX_BATCH_ATTEMPTS = 5
+
+
+def in_range(timestamp, start, end):
+    # start is inclusive, end exclusive; both are ISO 8601 strings
+    return (start is None or timestamp >= start) and (end is None or timestamp < end)
+
+
+def project(record, metadata_only):
+    if not metadata_only:
+        return record
+    return {field: record[field] for field in METADATA_FIELDS if field in record}
+
+
+class S3MealStore:
+    name = 's3'
+
+    def __init__(self, s3, bucket, executor=None):
+        self.s3 = s3
+        self.bucket = bucket
+        # Records on a page are fetched concurrently when given an executor
+        self.executor = executor
+        # Indexes read by version(), reused by the query that follows
+        self._indexes = {}
+
+    def put(self, record):
+        self._put_record(record)
+        # Record the meal in the user's history index so history reads
+        # don't have to list the bucket
+        try:
+            history_index.append_entry(self.s3, self.bucket, record['userId'], record['imageId'], record['timestamp'])
+        except Exception as e:
+            print(f"Error updating history index for {record['userId']}: {e}")
+
+    def put_many(self, records):
+        # Records are separate objects, but each user's index gets a single
+        # append for all of them
+        if self.executor:
+            list(self.executor.map(self._put_record, records))
+        else:
+            for record in records:
+                self._put_record(record)
+        by_user = {}
+        for record in records:
+            by_user.setdefault(record['userId'], []).append({
+                'imageId': record['imageId'],
+                'timestamp': record['timestamp'],
+                'key': history_index.feedback_key(record['userId'], record['imageId'])
+            })
+        for user_id, entries in by_user.items():
+            try:
+                history_index.append_entries(self.s3, self.bucket, user_id, entries)
+            except Exception as e:
+                print(f"Error updating history index for {user_id}: {e}")
+
+    def _put_record(self, record):
+        self.s3.put_object(
+            Bucket=self.bucket,
+            Key=history_index.feedback_key(record['userId'], record['imageId']),
+            Body=json.dumps(record),
+            ContentType='application/json'
+        )
+
+    def version(self, user_id):
+        # Changes whenever a meal is added: the ETag of the user's history
+        # index. None for users whose index hasn't been built yet.
+        entries, etag = history_index.read_index_with_etag(self.s3, self.bucket, user_id)
+        if entries is not None:
+            self._indexes[user_id] = entries
+        return etag
+
+    def load_index(self, user_id):
+        if user_id in self._indexes:
+            return self._indexes.pop(user_id)
+        entries = history_index.read_index(self.s3, self.bucket, user_id)
+        if entries is None:
+            # User has records from before the index existed: build it once
+            # from the full listing so the next read skips this step
+            print(f"No history index for user {user_id}, building from listing")
+            entries = history_index.build_index_from_listing(self.s3, self.bucket, user_id, self.executor)
+            if entries:
+                history_index.write_index(self.s3, self.bucket, user_id, entries)
+        return entries
+
+    def fetch(self, key):
+        try:
+            obj = self.s3.get_object(Bucket=self.bucket, Key=key)
+        except Exception as e:
+            if history_index.is_missing(e):
+                print(f"Feedback object missing for index entry: {key}")
+                return None
+            raise
+        return json.loads(obj['Body'].read().decode('utf-8'))
+
+    def fetch_block(self, segment, offset, length):
+        # Records of one segment block by imageId, from a ranged GET
+        return {record['imageId']: record
+                for record in feedback_segments.read_block(self.s3, self.bucket, segment, offset, length)}
+
+    def fetch_page(self, page):
+        # Records of the page's entries, None where missing: one GET per
+        # recent record and one ranged GET per compacted block, all at once
+        blocks = sorted({(e['segment'], *e['block']) for e in page if 'segment' in e})
+        keys = [e['key'] for e in page if 'key' in e]
+        run = self.executor.map if self.executor else map
+        fetched = list(run(lambda task: self.fetch_block(*task) if isinstance(task, tuple) else self.fetch(task),
+                           blocks + keys))
+        by_block = dict(zip(blocks, fetched[:len(blocks)]))
+        by_key = dict(zip(keys, fetched[len(blocks):]))
+        return [by_key[e['key']] if 'key' in e else by_block[(e['segment'], *e['block'])].get(e['imageId'])
+                for e in page]
+
+    def query(self, user_id, start=None, end=None, cursor=None, limit=50, metadata_only=False):
+        # Newest first. cursor is the (timestamp, imageId) of the last record
+        # of the previous page, so pages stay stable while meals are added.
+        # Returns (records, next_cursor).
+        for attempt in range(2):
+            entries = [e for e in self.load_index(user_id) if in_range(e['timestamp'], start, end)]
+            ordered = sorted(entries, key=lambda e: (e['timestamp'], e['imageId']), reverse=True)
+            if cursor:
+                ordered = [e for e in ordered if (e['timestamp'], e['imageId']) < tuple(cursor)]
+            page = ordered[:limit]
+            next_cursor = (page[-1]['timestamp'], page[-1]['imageId']) if len(ordered) > limit else None
+            fetched = self.fetch_page(page)
+            if None not in fetched:
+                break
+            # A compaction may have moved records since the index was read:
+            # once more with the index as it is now
+            self._indexes.pop(user_id, None)
+
+        records = []
+        for entry, record in zip(page, fetched):
+            if record is None:
+                continue
+            # The index is authoritative for ordering fields
+            record.setdefault('imageId', entry['imageId'])
+            record.setdefault('timestamp', entry['timestamp'])
+            records.append(project(record, metadata_only))
+        return records, next_cursor
+
+
+def to_item(record):
+    # DynamoDB has no float type: numbers travel as Decimal
+    from boto3.dynamodb.types import TypeSerializer
+    serializer = TypeSerializer()
+    record = json.loads(json.dumps(record), parse_float=Decimal)
+    return {k: serializer.serialize(v) for k, v in record.items() if v is not None}
+
+
+def _plain(value):
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, dict):
+        return {k: _plain(v) for k, v in value.items()}
+    if isinstance(value, (list, set)):
+        return [_plain(v) for v in value]
+    return value
+
+
+def from_item(item):
+    from boto3.dynamodb.types import TypeDeserializer
+    deserializer = TypeDeserializer()
+    return {k: _plain(deserializer.deserialize(v)) for k, v in item.items()}
+
+
+class DynamoMealStore:
+    name = 'dynamodb'
+
+    def __init__(self, dynamodb, table):
+        self.dynamodb = dynamodb
+        self.table = table
+
+    def put(self, record):
+        self.dynamodb.put_item(TableName=self.table, Item=to_item(record))
+
+    def put_many(self, records):
+        # Batched writes for backfills; unprocessed items are retried. A
+        # batch may not contain the same key twice, so the last one wins.
+        records = list({(r['userId'], r['timestamp']): r for r in records}.values())
+        for i in range(0, len(records), BATCH_WRITE_SIZE):
+            requests = [{'PutRequest': {'Item': to_item(r)}} for r in records[i:i + BATCH_WRITE_SIZE]]
+            for attempt in range(MAX_BATCH_ATTEMPTS):
+                response = self.dynamodb.batch_write_item(RequestItems={self.table: requests})
+                requests = response.get('UnprocessedItems', {}).get(self.table, [])
+                if not requests:
+                    break
+                print(f"Retrying {len(requests)} unprocessed items (attempt {attempt + 1})")
+            else:
+                raise RuntimeError(f"Could not write {len(requests)} items to {self.table}")
+
+    def version(self, user_id):
+        # Key of the newest meal: one single-item Query
+        response = self.dynamodb.query(
+            TableName=self.table,
+            KeyConditionExpression='#uid = :uid',
+            ExpressionAttributeNames={'#uid': 'userId', '#ts': 'timestamp', '#id': 'imageId'},
+            ExpressionAttributeValues={':uid': {'S': user_id}},
+            ProjectionExpression='#ts, #id',
+            ScanIndexForward=False,
+            Limit=1
+        )
+        items = [from_item(item) for item in response.get('Items', [])]
+        if not items:
+            return 'empty'
+        return f"{items[0]['timestamp']}/{items[0].get('imageId', '')}"
+
+    def query(self, user_id, start=None, end=None, cursor=None, limit=50, metadata_only=False):
+        # Same contract as S3MealStore.query. The sort key is the timestamp,
+        # so the range and newest-first order come from the Query itself.
+        names = {'#uid': 'userId'}
+        values = {':uid': {'S': user_id}}
+        condition = '#uid = :uid'
+        if start is not None or end is not None:
+            names['#ts'] = 'timestamp'
+            if start is not None and end is not None:
+                # BETWEEN is inclusive; a record exactly at end is dropped below
+                condition += ' AND #ts BETWEEN :start AND :end'
+                values[':start'] = {'S': start}
+                values[':end'] = {'S': end}
+            elif start is not None:
+                condition += ' AND #ts >= :start'
+                values[':start'] = {'S': start}
+            else:
+                condition += ' AND #ts < :end'
+                values[':end'] = {'S': end}
+
+        params = {
+            'TableName': self.table,
+            'KeyConditionExpression': condition,
+            'ExpressionAttributeNames': names,
+            'ExpressionAttributeValues': values,
+            'ScanIndexForward': False
+        }
+        if metadata_only:
+            for i, field in enumerate(METADATA_FIELDS):
+                names[f"#f{i}"] = field
+            params['ProjectionExpression'] = ', '.join(f"#f{i}" for i in range(len(METADATA_FIELDS)))
+        if cursor:
+            params['ExclusiveStartKey'] = {'userId': {'S': user_id}, 'timestamp': {'S': cursor[0]}}
+
+        # One item more than the page tells whether another page exists
+        records = []
+        while len(records) <= limit:
+            params['Limit'] = limit + 1 - len(records)
+            response = self.dynamodb.query(**params)
+            records.extend(r for r in map(from_item, response.get('Items', []))
+                           if in_range(r['timestamp'], start, end))
+            if 'LastEvaluatedKey' not in response:
+                break
+            params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+        page = records[:limit]
+        next_cursor = (page[-1]['timestamp'], page[-1].get('imageId', '')) if len(records) > limit else None
+        return page, next_cursor
+
+
+def open_store(backend, s3=None, bucket=None, dynamodb=None, executor=None):
+    if backend == 's3':
+        return S3MealStore(s3, bucket, executor)
+    if backend == 'dynamodb':
+        return DynamoMealStore(dynamodb, MEALS_TABLE)
+    raise ValueError(f"Unknown meal store: {backend} (expected one of {', '.join(BACKENDS)})")
+
+
+def reader(s3=None, bucket=None, dynamodb=None, executor=None):
+    return open_store(MEAL_STORE, s3, bucket, dynamodb, executor)
+
+
+def writers(s3=None, bucket=None, dynamodb=None, executor=None):
+    # The primary store first, then the dual-write target
+    stores = [open_store(MEAL_STORE, s3, bucket, dynamodb, executor)]
+    if DUAL_WRITE:
+        stores += [open_store(b, s3, bucket, dynamodb, executor) for b in BACKENDS if b != MEAL_STORE]
+    return stores
+
+
+def save(record, s3=None, bucket=None, dynamodb=None):
+    primary, *secondary = writers(s3, bucket, dynamodb)
+    primary.put(record)
+    for store in secondary:
+        # The secondary copy is caught up by the backfill if this fails
+        try:
+            store.put(record)
+        except Exception as e:
+            print(f"Dual write to {store.name} failed for {record['userId']}/{record['imageId']}: {e}")
+
+
+def save_many(records, s3=None, bucket=None, dynamodb=None, executor=None):
+    # Batched save: one index append per user on S3, batch_write_item on
+    # DynamoDB
+    primary, *secondary = writers(s3, bucket, dynamodb, executor)
+    primary.put_many(records)
+    for store in secondary:
+        try:
+            store.put_many(records)
+        except Exception as e:
+            print(f"Dual write to {store.name} failed for a batch of {len(records)}: {e}")
@@ -0,0 +1,304 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import adaptive_limiter
+import history_index
+
+# Resilient model invocation: every Bedrock call runs inside a deadline
+# budget, retryable failures (throttles, timeouts, 5xx) are retried with a
+# jittered exponential backoff, and a per-model circuit breaker fails fast
+# while the model is unhealthy instead of holding Lambda concurrency on
+# calls that will time out. When FALLBACK_MODEL_ID is set, requests the
+# primary model can't serve go to the fallback model.
+#
+#   text, info = model_invoker.invoke(lambda model_id: call(model_id), MODEL_ID, deadline)
+#
+# info reports the model that answered, attempts made and whether the
+# fallback was used.
+#
+# Each attempt runs on its own thread and is abandoned when the deadline
+# runs out (AttemptTimeout), so a hung call can't hold the request past its
+# budget; the client's read timeout only bounds how long the abandoned
+# call's thread lingers.
+
+# Budget for the model step when there's no Lambda context, and the time
+# kept back from the Lambda timeout to persist the result and respond
+MODEL_DEADLINE_MS = int(os.environ.get('MODEL_DEADLINE_MS', '45000'))
+MODEL_DEADLINE_MARGIN_MS = int(os.environ.get('MODEL_DEADLINE_MARGIN_MS', '3000'))
+# Attempts per model; another attempt is only started if the budget leaves
+# at least MODEL_MIN_ATTEMPT_MS after the backoff
+MODEL_MAX_ATTEMPTS = int(os.environ.get('MODEL_MAX_ATTEMPTS', '4'))
+MODEL_MIN_ATTEMPT_MS = int(os.environ.get('MODEL_MIN_ATTEMPT_MS', '2000'))
+MODEL_RETRY_BASE_MS = int(os.environ.get('MODEL_RETRY_BASE_MS', '250'))
+MODEL_RETRY_MAX_MS = int(os.environ.get('MODEL_RETRY_MAX_MS', '4000'))
+# Read timeout of the Bedrock client: how long a call abandoned at the
+# deadline can keep running
+MODEL_READ_TIMEOUT_SECONDS = int(os.environ.get('MODEL_READ_TIMEOUT_SECONDS', '30'))
+# Cheaper/faster model used when the primary is failing (empty: none)
+FALLBACK_MODEL_ID = os.environ.get('FALLBACK_MODEL_ID', '')
+
+# The circuit opens when at least CIRCUIT_FAILURE_RATE of the last
+# CIRCUIT_WINDOW calls failed (once CIRCUIT_MIN_CALLS were seen), and lets
+# a single probe through after CIRCUIT_COOLDOWN_SECONDS
+CIRCUIT_WINDOW = int(os.environ.get('CIRCUIT_WINDOW', '20'))
+CIRCUIT_MIN_CALLS = int(os.environ.get('CIRCUIT_MIN_CALLS', '10'))
+CIRCUIT_FAILURE_RATE = float(os.environ.get('CIRCUIT_FAILURE_RATE', '0.5'))
+CIRCUIT_COOLDOWN_SECONDS = float(os.environ.get('CIRCUIT_COOLDOWN_SECONDS', '30'))
+
+# Error codes worth another attempt; anything else (validation, access
+# denied, unknown model) fails immediately
+RETRYABLE_CODES = adaptive_limiter.THROTTLE_CODES + (
+    'ModelTimeoutException', 'ModelStreamErrorException', 'InternalServerException',
+    'InternalFailure', 'ServiceUnavailable')
+# Throttles from our own quota say nothing about the model's health: they
+# are retried but don't count towards opening the circuit
+QUOTA_CODES = ('ThrottlingException', 'TooManyRequestsException', 'RequestLimitExceeded',
+               'ProvisionedThroughputExceededException')
+# botocore raises these without an error code; AttemptTimeout is ours
+TIMEOUT_ERRORS = ('ReadTimeoutError', 'ConnectTimeoutError', 'EndpointConnectionError',
+                  'ConnectionClosedError', 'AttemptTimeout')
+
+
+class ModelUnavailableError(Exception):
+    # Raised when no model could answer in time; callers map it to a 503
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = max(1, int(retry_after + 0.999))
+
+
+class Deadline:
+    def __init__(self, budget_ms):
+        self.budget_ms = budget_ms
+        self.expires = time.monotonic() + budget_ms / 1000.0
+        # Threads of attempts abandoned at this deadline
+        self.abandoned = []
+
+    def remaining_ms(self):
+        return max(0.0, (self.expires - time.monotonic()) * 1000)
+
+    def pending(self):
+        # Abandoned attempts whose call is still open
+        return [thread for thread in self.abandoned if thread.is_alive()]
+
+
+class AttemptTimeout(Exception):
+    # An attempt still running when the deadline ran out
+    pass
+
+
+def deadline_for(context=None):
+    # The model budget ends MODEL_DEADLINE_MARGIN_MS before the Lambda times out
+    budget = MODEL_DEADLINE_MS
+    if context is not None and hasattr(context, 'get_remaining_time_in_millis'):
+        budget = min(budget, context.get_remaining_time_in_millis() - MODEL_DEADLINE_MARGIN_MS)
+    return Deadline(max(0, budget))
+
+
+class CircuitBreaker:
+    # closed: calls flow, outcomes are recorded; open: calls are refused
+    # until the cooldown ends; half-open: one probe decides between the two
+    def __init__(self, window=None, min_calls=None, failure_rate=None, cooldown=None):
+        self.window = window or CIRCUIT_WINDOW
+        self.min_calls = min_calls or CIRCUIT_MIN_CALLS
+        self.failure_rate = failure_rate or CIRCUIT_FAILURE_RATE
+        self.cooldown = CIRCUIT_COOLDOWN_SECONDS if cooldown is None else cooldown
+        self.state = 'closed'
+        self.outcomes = deque(maxlen=self.window)
+        self.opened_at = 0.0
+        self.opened = 0
+        self.probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = 'half-open'
+                self.probing = False
+            if self.state == 'half-open' and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != 'closed':
+                print("Model circuit closed")
+                self.state = 'closed'
+                self.outcomes.clear()
+            self.probing = False
+            self.outcomes.append(True)
+
+    def record_throttle(self):
+        with self._lock:
+            self.probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.probing = False
+            if self.state == 'half-open':
+                self._open()
+                return
+            self.outcomes.append(False)
+            failures = self.outcomes.count(False)
+            if (self.state == 'closed' and len(self.outcomes) >= self.min_calls
+                    and failures >= self.failure_rate * len(self.outcomes)):
+                self._open()
+
+    def _open(self):
+        print(f"Model circuit opened for {self.cooldown}s")
+        self.state = 'open'
+        self.opened_at = time.monotonic()
+        self.opened += 1
+
+    def retry_after(self):
+        with self._lock:
+            if self.state == 'closed':
+                return 1
+            return max(1, self.cooldown - (time.monotonic() - self.opened_at))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'failures': self.outcomes.count(False),
+                'calls': len(self.outcomes),
+                'opened': self.opened
+            }
+
+
+# One breaker per model id, shared across warm invocations of a container
+breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker(model_id):
+    with _breakers_lock:
+        if model_id not in breakers:
+            breakers[model_id] = CircuitBreaker()
+        return breakers[model_id]
+
+
+def is_timeout(e):
+    return type(e).__name__ in TIMEOUT_ERRORS
+
+
+def is_retryable(e):
+    return is_timeout(e) or history_index.error_code(e) in RETRYABLE_CODES
+
+
+def backoff_ms(attempt):
+    # Full jitter: uniform in [0, base * 2^attempt], capped
+    return random.uniform(0, min(MODEL_RETRY_MAX_MS, MODEL_RETRY_BASE_MS * 2 ** attempt))
+
+
+def _attempt(fn, model_id, limiter, deadline):
+    # Waits for the call at most until the deadline; past it the call is
+    # left to finish on its own thread and its outcome is dropped. The
+    # limiter slot is taken here, within the deadline, so an abandoned
+    # attempt never starts a call later; a started call keeps its slot
+    # until it returns.
+    if limiter and not limiter.acquire(deadline.remaining_ms() / 1000.0):
+        raise AttemptTimeout(f"No model slot for {model_id} before the deadline")
+    outcome = {}
+    cancelled = threading.Event()
+
+    def run():
+        throttled = False
+        try:
+            if not cancelled.is_set():
+                outcome['result'] = fn(model_id)
+        except Exception as e:
+            throttled = adaptive_limiter.is_throttle(e)
+            outcome['error'] = e
+        finally:
+            if limiter:
+                limiter.release(throttled)
+
+    thread = threading.Thread(target=run, name=f"model-attempt-{model_id}", daemon=True)
+    thread.start()
+    thread.join(deadline.remaining_ms() / 1000.0)
+    if thread.is_alive():
+        cancelled.set()
+        deadline.abandoned.append(thread)
+        raise AttemptTimeout(f"Model call to {model_id} still running at the deadline")
+    if 'error' in outcome:
+        raise outcome['error']
+    if 'result' not in outcome:
+        raise AttemptTimeout(f"Model call to {model_id} cancelled at the deadline")
+    return outcome['result']
+
+
+def _invoke_model_id(fn, model_id, deadline, limiter, info):
+    # Attempts on one model; returns the result or raises the last error
+    circuit = breaker(model_id)
+    last_error = None
+    for attempt in range(MODEL_MAX_ATTEMPTS):
+        if attempt and not circuit.allow():
+            break
+        info['attempts'] += 1
+        try:
+            result = _attempt(fn, model_id, limiter, deadline)
+        except Exception as e:
+            if not is_retryable(e):
+                # The model answered; the request itself is at fault
+                circuit.record_success()
+                raise
+            if history_index.error_code(e) in QUOTA_CODES:
+                circuit.record_throttle()
+            else:
+                circuit.record_failure()
+            last_error = e
+            delay = backoff_ms(attempt)
+            print(f"Model call to {model_id} failed ({history_index.error_code(e) or type(e).__name__}), "
+                  f"attempt {attempt + 1}")
+            if attempt == MODEL_MAX_ATTEMPTS - 1 or deadline.remaining_ms() < delay + MODEL_MIN_ATTEMPT_MS:
+                break
+            info['retries'] += 1
+            if limiter:
+                limiter.record_retry()
+            time.sleep(delay / 1000.0)
+            continue
+        circuit.record_success()
+        return result
+    raise last_error or ModelUnavailableError(f"Model {model_id} is unavailable", circuit.retry_after())
+
+
+def invoke(fn, model_id, deadline=None, fallback_model_id=None, limiter=None):
+    # Calls fn(model_id) and returns (result, info). Non-retryable errors
+    # propagate unchanged; exhausted retries, an open circuit or a spent
+    # budget raise ModelUnavailableError. A limiter (adaptive_limiter)
+    # bounds concurrency across the attempts.
+    deadline = deadline or deadline_for()
+    fallback_model_id = FALLBACK_MODEL_ID if fallback_model_id is None else fallback_model_id
+    models = [model_id] + ([fallback_model_id] if fallback_model_id and fallback_model_id != model_id else [])
+    info = {'modelId': model_id, 'attempts': 0, 'retries': 0, 'fallback': False}
+    retry_after = 1
+    last_error = None
+    for index, current in enumerate(models):
+        circuit = breaker(current)
+        if not circuit.allow():
+            print(f"Model circuit for {current} is {circuit.state}, skipping")
+            retry_after = circuit.retry_after()
+            continue
+        if deadline.remaining_ms() < MODEL_MIN_ATTEMPT_MS:
+            break
+        try:
+            result = _invoke_model_id(fn, current, deadline, limiter, info)
+        except Exception as e:
+            if not is_retryable(e) and not isinstance(e, ModelUnavailableError):
+                raise
+            last_error = e
+            retry_after = circuit.retry_after()
+            continue
+        info['modelId'] = current
+        info['fallback'] = index > 0
+        return result, info
+    if last_error is None and deadline.remaining_ms() < MODEL_MIN_ATTEMPT_MS:
+        raise ModelUnavailableError("Model deadline exceeded", retry_after)
+    reason = f": {last_error}" if last_error is not None else " (circuit open)"
+    raise ModelUnavailableError(f"Model unavailable{reason}", retry_after)
@@ -0,0 +1,91 @@
+import os
+import threading
+
+import analysis_parser
+
+# Tiered model routing. Most meal photos (an apple, a bowl of oatmeal) don't
+# need the large model: a fast model analyzes the image first and rates its
+# own confidence and the plate's complexity in the JSON block. Its answer is
+# kept when it is confident about a simple plate; otherwise, or when the
+# client asks for detailed feedback ("detail": "detailed"), the request is
+# escalated to MODEL_ID.
+#
+# MODEL_ROUTING=single sends everything straight to MODEL_ID.
+ROUTING_MODE = os.environ.get('MODEL_ROUTING', 'tiered').lower()
+FAST_MODEL_ID = os.environ.get('FAST_MODEL_ID', 'anthropic.claude-3-haiku-20240307-v1:0')
+FAST_MAX_TOKENS = int(os.environ.get('FAST_MAX_TOKENS', '1200'))
+# The fast answer is kept only at or above this self-reported confidence...
+ROUTING_MIN_CONFIDENCE = float(os.environ.get('ROUTING_MIN_CONFIDENCE', '0.75'))
+# ...and for at most this many identified ingredients
+ROUTING_MAX_ITEMS = int(os.environ.get('ROUTING_MAX_ITEMS', '6'))
+
+DETAIL_LEVELS = ('auto', 'detailed')
+
+# Appended to the fast model's prompt
+TRIAGE_INSTRUCTIONS = """
+            Add two more fields to the JSON block:
+            "confidence": a number from 0 to 1, how sure you are about the foods identified and the scores,
+            "complexity": "simple" for a single food or a plain plate, "complex" for mixed dishes,
+            many components or anything hard to make out.
+            """
+
+# Per-container counters by outcome, returned with each response
+stats = {
+    'single': 0,
+    'fast': 0,
+    'escalated': 0
+}
+_stats_lock = threading.Lock()
+
+
+def parse_detail(value):
+    # Request field -> 'auto' or 'detailed'
+    if value is True or str(value).lower() in ('detailed', 'detail', 'high', 'true'):
+        return 'detailed'
+    return 'auto'
+
+
+def route(detail, model_id):
+    # 'tiered' (fast model first) or 'single' (model_id only)
+    if ROUTING_MODE != 'tiered' or detail == 'detailed':
+        return 'single'
+    if not FAST_MODEL_ID or FAST_MODEL_ID == model_id:
+        return 'single'
+    return 'tiered'
+
+
+def cache_model_id(route_name, model_id):
+    # Analyses from different routing setups must not share cache entries
+    if route_name == 'single':
+        return model_id
+    return f"tiered:{FAST_MODEL_ID}:{model_id}:{ROUTING_MIN_CONFIDENCE}:{ROUTING_MAX_ITEMS}"
+
+
+def triage(text):
+    # (confidence, complexity) reported by the fast model, None when missing
+    data = analysis_parser.json_block(text) or {}
+    try:
+        confidence = float(data.get('confidence'))
+    except (TypeError, ValueError):
+        confidence = None
+    complexity = data.get('complexity')
+    return confidence, complexity if isinstance(complexity, str) else None
+
+
+def escalation_reason(text, analysis):
+    # Why the fast answer isn't good enough, or None to keep it
+    if analysis.get('format') != 'json':
+        return 'unstructured'
+    confidence, complexity = triage(text)
+    if confidence is None or confidence < ROUTING_MIN_CONFIDENCE:
+        return 'lowConfidence'
+    if (complexity or '').lower() != 'simple':
+        return 'complex'
+    if len(analysis.get('ingredients') or []) > ROUTING_MAX_ITEMS:
+        return 'manyItems'
+    return None
+
+
+def count(outcome):
+    with _stats_lock:
+        stats[outcome] += 1
@@ -1,223 +1,265 @@
 import json
-import boto3
-from botocore.config import Config
-import base64
-import uuid
+import time
+import traceback
 from datetime import datetime
+from urllib.parse import unquote_plus
 import os
 
-s3 = boto3.client('s3', region_name='us-west-2', config=Config(
-    connect_timeout=5,
-    read_timeout=5,
-    retries={'max_attempts': 2}
-))
+import admission
+import aws_clients
+import batch_analysis
+import image_utils
+import instrumentation
+import meal_analysis
+import model_invoker
 
 # Get environment variables
-IMAGES_BUCKET = os.environ['IMAGES_BUCKET']
-FEEDBACK_BUCKET = os.environ['FEEDBACK_BUCKET']
 AGENT_ID = os.environ['AGENT_ID']
 AGENT_ALIAS_ID = os.environ['AGENT_ALIAS_ID']
+MODEL_ID = meal_analysis.MODEL_ID
 
-# Create the correct Bedrock clients
-try:
-    # Management client
-    bedrock = boto3.client('bedrock', region_name='us-west-2', config=Config(
-        connect_timeout=5,
-        read_timeout=50  # Longer timeout for model operations
-    ))
-    # Runtime client for model invocation
-    bedrock_runtime = boto3.client('bedrock-runtime', region_name='us-west-2', config=Config(
-        connect_timeout=5,
-        read_timeout=50  # Longer timeout for model operations
-    ))
-    print("Successfully created bedrock clients")
-except Exception as e:
-    print(f"Error creating bedrock clients: {e}")
+# Model discovery (list_foundation_models) is a control-plane call and stays
+# off the request path: 'cold_start' checks MODEL_ID once per container,
+# 'diagnostics' only runs when an invocation asks for it explicitly
+MODEL_DISCOVERY = os.environ.get('MODEL_DISCOVERY', 'diagnostics')
+MODEL_LIST_TTL_SECONDS = int(os.environ.get('MODEL_LIST_TTL_SECONDS', '3600'))
+
+# Management (control-plane) client, only used for model discovery; it is
+# never built unless discovery runs, not even by pre-warming
+bedrock = aws_clients.lazy('bedrock', prewarm=False, connect_timeout=5, read_timeout=10)
+
+# Memoized result of list_foundation_models, shared by warm invocations
+_model_list = {'modelIds': None, 'fetchedAt': 0.0}
+_model_checked = False
+
+def list_available_models(force=False):
+    age = time.time() - _model_list['fetchedAt']
+    if force or _model_list['modelIds'] is None or age > MODEL_LIST_TTL_SECONDS:
+        model_list = bedrock.list_foundation_models()
+        _model_list['modelIds'] = [m['modelId'] for m in model_list.get('modelSummaries', [])]
+        _model_list['fetchedAt'] = time.time()
+    return _model_list['modelIds']
+
+def check_model_id():
+    # Validate the configured model against the cached list once per container
+    global _model_checked
+    if _model_checked:
+        return
+    _model_checked = True
+    try:
+        if MODEL_ID not in list_available_models():
+            print(f"WARNING: configured MODEL_ID {MODEL_ID} is not in the available model list")
+    except Exception as e:
+        print(f"Could not list models: {e}")
+
+def run_diagnostics():
+    model_ids = list_available_models(force=True)
+    print(f"Available models: {model_ids}")
+    return respond(200, {
+        'success': True,
+        'modelId': MODEL_ID,
+        'modelAvailable': MODEL_ID in model_ids,
+        'availableModels': model_ids
+    })
+
+if MODEL_DISCOVERY == 'cold_start':
+    check_model_id()
+
+def respond(status_code, body, headers=None):
+    return {
+        'statusCode': status_code,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Headers': '*',
+            'Access-Control-Allow-Methods': 'OPTIONS,POST,GET',
+            **(headers or {})
+        },
+        'body': json.dumps(body)
+    }
+
+def process_upload_events(records):
+    # Each upload is analyzed as a job whose id is the image id, so the client
+    # that requested the upload URL can poll GET /analysis/{imageId}. S3
+    # delivers events at least once: an upload that already has a job is
+    # skipped rather than analyzed (and saved to history) again.
+    job_ids = []
+    for record in records:
+        if record.get('eventSource') != 'aws:s3' or not record['eventName'].startswith('ObjectCreated'):
+            continue
+        image_key = unquote_plus(record['s3']['object']['key'])
+        try:
+            user_id, image_id, media_type = image_utils.parse_upload_key(image_key)
+            timestamp = datetime.now().isoformat()
+            try:
+                meal_analysis.analysis_jobs.create_job(
+                    meal_analysis.s3, meal_analysis.JOBS_BUCKET, user_id, image_id, image_key,
+                    media_type or 'image/jpeg', timestamp, job_id=image_id)
+            except Exception as e:
+                if not meal_analysis.history_index.is_conflict(e):
+                    raise
+                print(f"Upload {image_key} already has a job, skipping duplicate event")
+                continue
+            meal_analysis.run_job(image_id)
+            job_ids.append(image_id)
+        except Exception as e:
+            print(f"Error analyzing upload {image_key}: {e}")
+    return {'jobIds': job_ids}
 
 def lambda_handler(event, context):
+    if aws_clients.is_warmup(event):
+        return aws_clients.warmup_response()
+
+    if event.get('diagnostics'):
+        return run_diagnostics()
+    
+    # Asynchronous invocation started by a streaming request when no
+    # analysis queue/worker is configured
+    if event.get('analysisJob'):
+        meal_analysis.run_job(event['analysisJob']['jobId'])
+        return {'jobId': event['analysisJob']['jobId']}
+    
+    # S3 ObjectCreated notifications for direct uploads under uploads/
+    if event.get('Records'):
+        return process_upload_events(event['Records'])
+    
+    metrics = instrumentation.RequestMetrics('process_image', context)
+    try:
+        response = handle_request(event, context, metrics)
+        metrics.set_property('statusCode', response['statusCode'])
+        metrics.set_bytes('responseBytes', len(response['body']))
+        return response
+    finally:
+        metrics.emit()
+
+def handle_request(event, context, metrics):
+    ticket = None
+    deadline = None
     try:
         # Parse request body
+        metrics.set_bytes('requestBytes', len(event.get('body') or ''))
         body = json.loads(event['body'])
         image_data = body.get('image')
+        upload_key = body.get('imageKey')
         user_id = body.get('userId', 'anonymous')
+        stream = bool(body.get('stream'))
+        # "detail": "detailed" goes straight to the full model
+        detail = meal_analysis.model_router.parse_detail(body.get('detail'))
+        metrics.set_property('userId', user_id)
         
-        # Add more detailed error logging
-        print(f"Processing request for user: {user_id}")
-        print(f"Image data length: {len(image_data) if image_data else 'None'}")
-        
-        # Add more detailed validation of the image data format
-        if not image_data or not isinstance(image_data, str):
-            raise ValueError(f"Invalid image data type: {type(image_data)}")
-        
-        if not image_data.startswith('data:image/'):
-            raise ValueError("Image data doesn't have the expected MIME prefix")
+        # Rate limit and global model concurrency (admission), checked
+        # before the image is decoded or stored. A batch costs one token per
+        # item and holds as many slots as it runs model calls at once; a
+        # streamed analysis takes its slot in the worker (run_job).
+        items = body.get('items')
+        cost = len(items) if isinstance(items, list) and items else 1
+        slots = 0 if stream else min(cost, batch_analysis.BATCH_MODEL_CONCURRENCY)
+        try:
+            ticket = admission.admit(user_id, metrics, cost, slots, context)
+        except admission.AdmissionRejected as e:
+            print(f"Rejected analysis for {user_id}: {e}")
+            return respond(429, {
+                'success': False,
+                'error': 'Too many analysis requests, please retry later',
+                'reason': e.reason,
+                'retryAfter': e.retry_after
+            }, {'Retry-After': str(e.retry_after)})
         
-        if ',' not in image_data:
-            raise ValueError("Image data doesn't contain the expected base64 separator")
-
-        print(f"Image data prefix: {image_data[:30]}...") # Log the beginning of the data
+        if 'items' in body:
+            # Batch mode: several images analyzed in one request
+            deadline = model_invoker.deadline_for(context)
+            try:
+                result = batch_analysis.analyze_batch(user_id, body['items'], metrics, deadline, detail)
+            except ValueError as e:
+                metrics.fail(e)
+                return respond(400, {'success': False, 'error': str(e)})
+            with metrics.stage('serialize'):
+                response = respond(200, result)
+            return response
         
-        # More careful image decoding
-        if image_data and ',' in image_data:
-            image_content = base64.b64decode(image_data.split(',')[1])
-            print(f"Successfully decoded image, size: {len(image_content)} bytes")
+        if upload_key:
+            # Image was uploaded straight to S3 through POST /upload-url
+            with metrics.stage('imageGet'):
+                _, image_id, media_type, image_content, timestamp = meal_analysis.load_upload(upload_key, user_id)
+            image_key = upload_key
         else:
-            raise ValueError("Invalid image data format")
-        
-        # Generate IDs and timestamp
-        image_id = str(uuid.uuid4())
-        timestamp = datetime.now().isoformat()
+            # Validate the data URL and decode the image
+            with metrics.stage('decode'):
+                media_type, image_content = image_utils.parse_data_url(image_data)
+            
+            with metrics.stage('imagePut'):
+                image_id, image_key, timestamp = meal_analysis.store_image(user_id, image_content, media_type)
+        metrics.set_property('mediaType', media_type)
         
-        # For direct S3 access (keeping this commented out as reference)
-        # image_key = f"{user_id}/{image_id}.jpg"
-        # s3.put_object(
-        #     Bucket=IMAGES_BUCKET,
-        #     Key=image_key,
-        #     Body=image_content,
-        #     ContentType='image/jpeg'
-        # )
+        if stream:
+            # Analysis continues in a worker; the client polls GET /analysis/{jobId}
+            job = meal_analysis.submit_job(user_id, image_id, image_key, media_type,
+                                           timestamp, True, context, detail)
+            return respond(202, {
+                'success': True,
+                'jobId': job['jobId'],
+                'imageId': image_id,
+                'imageKey': image_key,
+                'status': job['status']
+            })
         
-        # Try to use the invoke_model directly on the bedrock_runtime client
+        deadline = model_invoker.deadline_for(context)
         try:
-            # List available models to help with debugging
-            try:
-                model_list = bedrock.list_foundation_models()
-                print(f"Available models: {[m['modelId'] for m in model_list.get('modelSummaries', [])]}")
-            except Exception as e:
-                print(f"Could not list models: {e}")
-            
-            # Use Claude 3.7 model that you have access to
-            model_id = 'anthropic.claude-3-5-sonnet-20241022-v2:0'
-            
-            print(f"Sending base64 image to model, length: {len(image_data)}")
-            
-            # Create an improved prompt for nutritional analysis
-            analysis_prompt = """
-            Analyze this meal image and provide a comprehensive nutritional assessment:
-
-            1. IDENTIFICATION:
-               - Identify all visible foods and ingredients in this meal
-
-            2. NUTRITIONAL EVALUATION:
-               - Estimate the nutrition score of this meal on a scale of 1-10
-               - How balanced is this meal? Score 1-10
-               - How healthy is this meal overall? Score 1-10
-               - How sustainable is this meal environmentally? Score 1-10
-               
-            3. IMPROVEMENTS:
-               - Identify any unhealthy or unsustainable ingredients
-               - Suggest specific healthier and more sustainable alternatives
-               - Justify each recommendation with brief nutritional facts
-               
-            Format your response in clear sections with headings and bullet points where appropriate.
-            """
-            
-            response = bedrock_runtime.invoke_model(
-                modelId=model_id,
-                body=json.dumps({
-                    "anthropic_version": "bedrock-2023-05-31",
-                    "max_tokens": 1500,
-                    "messages": [
-                        {
-                            "role": "user",
-                            "content": [
-                                {
-                                    "type": "image",
-                                    "source": {
-                                        "type": "base64",
-                                        "media_type": "image/jpeg",
-                                        "data": image_data.split(',')[1]
-                                    }
-                                },
-                                {
-                                    "type": "text",
-                                    "text": analysis_prompt
-                                }
-                            ]
-                        }
-                    ]
-                })
-            )
-            
-            # Process the response
-            response_body = json.loads(response['body'].read())
-            print(f"Model response keys: {response_body.keys()}")
-            
-            # Claude 3 response format is different
-            if 'content' in response_body:
-                agent_response = response_body['content'][0]['text']
-            else:
-                agent_response = response_body.get('completion', '')
-            
-            # Save feedback to S3 (now including base64 image directly)
-            feedback_data = {
-                'userId': user_id,
-                'imageId': image_id,
-                # 'imageUrl': f"s3://{IMAGES_BUCKET}/{image_key}",  # Not needed anymore
-                'imageBase64': image_data,  # Store the original base64 data
-                'timestamp': timestamp,
-                'feedback': agent_response
-            }
-            
-            feedback_key = f"{user_id}/{image_id}_feedback.json"
-            s3.put_object(
-                Bucket=FEEDBACK_BUCKET,
-                Key=feedback_key,
-                Body=json.dumps(feedback_data),
-                ContentType='application/json'
-            )
+            result = meal_analysis.analyze_image(user_id, image_id, image_key, image_content,
+                                                 media_type, timestamp, metrics,
+                                                 deadline=deadline, detail=detail)
             
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*',
-                    'Access-Control-Allow-Headers': '*',
-                    'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
-                },
-                'body': json.dumps({
+            with metrics.stage('serialize'):
+                response = respond(200, {
                     'success': True,
                     'imageId': image_id,
-                    'feedback': agent_response
+                    'imageKey': image_key,
+                    'feedback': result['feedback'],
+                    'analysis': result['analysis'],
+                    'cacheHit': result['cacheHit'],
+                    'similarMatch': result['similarMatch'],
+                    'routing': result['routing'],
+                    'cacheStats': meal_analysis.analysis_cache.stats,
+                    'routingStats': meal_analysis.model_router.stats
                 })
-            }
+            return response
+            
+        except model_invoker.ModelUnavailableError as e:
+            # Model throttled, timing out or circuit open: the image is
+            # stored, the client can retry the analysis later
+            print(f"Model unavailable: {str(e)}")
+            metrics.fail(e)
+            return respond(503, {
+                'success': False,
+                'error': 'The analysis model is temporarily unavailable, please retry',
+                'imageId': image_id,
+                'imageKey': image_key,
+                'retryAfter': e.retry_after
+            }, {'Retry-After': str(e.retry_after)})
             
         except Exception as e:
             print(f"ERROR DETAILS: {str(e)}")
-            import traceback
-            traceback_str = traceback.format_exc()
-            print(f"FULL TRACEBACK: {traceback_str}")
-            
-            # Return more detailed error info (for development only)
-            return {
-                'statusCode': 500,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*',
-                    'Access-Control-Allow-Headers': '*',
-                    'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
-                },
-                'body': json.dumps({
-                    'success': False,
-                    'error': str(e),
-                    'traceback': traceback_str
-                })
-            }
+            print(f"FULL TRACEBACK: {traceback.format_exc()}")
+            metrics.fail(e)
+            return respond(500, {
+                'success': False,
+                'error': str(e)
+            })
             
     except Exception as e:
         print(f"Detailed error: {str(e)}")
-        import traceback
         print(f"Traceback: {traceback.format_exc()}")
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Headers': '*',
-                'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
-            },
-            'body': json.dumps({
-                'success': False,
-                'error': str(e)
-            })
-        } 
\ No newline at end of file
+        metrics.fail(e)
+        return respond(500, {
+            'success': False,
+            'error': str(e)
+        })
+    finally:
+        if ticket:
+            # Held on while a model call abandoned at the deadline runs
+            ticket.release(deadline.pending() if deadline else ())
+
+
+# With provisioned concurrency, init runs ahead of traffic: build clients now
+if aws_clients.PREWARM_ON_INIT:
+    aws_clients.warm()
@@ -0,0 +1,139 @@
+import os
+import textwrap
+
+import analysis_parser
+import model_router
+
+# Prompt registry. Each prompt has a version (part of the analysis cache
+# key: bump it whenever the text changes) and is split the way Bedrock
+# prompt caching wants it: the static instructions go into the system
+# prompt, which comes first in the request and can be reused as a cached
+# prefix, and only the per-request part (the image and a short question)
+# goes into the user message.
+#
+# Text is dedented and stripped once at import, so no indentation from
+# this file is sent (or paid for) with every request.
+
+# cache_control is only sent to models that support Bedrock prompt caching;
+# others reject the field. Neither default model (MODEL_ID Claude 3.5 Sonnet
+# v2, FAST_MODEL_ID Claude 3 Haiku) is one of them, and the system prefix
+# with the shipped guideline index is ~570 tokens (~650 for the fast tier),
+# under the minimums below: the default configuration gets no prompt
+# caching. It takes a model from this list and a prefix of MIN_CACHE_TOKENS
+# or more, e.g. from a larger guideline corpus; budget() reports
+# cacheEligible, recorded per request as promptCacheEligible.
+# benchmarks/bench_prompt_cache.py compares the configurations.
+PROMPT_CACHING = os.environ.get('PROMPT_CACHING', 'true').lower() == 'true'
+CACHING_MODELS = tuple(m for m in os.environ.get(
+    'PROMPT_CACHE_MODELS',
+    'claude-3-7-sonnet,claude-3-5-haiku,claude-sonnet-4,claude-opus-4,claude-haiku-4').split(',') if m)
+# Shortest prefix Bedrock will cache, in tokens (2048 for Haiku models)
+MIN_CACHE_TOKENS = 1024
+MIN_CACHE_TOKENS_HAIKU = 2048
+
+# Rough token estimates: ~3.5 characters per text token, and Anthropic's
+# (width * height) / 750 for images
+CHARS_PER_TOKEN = 3.5
+IMAGE_PIXELS_PER_TOKEN = 750
+
+
+def normalize(text):
+    # Dedented, trailing spaces and surrounding blank lines removed
+    lines = [line.rstrip() for line in textwrap.dedent(text).strip().splitlines()]
+    return '\n'.join(lines)
+
+
+ANALYSIS_INSTRUCTIONS = normalize("""
+    You are a nutrition assistant. Analyze the meal image the user sends and provide a comprehensive
+    nutritional assessment:
+
+    1. IDENTIFICATION:
+       - Identify all visible foods and ingredients in this meal
+
+    2. NUTRITIONAL EVALUATION:
+       - Estimate the nutrition score of this meal on a scale of 1-10
+       - How balanced is this meal? Score 1-10
+       - How healthy is this meal overall? Score 1-10
+       - How sustainable is this meal environmentally? Score 1-10
+
+    3. IMPROVEMENTS:
+       - Identify any unhealthy or unsustainable ingredients
+       - Suggest specific healthier and more sustainable alternatives
+       - Justify each recommendation with brief nutritional facts
+
+    Format your response in clear sections with headings and bullet points where appropriate.
+    """)
+
+PROMPTS = {
+    'analysis': {
+        'version': '4',
+        'system': ANALYSIS_INSTRUCTIONS + '\n\n' + normalize(analysis_parser.OUTPUT_INSTRUCTIONS),
+        'user': 'Analyze this meal.',
+        'maxTokens': 2000
+    },
+    # Fast tier of model_router: same analysis plus the triage fields
+    'analysis-fast': {
+        'version': '4',
+        'system': (ANALYSIS_INSTRUCTIONS + '\n\n' + normalize(analysis_parser.OUTPUT_INSTRUCTIONS)
+                   + '\n' + normalize(model_router.TRIAGE_INSTRUCTIONS)),
+        'user': 'Analyze this meal.',
+        'maxTokens': model_router.FAST_MAX_TOKENS
+    }
+}
+
+
+def get(name):
+    return PROMPTS[name]
+
+
+def version(name):
+    return f"{name}@{PROMPTS[name]['version']}"
+
+
+def supports_caching(model_id):
+    return PROMPT_CACHING and any(marker in model_id for marker in CACHING_MODELS)
+
+
+def system_blocks(name, context='', model_id=''):
+    # The system prompt as content blocks. Guideline context goes after the
+    # instructions, so the prefix stays the same while the context does.
+    # The cache checkpoint marks the end of the whole static prefix.
+    text = PROMPTS[name]['system']
+    if context:
+        text += '\n\n' + normalize(context)
+    block = {'type': 'text', 'text': text}
+    if supports_caching(model_id):
+        block['cache_control'] = {'type': 'ephemeral'}
+    return [block]
+
+
+def estimate_text_tokens(text):
+    return int(len(text) / CHARS_PER_TOKEN + 0.5)
+
+
+def estimate_image_tokens(size):
+    # size is (width, height) of the image as sent
+    if not size:
+        return 0
+    return int(size[0] * size[1] / IMAGE_PIXELS_PER_TOKEN + 0.5)
+
+
+def budget(name, context='', image_size=None, model_id=''):
+    # Token budget of one request: estimated input tokens by part, the
+    # output cap, and whether the system prefix is long enough to be cached
+    prompt = PROMPTS[name]
+    system_text = system_blocks(name, context)[0]['text']
+    system_tokens = estimate_text_tokens(system_text)
+    user_tokens = estimate_text_tokens(prompt['user'])
+    image_tokens = estimate_image_tokens(image_size)
+    min_cache = MIN_CACHE_TOKENS_HAIKU if 'haiku' in model_id else MIN_CACHE_TOKENS
+    return {
+        'prompt': version(name),
+        'systemTokens': system_tokens,
+        'userTokens': user_tokens,
+        'imageTokens': image_tokens,
+        'inputTokens': system_tokens + user_tokens + image_tokens,
+        'maxOutputTokens': prompt['maxTokens'],
+        'cacheablePrefixTokens': system_tokens if supports_caching(model_id) else 0,
+        'cacheEligible': supports_caching(model_id) and system_tokens >= min_cache
+    }
@@ -0,0 +1,222 @@
+import io
+import itertools
+import json
+import math
+import os
+import time
+
+import history_index
+import image_utils
+
+# Reuse of analyses for near-duplicate uploads. The exact-bytes analysis
+# cache (analysis_cache) misses the same photo once it has been re-encoded,
+# resized, rotated by its EXIF tag or lightly cropped or edited (a re-upload
+# from another device or app); a perceptual hash, a 64-bit fingerprint of
+# the image's coarse structure, still matches it. Two photos are
+# near-duplicates when their hashes differ in at most
+# SIMILARITY_MAX_DISTANCE bits.
+#
+# This does not recognize the same meal photographed again: at the default
+# distance, bench_similarity.py's re-shots (a few degrees of rotation, a few
+# percent of crop, +-15% exposure) match about a quarter of the time, and
+# any larger distance already reuses analyses for meals never seen before.
+#
+#   phash  sign of the 8x8 lowest frequencies of a 32x32 DCT, against their
+#          median; robust to re-encoding, resizing and mild edits
+#   dhash  sign of horizontal gradients on a 9x8 grayscale; cheaper, more
+#          sensitive to shifts
+#
+# Each user has an index, _similarity/{user_id}.json in the analysis cache
+# bucket, of the hashes of their analyzed meals with the analysis cache key
+# each was stored under. A lookup loads it into a multi-index hash table,
+# which finds every hash within the distance without comparing against all
+# of them. Only entries made with the current model, prompt and guidelines
+# are searched; a match is served from the analysis cache, so it expires
+# with it.
+#
+# benchmarks/bench_similarity.py measures precision and recall per
+# algorithm and distance on a labeled image set.
+ENABLED = os.environ.get('SIMILARITY_ENABLED', 'true').lower() == 'true'
+ALGORITHM = os.environ.get('SIMILARITY_HASH', 'phash').lower()
+# The largest distance that made no false matches on bench_similarity.py's
+# synthetic set (60 meals, 5 shots each: 6 already reused 1.3% of new
+# meals); measure on real photos before raising it
+MAX_DISTANCE = int(os.environ.get('SIMILARITY_MAX_DISTANCE', '4'))
+# Newest entries kept per user
+MAX_ENTRIES = int(os.environ.get('SIMILARITY_MAX_ENTRIES', '500'))
+INDEX_PREFIX = os.environ.get('SIMILARITY_INDEX_PREFIX', '_similarity/')
+# Entries older than this point at expired analysis cache entries
+ENTRY_TTL_SECONDS = int(os.environ.get('SIMILARITY_ENTRY_TTL_SECONDS', str(7 * 24 * 3600)))
+
+ALGORITHMS = ('phash', 'dhash')
+MAX_WRITE_ATTEMPTS = 5
+
+# Cosine table of the DCT-II, only the 8 lowest frequencies of 32 samples
+_DCT = [[math.cos(math.pi * (2 * x + 1) * u / 64) for x in range(32)] for u in range(8)]
+
+
+def _grayscale(image_content, size):
+    from PIL import Image, ImageOps
+    with Image.open(io.BytesIO(image_content)) as img:
+        # The JPEG decoder can downscale while decoding
+        img.draft('L', (size[0] * 4, size[1] * 4))
+        img = ImageOps.exif_transpose(img).convert('L')
+        return list(img.resize(size, Image.LANCZOS).getdata())
+
+
+def _bits(flags):
+    value = 0
+    for flag in flags:
+        value = (value << 1) | int(flag)
+    return value
+
+
+def dhash(image_content):
+    pixels = _grayscale(image_content, (9, 8))
+    return _bits(pixels[row * 9 + col] > pixels[row * 9 + col + 1] for row in range(8) for col in range(8))
+
+
+def phash(image_content):
+    pixels = _grayscale(image_content, (32, 32))
+    # Separable DCT: rows first, then the 8 lowest frequencies of each column
+    rows = [[sum(c * p for c, p in zip(_DCT[u], pixels[y * 32:y * 32 + 32])) for u in range(8)] for y in range(32)]
+    coefficients = [sum(_DCT[v][y] * rows[y][u] for y in range(32)) for v in range(8) for u in range(8)]
+    # The DC term is the mean brightness; it stays out of the median
+    median = sorted(coefficients[1:])[31]
+    return _bits(c > median for c in coefficients)
+
+
+def perceptual_hash(image_content, algorithm=None):
+    # 64-bit hash of the image, or None if it can't be decoded (or Pillow is
+    # missing)
+    if image_utils.Image is None:
+        return None
+    try:
+        return {'phash': phash, 'dhash': dhash}[algorithm or ALGORITHM](image_content)
+    except Exception as e:
+        print(f"Could not hash image: {e}")
+        return None
+
+
+def distance(a, b):
+    return (a ^ b).bit_count()
+
+
+def _chunk(value, i):
+    return (value >> (16 * i)) & 0xFFFF
+
+
+def _variants(chunk, radius):
+    # The chunk and every value within radius flipped bits of it
+    yield chunk
+    for flips in range(1, radius + 1):
+        for bits in itertools.combinations(range(16), flips):
+            variant = chunk
+            for bit in bits:
+                variant ^= 1 << bit
+            yield variant
+
+
+class MultiIndex:
+    # Multi-index hashing: the 64 bits are split into 4 chunks of 16, each
+    # with its own table. Two hashes within distance d differ in at most
+    # d // 4 bits on at least one chunk (pigeonhole), so a search only looks
+    # up each chunk's variants within d // 4 bits and compares the hashes
+    # found there, not the whole index.
+    CHUNKS = 4
+
+    def __init__(self):
+        self.tables = [{} for _ in range(self.CHUNKS)]
+        self.entries = []
+
+    def add(self, value, item):
+        position = len(self.entries)
+        self.entries.append((value, item))
+        for i, table in enumerate(self.tables):
+            table.setdefault(_chunk(value, i), []).append(position)
+
+    def search(self, value, max_distance):
+        # [(distance, item)], nearest first; also returns how many hashes
+        # were compared
+        candidates = set()
+        for i, table in enumerate(self.tables):
+            for key in _variants(_chunk(value, i), max_distance // self.CHUNKS):
+                candidates.update(table.get(key, ()))
+        found = []
+        for position in candidates:
+            other, item = self.entries[position]
+            d = distance(value, other)
+            if d <= max_distance:
+                found.append((d, item))
+        found.sort(key=lambda pair: pair[0])
+        return found, len(candidates)
+
+
+def index_key(user_id):
+    return f"{INDEX_PREFIX}{user_id}.json"
+
+
+def read(s3, bucket, user_id):
+    # (entries, etag); ([], None) for a user without an index
+    try:
+        obj = s3.get_object(Bucket=bucket, Key=index_key(user_id))
+    except Exception as e:
+        if history_index.is_missing(e):
+            return [], None
+        raise
+    return json.loads(obj['Body'].read().decode('utf-8'))['entries'], obj.get('ETag')
+
+
+def find(s3, bucket, user_id, image_hash, version, max_distance=None):
+    # Nearest earlier meal of the user within max_distance, analyzed with
+    # the same version: (entry, distance) or (None, None). Also returns the
+    # index as read, for add().
+    max_distance = MAX_DISTANCE if max_distance is None else max_distance
+    entries, etag = read(s3, bucket, user_id)
+    oldest = time.time() - ENTRY_TTL_SECONDS
+    index = MultiIndex()
+    for entry in entries:
+        if entry['version'] == version and entry['createdAt'] > oldest:
+            index.add(int(entry['hash'], 16), entry)
+    found, _ = index.search(image_hash, max_distance)
+    if not found:
+        return None, None, (entries, etag)
+    d, entry = found[0]
+    return entry, d, (entries, etag)
+
+
+def add(s3, bucket, user_id, image_hash, image_id, cache_key, version, snapshot=None):
+    # Records an analyzed meal; concurrent writers are resolved with
+    # conditional writes, like history_index. Never fails the request.
+    entry = {
+        'hash': f"{image_hash:016x}",
+        'imageId': image_id,
+        'cacheKey': cache_key,
+        'version': version,
+        'createdAt': round(time.time(), 3)
+    }
+    oldest = time.time() - ENTRY_TTL_SECONDS
+    try:
+        for attempt in range(MAX_WRITE_ATTEMPTS):
+            entries, etag = snapshot if snapshot and attempt == 0 else read(s3, bucket, user_id)
+            entries = [e for e in entries if e['createdAt'] > oldest][-(MAX_ENTRIES - 1):] + [entry]
+            params = {
+                'Bucket': bucket,
+                'Key': index_key(user_id),
+                'Body': json.dumps({'entries': entries}),
+                'ContentType': 'application/json'
+            }
+            if etag:
+                params['IfMatch'] = etag
+            else:
+                params['IfNoneMatch'] = '*'
+            try:
+                s3.put_object(**params)
+                return
+            except Exception as e:
+                if history_index.error_code(e) not in ('PreconditionFailed', 'ConditionalRequestConflict',
+                                                       '412', '409'):
+                    raise
+        print(f"Could not update similarity index for {user_id}: too many conflicts")
+    except Exception as e:
+        print(f"Could not update similarity index for {user_id}: {e}")
@@ -0,0 +1,98 @@
+import json
+import traceback
+from datetime import datetime
+
+import admission
+import aws_clients
+import image_utils
+import instrumentation
+import meal_analysis
+
+# POST /analysis: store the upload, enqueue an analysis job and return its
+# jobId immediately. analysis_worker runs the model; the client polls
+# GET /analysis/{jobId} (get_analysis_status). A job costs the user one
+# token of their rate limit (admission) here; the worker holds the global
+# model slot.
+
+def respond(status_code, body, headers=None):
+    return {
+        'statusCode': status_code,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Headers': '*',
+            'Access-Control-Allow-Methods': 'OPTIONS,POST',
+            **(headers or {})
+        },
+        'body': json.dumps(body)
+    }
+
+def lambda_handler(event, context):
+    if aws_clients.is_warmup(event):
+        return aws_clients.warmup_response()
+
+    metrics = instrumentation.RequestMetrics('submit_analysis', context)
+    try:
+        response = handle_request(event, context, metrics)
+        metrics.set_property('statusCode', response['statusCode'])
+        return response
+    finally:
+        metrics.emit()
+
+def handle_request(event, context, metrics):
+    try:
+        body = json.loads(event['body'])
+        user_id = body.get('userId', 'anonymous')
+        stream = bool(body.get('stream'))
+        metrics.set_property('userId', user_id)
+        
+        # Rate limit only: the job takes its model slot in the worker
+        try:
+            admission.admit(user_id, metrics, 1, 0, context)
+        except admission.AdmissionRejected as e:
+            print(f"Rejected analysis job for {user_id}: {e}")
+            return respond(429, {
+                'success': False,
+                'error': 'Too many analysis requests, please retry later',
+                'reason': e.reason,
+                'retryAfter': e.retry_after
+            }, {'Retry-After': str(e.retry_after)})
+        
+        try:
+            if body.get('imageKey'):
+                # Uploaded straight to S3 through POST /upload-url; the worker
+                # reads it from there, so only check ownership and the key
+                image_key = body['imageKey']
+                key_user_id, image_id, media_type = image_utils.parse_upload_key(image_key)
+                if key_user_id != user_id:
+                    raise ValueError("imageKey does not belong to this user")
+                if media_type is None:
+                    raise ValueError(f"Unsupported image type: {image_key}")
+                timestamp = datetime.now().isoformat()
+            else:
+                media_type, image_content = image_utils.parse_data_url(body.get('image'))
+                image_id, image_key, timestamp = meal_analysis.store_image(user_id, image_content, media_type)
+        except ValueError as e:
+            return respond(400, {'success': False, 'error': str(e)})
+        
+        job = meal_analysis.submit_job(user_id, image_id, image_key, media_type,
+                                       timestamp, stream, context)
+        
+        return respond(202, {
+            'success': True,
+            'jobId': job['jobId'],
+            'imageId': image_id,
+            'imageKey': image_key,
+            'status': job['status']
+        })
+    
+    except Exception as e:
+        print(f"Error submitting analysis: {str(e)}")
+        print(f"Traceback: {traceback.format_exc()}")
+        metrics.fail(e)
+        return respond(500, {'success': False, 'error': str(e)})
+
+
+# With provisioned concurrency, init runs ahead of traffic: build clients now
+if aws_clients.PREWARM_ON_INIT:
+    aws_clients.warm()
@@ -0,0 +1,83 @@
+import boto3
+import json
+import os
+import sys
+import argparse
+
+# Share the image helpers with the Lambda functions
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lambda_functions'))
+import image_utils
+
+# Initialize clients
+s3 = boto3.client('s3')
+
+# One-time migration: move the inline base64 image out of every feedback
+# record into the images bucket, replacing it with imageKey + thumbnail.
+def migrate_record(feedback_bucket, images_bucket, key, dry_run=False):
+    obj = s3.get_object(Bucket=feedback_bucket, Key=key)
+    feedback_data = json.loads(obj['Body'].read().decode('utf-8'))
+
+    image_data = feedback_data.get('imageBase64')
+    if not image_data:
+        return False
+
+    media_type, image_content = image_utils.parse_data_url(image_data)
+    user_id = feedback_data.get('userId') or key.split('/')[0]
+    image_id = feedback_data.get('imageId') or key.split('/')[-1][:-len('_feedback.json')]
+    image_key = image_utils.image_key(user_id, image_id, media_type)
+
+    feedback_data.pop('imageBase64')
+    feedback_data['imageKey'] = image_key
+    feedback_data['imageContentType'] = media_type
+    feedback_data['thumbnailBase64'] = image_utils.make_thumbnail(image_content)
+
+    if dry_run:
+        print(f"Would migrate {key} -> s3://{images_bucket}/{image_key} ({len(image_content)} bytes)")
+        return True
+
+    s3.put_object(
+        Bucket=images_bucket,
+        Key=image_key,
+        Body=image_content,
+        ContentType=media_type
+    )
+    # Only rewrite the record if nobody changed it since we read it
+    s3.put_object(
+        Bucket=feedback_bucket,
+        Key=key,
+        Body=json.dumps(feedback_data),
+        ContentType='application/json',
+        IfMatch=obj['ETag']
+    )
+    print(f"Migrated {key} -> s3://{images_bucket}/{image_key}")
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description='Move inline meal images out of feedback records')
+    parser.add_argument('--feedback-bucket', default='healthy-meal-feedback-bucket')
+    parser.add_argument('--images-bucket', default='healthy-meal-images-bucket')
+    parser.add_argument('--prefix', default='', help='Only migrate keys under this prefix (e.g. a user id)')
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    migrated = 0
+    skipped = 0
+    failed = 0
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=args.feedback_bucket, Prefix=args.prefix):
+        for item in page.get('Contents', []):
+            if not item['Key'].endswith('_feedback.json'):
+                continue
+            try:
+                if migrate_record(args.feedback_bucket, args.images_bucket, item['Key'], args.dry_run):
+                    migrated += 1
+                else:
+                    skipped += 1
+            except Exception as e:
+                failed += 1
+                print(f"Error migrating {item['Key']}: {e}")
+
+    print(f"\nMigrated: {migrated}, already migrated: {skipped}, failed: {failed}")
+
+if __name__ == "__main__":
+    main()
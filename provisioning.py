@@ -0,0 +1,196 @@
+import argparse
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import boto3
+
+# Small provisioning engine shared by setup_aws_resources.py and
+# setup_api_gateway.py. Resources are declared as steps with the steps they
+# depend on; a step starts as soon as its dependencies are done, so
+# independent resources are looked up and created concurrently.
+#
+# Every step is idempotent: check() looks for the resource and returns its
+# outputs (ids, ARNs) when it already exists, and apply() only runs when it
+# doesn't. Running the setup again therefore only reads. In plan mode
+# nothing is created: each step reports whether it exists or would be
+# created, and steps that depend on a resource still to be created can't be
+# looked up and are reported as waiting for it.
+#
+# A step can name the dependency that contains its resource as parent (a
+# route's API, an object's bucket). When the parent is new, the resource
+# can't exist yet, so the step goes straight to apply (or is planned as a
+# create) without looking.
+#
+# Lookups that several steps need (account id, region, list calls covering
+# many resources) go through lookup(), which makes each of them once per run.
+
+WORKERS = 8
+
+clients = {}
+_clients_lock = threading.Lock()
+
+_lookups = {}
+_lookup_locks = {}
+_lookups_lock = threading.Lock()
+
+
+class Step:
+    def __init__(self, name, check, apply=None, depends_on=(), parent=None):
+        # check(outputs) -> outputs of the existing resource, or None
+        # apply(outputs) -> outputs of the created resource
+        # outputs maps the names of finished steps to what they returned
+        self.name = name
+        self.check = check
+        self.apply = apply
+        self.parent = parent
+        self.depends_on = tuple(depends_on) + ((parent,) if parent and parent not in depends_on else ())
+
+
+def client(service):
+    # boto3 clients are thread-safe once built; building them is not
+    with _clients_lock:
+        if service not in clients:
+            clients[service] = boto3.client(service)
+        return clients[service]
+
+
+def error_code(e):
+    return getattr(e, 'response', {}).get('Error', {}).get('Code', '')
+
+
+def pages(call, key, **kwargs):
+    # Every item of a NextToken-paginated list call (API Gateway v2 style)
+    items = []
+    while True:
+        response = call(**kwargs)
+        items.extend(response.get(key, []))
+        if not response.get('NextToken'):
+            return items
+        kwargs['NextToken'] = response['NextToken']
+
+
+def lookup(key, fetch):
+    # fetch() once per key, even when several steps ask at the same time
+    with _lookups_lock:
+        lock = _lookup_locks.setdefault(key, threading.Lock())
+    with lock:
+        if key not in _lookups:
+            _lookups[key] = fetch()
+        return _lookups[key]
+
+
+def forget(key):
+    # Drop a cached lookup after creating something it lists
+    with _lookups_lock:
+        _lookups.pop(key, None)
+
+
+def reset():
+    # Forget every cached lookup, e.g. between runs in one process
+    with _lookups_lock:
+        _lookups.clear()
+
+
+def account_id():
+    return lookup('account_id', lambda: client('sts').get_caller_identity()['Account'])
+
+
+def region():
+    return lookup('region', lambda: boto3.session.Session().region_name)
+
+
+def _order(steps):
+    names = {step.name for step in steps}
+    for step in steps:
+        missing = [d for d in step.depends_on if d not in names]
+        if missing:
+            raise ValueError(f"Step {step.name} depends on unknown steps: {', '.join(missing)}")
+    # Kahn's algorithm, only to reject cycles before anything runs
+    remaining = {step.name: set(step.depends_on) for step in steps}
+    while remaining:
+        ready = [name for name, deps in remaining.items() if not deps]
+        if not ready:
+            raise ValueError(f"Dependency cycle between steps: {', '.join(sorted(remaining))}")
+        for name in ready:
+            del remaining[name]
+        for deps in remaining.values():
+            deps.difference_update(ready)
+
+
+def _run_step(step, outputs, apply, fresh=False):
+    start = time.perf_counter()
+    existing = None if fresh else step.check(outputs)
+    if existing is not None:
+        action, value = 'exists', existing
+    elif not apply:
+        action, value = 'create', None
+    elif step.apply is None:
+        raise RuntimeError(f"{step.name} does not exist and can't be created by this script")
+    else:
+        action, value = 'created', step.apply(outputs)
+    return action, value, round((time.perf_counter() - start) * 1000, 1)
+
+
+def run(steps, apply=False, workers=WORKERS):
+    # Runs the steps in dependency order, independent ones concurrently.
+    # Returns (outputs, results): outputs by step name, and one result per
+    # step {"step", "action", "ms"} in declaration order, where action is
+    # exists, created, create (plan), waiting (plan, on a step to be
+    # created that isn't its parent), failed or skipped (a dependency
+    # failed). A failing step doesn't stop the steps that don't depend on it.
+    _order(steps)
+    outputs = {}
+    results = {}
+    pending = {step.name: step for step in steps}
+    running = {}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        while pending or running:
+            for name, step in list(pending.items()):
+                deps = [results.get(d, {}).get('action') for d in step.depends_on]
+                parent = results.get(step.parent, {}).get('action')
+                if any(action in ('failed', 'skipped') for action in deps):
+                    results[name] = {'step': name, 'action': 'skipped', 'ms': 0}
+                elif parent == 'create':
+                    results[name] = {'step': name, 'action': 'create', 'ms': 0}
+                elif any(action in ('create', 'waiting') for action in deps):
+                    results[name] = {'step': name, 'action': 'waiting', 'ms': 0}
+                elif all(deps):
+                    future = executor.submit(_run_step, step, dict(outputs), apply, parent == 'created')
+                    running[future] = name
+                else:
+                    continue
+                del pending[name]
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    action, value, ms = future.result()
+                except Exception as e:
+                    print(f"[{name}] failed: {e}")
+                    results[name] = {'step': name, 'action': 'failed', 'ms': 0, 'error': str(e)}
+                    continue
+                outputs[name] = value
+                results[name] = {'step': name, 'action': action, 'ms': ms}
+    return outputs, [results[step.name] for step in steps]
+
+
+def report(results):
+    for result in results:
+        print(f"  {result['action']:<8} {result['step']}")
+    failed = [r['step'] for r in results if r['action'] in ('failed', 'skipped')]
+    if failed:
+        print(f"Not provisioned: {', '.join(failed)}")
+    return not failed
+
+
+def arguments(description):
+    # Setup applies by default, as it always has; --plan only reads
+    parser = argparse.ArgumentParser(description=description)
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--plan', action='store_true', help='Only report what exists and what would be created')
+    mode.add_argument('--apply', action='store_true', help='Create missing resources (default)')
+    parser.add_argument('--workers', type=int, default=WORKERS, help='Steps run concurrently')
+    return parser
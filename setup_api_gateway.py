@@ -2,84 +2,92 @@ import boto3
 import json
 import os
 
+import provisioning
+from provisioning import Step, error_code, lookup
+
 # Initialize clients
 api_gateway = boto3.client('apigatewayv2')
 lambda_client = boto3.client('lambda')
 iam = boto3.client('iam')
+s3 = boto3.client('s3')
+events = boto3.client('events')
 
-def create_api_gateway(process_image_lambda_arn, get_history_lambda_arn):
-    # Create HTTP API
-    api_name = 'MealAnalyzerAPI'
-    
-    print(f"Creating API Gateway: {api_name}")
-    
+API_NAME = 'MealAnalyzerAPI'
+STAGE_NAME = '$default'
+# Browsers only let the web app read ETag (history revalidation) and
+# Retry-After (429s from admission control) when they are exposed, and
+# only send If-None-Match after the preflight allows it
+CORS_CONFIGURATION = {
+    'AllowOrigins': ['*'],
+    'AllowMethods': ['POST', 'GET', 'OPTIONS'],
+    'AllowHeaders': ['Content-Type', 'Authorization', 'If-None-Match'],
+    'ExposeHeaders': ['ETag', 'Retry-After'],
+    'MaxAge': 300
+}
+
+# The API is provisioned as idempotent steps (see provisioning.py): the API,
+# one integration and one invoke permission per Lambda function however many
+# routes it serves, the routes, and the stage. Existing resources are found
+# by name, so running the script again creates nothing twice.
+
+def function_label(lambda_arn):
+    # Function name, with the alias or version when the ARN has one
+    return ':'.join(lambda_arn.split(':')[6:]) or lambda_arn
+
+def _apis():
+    return lookup('apis', lambda: provisioning.pages(api_gateway.get_apis, 'Items'))
+
+def find_api(api_name=API_NAME):
+    for api in _apis():
+        if api['Name'] == api_name:
+            return api['ApiId']
+    return None
+
+def create_api(api_name=API_NAME):
+    # Create HTTP API. Its CORS configuration also answers the browser's
+    # OPTIONS preflight requests for every route.
     response = api_gateway.create_api(
         Name=api_name,
         ProtocolType='HTTP',
-        CorsConfiguration={
-            'AllowOrigins': ['*'],
-            'AllowMethods': ['POST', 'GET', 'OPTIONS'],
-            'AllowHeaders': ['Content-Type', 'Authorization'],
-            'MaxAge': 300
-        }
-    )
-    
-    api_id = response['ApiId']
-    print(f"Created API with ID: {api_id}")
-    
-    # Create routes
-    # 1. Route for processing images
-    api_gateway.create_route(
-        ApiId=api_id,
-        RouteKey='POST /analyze-meal',
-        Target=f'integrations/{create_lambda_integration(api_id, process_image_lambda_arn)}'
-    )
-    print("Created route: POST /analyze-meal")
-    
-    # 2. Route for getting meal history
-    api_gateway.create_route(
-        ApiId=api_id,
-        RouteKey='GET /meal-history/{userId}',
-        Target=f'integrations/{create_lambda_integration(api_id, get_history_lambda_arn)}'
-    )
-    print("Created route: GET /meal-history/{userId}")
-    
-    # After creating your routes, add this CORS configuration
-    api_gateway.update_route(
-        ApiId=api_id,
-        RouteKey='GET /meal-history/{userId}',
-        RouteResponseSelectionExpression='$default',
-        AuthorizationType='NONE',
-        Target=f'integrations/{create_lambda_integration(api_id, get_history_lambda_arn)}',
-        ResponseParameters={
-            'method.response.header.Access-Control-Allow-Origin': "'*'",
-            'method.response.header.Access-Control-Allow-Headers': "'Content-Type,X-Amz-Date,Authorization,X-Api-Key'",
-            'method.response.header.Access-Control-Allow-Methods': "'GET,OPTIONS'"
-        }
-    )
-    
-    # Add an OPTIONS method for CORS preflight requests
-    api_gateway.create_route(
-        ApiId=api_id,
-        RouteKey='OPTIONS /meal-history/{userId}',
-        Target=f'integrations/{create_options_integration(api_id)}'
-    )
-    
-    # Create stage and deploy
-    api_gateway.create_stage(
-        ApiId=api_id,
-        StageName='$default',
-        AutoDeploy=True
+        CorsConfiguration=CORS_CONFIGURATION
     )
-    
-    # Get the API endpoint URL
-    api_endpoint = f"https://{api_id}.execute-api.{boto3.session.Session().region_name}.amazonaws.com"
-    print(f"API Gateway endpoint: {api_endpoint}")
-    
-    return api_endpoint
+    print(f"Created API {api_name} with ID: {response['ApiId']}")
+    return response['ApiId']
+
+def _cors_matches(current):
+    # API Gateway may return header names in another case
+    for field, wanted in CORS_CONFIGURATION.items():
+        value = (current or {}).get(field)
+        if isinstance(wanted, list):
+            if sorted(v.lower() for v in value or []) != sorted(v.lower() for v in wanted):
+                return False
+        elif value != wanted:
+            return False
+    return True
+
+def find_cors(api_id):
+    for api in _apis():
+        if api['ApiId'] == api_id:
+            return api_id if _cors_matches(api.get('CorsConfiguration')) else None
+    # Not listed before this run: create_api just set CORS_CONFIGURATION
+    return api_id
+
+def update_cors(api_id):
+    # APIs created by earlier versions of this script keep their old CORS
+    # configuration until it is updated
+    api_gateway.update_api(ApiId=api_id, CorsConfiguration=CORS_CONFIGURATION)
+    print(f"Updated CORS configuration of API {api_id}")
+    return api_id
+
+def find_lambda_integration(api_id, lambda_arn):
+    integrations = lookup(('integrations', api_id),
+                          lambda: provisioning.pages(api_gateway.get_integrations, 'Items', ApiId=api_id))
+    for integration in integrations:
+        if integration.get('IntegrationUri') == lambda_arn:
+            return integration['IntegrationId']
+    return None
 
 def create_lambda_integration(api_id, lambda_arn):
-    # Create integration
     response = api_gateway.create_integration(
         ApiId=api_id,
         IntegrationType='AWS_PROXY',
@@ -87,40 +95,325 @@ def create_lambda_integration(api_id, lambda_arn):
         PayloadFormatVersion='2.0',
         IntegrationUri=lambda_arn
     )
-    
+    print(f"Created integration for {function_label(lambda_arn)}: {response['IntegrationId']}")
+    return response['IntegrationId']
+
+def invoke_permission_id(api_id, lambda_arn):
+    return f"apigateway-invoke-{api_id}-{lambda_arn.split(':')[-1]}"
+
+def find_invoke_permission(api_id, lambda_arn):
+    def policy_statements():
+        try:
+            policy = lambda_client.get_policy(FunctionName=lambda_arn)['Policy']
+        except Exception as e:
+            if error_code(e) == 'ResourceNotFoundException':
+                return []
+            raise
+        return [statement.get('Sid') for statement in json.loads(policy).get('Statement', [])]
+    statement_id = invoke_permission_id(api_id, lambda_arn)
+    return statement_id if statement_id in lookup(('policy', lambda_arn), policy_statements) else None
+
+def add_invoke_permission(api_id, lambda_arn):
     # Add permission for API Gateway to invoke Lambda
+    statement_id = invoke_permission_id(api_id, lambda_arn)
     try:
-        source_arn = f"arn:aws:execute-api:{boto3.session.Session().region_name}:{boto3.session.Session().client('sts').get_caller_identity()['Account']}:{api_id}/*/*"
         lambda_client.add_permission(
             FunctionName=lambda_arn,
-            StatementId=f"apigateway-invoke-{api_id}-{lambda_arn.split(':')[-1]}",
+            StatementId=statement_id,
             Action='lambda:InvokeFunction',
             Principal='apigateway.amazonaws.com',
-            SourceArn=source_arn
+            SourceArn=f"arn:aws:execute-api:{provisioning.region()}:{provisioning.account_id()}:{api_id}/*/*"
         )
-    except lambda_client.exceptions.ResourceConflictException:
+    except Exception as e:
+        if error_code(e) != 'ResourceConflictException':
+            raise
+        # Permission already exists
+    return statement_id
+
+def _routes(api_id):
+    return lookup(('routes', api_id), lambda: provisioning.pages(api_gateway.get_routes, 'Items', ApiId=api_id))
+
+def find_route(api_id, route_key, integration_id):
+    for route in _routes(api_id):
+        if route['RouteKey'] == route_key and route.get('Target') == f"integrations/{integration_id}":
+            return route['RouteId']
+    return None
+
+def create_route(api_id, route_key, integration_id):
+    # Routes pointing elsewhere (e.g. at a duplicate integration left by
+    # earlier versions of this script) are repointed rather than recreated
+    target = f"integrations/{integration_id}"
+    for route in _routes(api_id):
+        if route['RouteKey'] == route_key:
+            api_gateway.update_route(ApiId=api_id, RouteId=route['RouteId'], Target=target)
+            print(f"Updated route: {route_key}")
+            return route['RouteId']
+    route_id = api_gateway.create_route(ApiId=api_id, RouteKey=route_key, Target=target)['RouteId']
+    print(f"Created route: {route_key}")
+    return route_id
+
+def find_stage(api_id, stage_name=STAGE_NAME):
+    stages = provisioning.pages(api_gateway.get_stages, 'Items', ApiId=api_id)
+    return stage_name if any(stage['StageName'] == stage_name for stage in stages) else None
+
+def create_stage(api_id, stage_name=STAGE_NAME):
+    # Create stage and deploy
+    api_gateway.create_stage(ApiId=api_id, StageName=stage_name, AutoDeploy=True)
+    print(f"Created stage: {stage_name}")
+    return stage_name
+
+def api_routes(process_image_lambda_arn, get_history_lambda_arn, get_analysis_status_lambda_arn=None,
+               submit_analysis_lambda_arn=None, create_upload_url_lambda_arn=None,
+               get_meal_stats_lambda_arn=None):
+    # Route key -> Lambda ARN; optional functions are left out
+    routes = {
+        # 1. Route for processing images
+        'POST /analyze-meal': process_image_lambda_arn,
+        # Batch analysis of several photos, served by the same function
+        'POST /analyze-meals': process_image_lambda_arn,
+        # 2. Route for getting meal history
+        'GET /meal-history/{userId}': get_history_lambda_arn,
+        # 3. Route for presigned direct-to-S3 uploads
+        'POST /upload-url': create_upload_url_lambda_arn,
+        # 4. Routes for asynchronous analysis jobs (submit, then poll)
+        'POST /analysis': submit_analysis_lambda_arn,
+        'GET /analysis/{jobId}': get_analysis_status_lambda_arn,
+        # 5. Route for nutrition trend rollups
+        'GET /meal-stats/{userId}': get_meal_stats_lambda_arn
+    }
+    return {route_key: arn for route_key, arn in routes.items() if arn}
+
+def api_steps(routes):
+    # Everything lives in the API (so a new API skips the lookups);
+    # integrations and permissions only need the API, each route also waits
+    # for the integration of its function
+    steps = [Step('api', lambda outputs: find_api(), lambda outputs: create_api()),
+             Step('cors', lambda outputs: find_cors(outputs['api']), lambda outputs: update_cors(outputs['api']),
+                  depends_on=['api'])]
+    for lambda_arn in dict.fromkeys(routes.values()):
+        label = function_label(lambda_arn)
+        steps += [
+            Step(f"integration:{label}",
+                 lambda outputs, arn=lambda_arn: find_lambda_integration(outputs['api'], arn),
+                 lambda outputs, arn=lambda_arn: create_lambda_integration(outputs['api'], arn),
+                 parent='api'),
+            Step(f"permission:{label}",
+                 lambda outputs, arn=lambda_arn: find_invoke_permission(outputs['api'], arn),
+                 lambda outputs, arn=lambda_arn: add_invoke_permission(outputs['api'], arn),
+                 parent='api')
+        ]
+    for route_key, lambda_arn in routes.items():
+        integration = f"integration:{function_label(lambda_arn)}"
+        steps.append(Step(f"route:{route_key}",
+                          lambda outputs, k=route_key, i=integration: find_route(outputs['api'], k, outputs[i]),
+                          lambda outputs, k=route_key, i=integration: create_route(outputs['api'], k, outputs[i]),
+                          depends_on=[integration], parent='api'))
+    steps.append(Step('stage', lambda outputs: find_stage(outputs['api']),
+                      lambda outputs: create_stage(outputs['api']), parent='api'))
+    return steps
+
+def api_endpoint(api_id):
+    return f"https://{api_id}.execute-api.{provisioning.region()}.amazonaws.com"
+
+def create_api_gateway(process_image_lambda_arn, get_history_lambda_arn, get_analysis_status_lambda_arn=None,
+                       submit_analysis_lambda_arn=None, create_upload_url_lambda_arn=None,
+                       get_meal_stats_lambda_arn=None, apply=True, workers=provisioning.WORKERS):
+    print(f"Provisioning API Gateway: {API_NAME}")
+    routes = api_routes(process_image_lambda_arn, get_history_lambda_arn, get_analysis_status_lambda_arn,
+                        submit_analysis_lambda_arn, create_upload_url_lambda_arn, get_meal_stats_lambda_arn)
+    outputs, results = provisioning.run(api_steps(routes), apply=apply, workers=workers)
+    provisioning.report(results)
+    if not outputs.get('api'):
+        return None
+
+    # Get the API endpoint URL
+    endpoint = api_endpoint(outputs['api'])
+    print(f"API Gateway endpoint: {endpoint}")
+    return endpoint
+
+def find_analysis_worker(queue_arn, worker_lambda_arn):
+    mappings = lambda_client.list_event_source_mappings(EventSourceArn=queue_arn, FunctionName=worker_lambda_arn)
+    for mapping in mappings.get('EventSourceMappings', []):
+        return mapping['UUID']
+    return None
+
+def connect_analysis_worker(queue_arn, worker_lambda_arn, batch_size=10):
+    # Feed the analysis queue to the worker; failed jobs are reported per
+    # message so the rest of the batch isn't redelivered
+    response = lambda_client.create_event_source_mapping(
+        EventSourceArn=queue_arn,
+        FunctionName=worker_lambda_arn,
+        BatchSize=batch_size,
+        MaximumBatchingWindowInSeconds=1,
+        FunctionResponseTypes=['ReportBatchItemFailures']
+    )
+    print(f"Connected analysis queue to worker: {response['UUID']}")
+    return response['UUID']
+
+# Parts of a bucket notification configuration (the response also carries
+# ResponseMetadata)
+NOTIFICATION_FIELDS = ('TopicConfigurations', 'QueueConfigurations', 'LambdaFunctionConfigurations',
+                       'EventBridgeConfiguration')
+
+def find_upload_notifications(images_bucket, process_image_lambda_arn, prefix='uploads/'):
+    config = s3.get_bucket_notification_configuration(Bucket=images_bucket)
+    for notification in config.get('LambdaFunctionConfigurations', []):
+        rules = notification.get('Filter', {}).get('Key', {}).get('FilterRules', [])
+        if (notification['LambdaFunctionArn'] == process_image_lambda_arn
+                and {'Name': 'prefix', 'Value': prefix} in rules):
+            return f"s3://{images_bucket}/{prefix}"
+    return None
+
+def connect_upload_notifications(images_bucket, process_image_lambda_arn, prefix='uploads/'):
+    # Analyze direct uploads as soon as they land in the bucket
+    try:
+        lambda_client.add_permission(
+            FunctionName=process_image_lambda_arn,
+            StatementId=f"s3-invoke-{images_bucket}",
+            Action='lambda:InvokeFunction',
+            Principal='s3.amazonaws.com',
+            SourceArn=f"arn:aws:s3:::{images_bucket}"
+        )
+    except Exception as e:
+        if error_code(e) != 'ResourceConflictException':
+            raise
         # Permission already exists
-        pass
     
-    return response['IntegrationId']
+    # The put replaces the bucket's whole notification configuration: keep
+    # every other notification and only replace this function's entry
+    current = s3.get_bucket_notification_configuration(Bucket=images_bucket)
+    config = {field: current[field] for field in NOTIFICATION_FIELDS if field in current}
+    config['LambdaFunctionConfigurations'] = [
+        notification for notification in config.get('LambdaFunctionConfigurations', [])
+        if notification['LambdaFunctionArn'] != process_image_lambda_arn
+    ] + [{
+        'LambdaFunctionArn': process_image_lambda_arn,
+        'Events': ['s3:ObjectCreated:*'],
+        'Filter': {'Key': {'FilterRules': [{'Name': 'prefix', 'Value': prefix}]}}
+    }]
+    s3.put_bucket_notification_configuration(Bucket=images_bucket, NotificationConfiguration=config)
+    print(f"Connected s3://{images_bucket}/{prefix} uploads to {process_image_lambda_arn}")
+    print("Set UPLOAD_AUTO_ANALYZE=true on the create_upload_url function")
+    return f"s3://{images_bucket}/{prefix}"
+
+def configure_prewarm(function_name, provisioned_concurrency=0, snap_start=False, warmup_schedule_minutes=0, alias='live'):
+    # Cold-start mitigation for a handler. Provisioned concurrency and
+    # SnapStart both run init ahead of traffic, so the function is told to
+    # build its AWS clients during init (PREWARM_CLIENTS). Both apply to a
+    # published version, served through an alias: point integrations at the
+    # returned ARN. A warm-up schedule pings the function with
+    # {"warmup": true}, which only builds clients.
+    function_arn = lambda_client.get_function(FunctionName=function_name)['Configuration']['FunctionArn']
+    target_arn = function_arn
+
+    if provisioned_concurrency or snap_start:
+        config = lambda_client.get_function_configuration(FunctionName=function_name)
+        variables = config.get('Environment', {}).get('Variables', {})
+        update = {
+            'FunctionName': function_name,
+            'Environment': {'Variables': {**variables, 'PREWARM_CLIENTS': 'true'}}
+        }
+        if snap_start:
+            update['SnapStart'] = {'ApplyOn': 'PublishedVersions'}
+        lambda_client.update_function_configuration(**update)
+        lambda_client.get_waiter('function_updated').wait(FunctionName=function_name)
 
-def create_options_integration(api_id):
-    # Implementation of create_options_integration function
-    # This function needs to be implemented based on your specific requirements
-    # For now, we'll return a placeholder
-    return "placeholder_integration_id"
+        version = lambda_client.publish_version(FunctionName=function_name)['Version']
+        try:
+            lambda_client.create_alias(FunctionName=function_name, Name=alias, FunctionVersion=version)
+        except lambda_client.exceptions.ResourceConflictException:
+            lambda_client.update_alias(FunctionName=function_name, Name=alias, FunctionVersion=version)
+        target_arn = f"{function_arn}:{alias}"
+
+        if provisioned_concurrency:
+            lambda_client.put_provisioned_concurrency_config(
+                FunctionName=function_name,
+                Qualifier=alias,
+                ProvisionedConcurrentExecutions=provisioned_concurrency
+            )
+        print(f"{function_name}:{alias} -> version {version} "
+              f"(provisioned concurrency {provisioned_concurrency}, SnapStart {snap_start})")
+
+    if warmup_schedule_minutes:
+        rule_name = f"{function_name.split(':')[-1]}-warmup"
+        rule_arn = events.put_rule(
+            Name=rule_name,
+            ScheduleExpression=f"rate({warmup_schedule_minutes} minute{'s' if warmup_schedule_minutes > 1 else ''})",
+            State='ENABLED'
+        )['RuleArn']
+        try:
+            lambda_client.add_permission(
+                FunctionName=target_arn,
+                StatementId=f"{rule_name}-invoke",
+                Action='lambda:InvokeFunction',
+                Principal='events.amazonaws.com',
+                SourceArn=rule_arn
+            )
+        except lambda_client.exceptions.ResourceConflictException:
+            # Permission already exists
+            pass
+        events.put_targets(Rule=rule_name, Targets=[{
+            'Id': 'warmup',
+            'Arn': target_arn,
+            'Input': json.dumps({'warmup': True})
+        }])
+        print(f"Warm-up ping every {warmup_schedule_minutes} min for {target_arn}")
+
+    return target_arn
+
+def main(argv=None):
+    args = provisioning.arguments('Set up the API Gateway of the Healthy Meal Analysis app').parse_args(argv)
+    apply = not args.plan
 
-def main():
     # Get Lambda ARNs (would be outputs from Lambda creation)
     # In a real setup, these would be retrieved from CloudFormation outputs or similar
     process_image_lambda_arn = input("Enter the ARN of the process_image Lambda function: ")
     get_history_lambda_arn = input("Enter the ARN of the get_user_history Lambda function: ")
+    get_analysis_status_lambda_arn = input("Enter the ARN of the get_analysis_status Lambda function (blank to skip): ").strip() or None
+    submit_analysis_lambda_arn = input("Enter the ARN of the submit_analysis Lambda function (blank to skip): ").strip() or None
+    create_upload_url_lambda_arn = input("Enter the ARN of the create_upload_url Lambda function (blank to skip): ").strip() or None
+    get_meal_stats_lambda_arn = input("Enter the ARN of the get_meal_stats Lambda function (blank to skip): ").strip() or None
+    
+    # Cold-start mitigation for the synchronous analysis path. Publishing a
+    # version is a deployment, not a lookup, so --plan skips it.
+    provisioned = input("Provisioned concurrency for process_image (blank for none): ").strip()
+    snap_start = input("Enable SnapStart for process_image? (y/N): ").strip().lower() == 'y'
+    warmup_minutes = input("Warm-up ping interval in minutes for process_image (blank for none): ").strip()
+    if (provisioned or snap_start or warmup_minutes) and apply:
+        process_image_lambda_arn = configure_prewarm(
+            process_image_lambda_arn,
+            provisioned_concurrency=int(provisioned or 0),
+            snap_start=snap_start,
+            warmup_schedule_minutes=int(warmup_minutes or 0)
+        )
+    
+    routes = api_routes(process_image_lambda_arn, get_history_lambda_arn, get_analysis_status_lambda_arn,
+                        submit_analysis_lambda_arn, create_upload_url_lambda_arn, get_meal_stats_lambda_arn)
+    steps = api_steps(routes)
+    
+    if create_upload_url_lambda_arn:
+        images_bucket = input("Enter the images bucket to analyze uploads automatically (blank to skip): ").strip()
+        if images_bucket:
+            steps.append(Step('upload-notifications',
+                              lambda outputs: find_upload_notifications(images_bucket, process_image_lambda_arn),
+                              lambda outputs: connect_upload_notifications(images_bucket, process_image_lambda_arn)))
+    
+    worker_lambda_arn = input("Enter the ARN of the analysis_worker Lambda function (blank to skip): ").strip()
+    if worker_lambda_arn:
+        queue_arn = input("Enter the ARN of the analysis SQS queue: ").strip()
+        steps.append(Step('analysis-worker',
+                          lambda outputs: find_analysis_worker(queue_arn, worker_lambda_arn),
+                          lambda outputs: connect_analysis_worker(queue_arn, worker_lambda_arn)))
     
-    api_endpoint = create_api_gateway(process_image_lambda_arn, get_history_lambda_arn)
+    print(f"{'Provisioning' if apply else 'Planning'} API Gateway: {API_NAME}")
+    outputs, results = provisioning.run(steps, apply=apply, workers=args.workers)
+    provisioning.report(results)
+    if not outputs.get('api'):
+        return
     
     # Output the endpoint to use in the React app
     print("\nAdd this URL to your React application's .env file:")
-    print(f"REACT_APP_API_URL={api_endpoint}")
+    print(f"REACT_APP_API_URL={api_endpoint(outputs['api'])}")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
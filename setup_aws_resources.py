@@ -1,279 +1,399 @@
 import boto3
+import hashlib
 import json
-import time
-from botocore.exceptions import ClientError
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import provisioning
+from provisioning import Step, error_code, lookup
 
 # Initialize clients
 s3 = boto3.client('s3')
 bedrock = boto3.client('bedrock')
 bedrock_agent = boto3.client('bedrock-agent')
 iam = boto3.client('iam')
+sqs = boto3.client('sqs')
+dynamodb = boto3.client('dynamodb')
 
-# Create S3 buckets
-def create_buckets():
-    # Bucket for storing food images
-    images_bucket_name = 'healthy-meal-images-bucket'
-    # Bucket for storing feedback data
-    feedback_bucket_name = 'healthy-meal-feedback-bucket'
-    # Bucket for knowledge base documents
-    kb_bucket_name = 'healthy-meal-kb-bucket'
-    
-    buckets = [images_bucket_name, feedback_bucket_name, kb_bucket_name]
-    
-    for bucket_name in buckets:
-        try:
-            s3.create_bucket(
-                Bucket=bucket_name,
-                CreateBucketConfiguration={'LocationConstraint': 'us-west-2'}
-            )
-            print(f"Created bucket: {bucket_name}")
-            
-            # Enable CORS for frontend access
-            cors_configuration = {
-                'CORSRules': [{
-                    'AllowedHeaders': ['*'],
-                    'AllowedMethods': ['GET', 'PUT', 'POST', 'DELETE', 'HEAD'],
-                    'AllowedOrigins': ['*'],
-                    'ExposeHeaders': []
-                }]
-            }
-            s3.put_bucket_cors(Bucket=bucket_name, CORSConfiguration=cors_configuration)
-            
-        except ClientError as e:
-            if e.response['Error']['Code'] == 'BucketAlreadyOwnedByYou':
-                print(f"Bucket already exists: {bucket_name}")
-            else:
-                print(f"Error creating bucket {bucket_name}: {e}")
-    
+# Guideline corpus; build_guideline_index.py indexes the same file for the
+# in-Lambda retrieval mode
+GUIDELINES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'nutrition_guidelines.json')
+
+IMAGES_BUCKET = 'healthy-meal-images-bucket'
+FEEDBACK_BUCKET = 'healthy-meal-feedback-bucket'
+KB_BUCKET = 'healthy-meal-kb-bucket'
+ANALYSIS_QUEUE = 'meal-analysis-jobs'
+MEALS_TABLE = 'healthy-meal-history'
+ADMISSION_TABLE = 'healthy-meal-admission'
+ANALYSIS_CACHE_RULE = 'expire-analysis-cache'
+ANALYSIS_CACHE_PREFIX = '_analysis_cache/'
+ANALYSIS_CACHE_DAYS = 7
+
+# Existing resources this script uses rather than creates
+AGENT_ROLE_ARN = "arn:aws:iam::430672174368:role/service-role/PerceiverAgent-ospy3-role-98S15A8K7GW"
+KNOWLEDGE_BASE_ID = "EA6O5SVHWD"
+AGENT_ID = "KKJN9H7DZE"
+AGENT_ALIAS_NAME = 'Production'
+
+# Every setup step is a lookup (returns None when the resource is missing)
+# plus a create; provisioning.run() orders them and runs independent ones
+# concurrently. See build_steps() for the dependency graph.
+
+def find_bucket(bucket_name):
+    try:
+        s3.head_bucket(Bucket=bucket_name)
+    except Exception as e:
+        if error_code(e) in ('404', 'NoSuchBucket', 'NotFound'):
+            return None
+        raise
+    return bucket_name
+
+# Create an S3 bucket
+def create_bucket(bucket_name):
+    try:
+        s3.create_bucket(
+            Bucket=bucket_name,
+            CreateBucketConfiguration={'LocationConstraint': 'us-west-2'}
+        )
+        print(f"Created bucket: {bucket_name}")
+    except Exception as e:
+        if error_code(e) != 'BucketAlreadyOwnedByYou':
+            raise
+        print(f"Bucket already exists: {bucket_name}")
+
+    # Enable CORS for frontend access
+    cors_configuration = {
+        'CORSRules': [{
+            'AllowedHeaders': ['*'],
+            'AllowedMethods': ['GET', 'PUT', 'POST', 'DELETE', 'HEAD'],
+            'AllowedOrigins': ['*'],
+            'ExposeHeaders': []
+        }]
+    }
+    s3.put_bucket_cors(Bucket=bucket_name, CORSConfiguration=cors_configuration)
+    return bucket_name
+
+def analysis_cache_rule(prefix=ANALYSIS_CACHE_PREFIX, days=ANALYSIS_CACHE_DAYS):
     return {
-        'images_bucket': images_bucket_name,
-        'feedback_bucket': feedback_bucket_name,
-        'kb_bucket': kb_bucket_name
+        'ID': ANALYSIS_CACHE_RULE,
+        'Filter': {'Prefix': prefix},
+        'Status': 'Enabled',
+        'Expiration': {'Days': days}
     }
 
-# Create IAM role for Bedrock agent
-def create_agent_role():
-    # Use your existing role ARN for agents
-    role_arn = "arn:aws:iam::430672174368:role/service-role/PerceiverAgent-ospy3-role-98S15A8K7GW"
-    print(f"Using existing agent role: {role_arn}")
-    return role_arn
+def lifecycle_rules(bucket_name):
+    try:
+        return s3.get_bucket_lifecycle_configuration(Bucket=bucket_name)['Rules']
+    except Exception as e:
+        if error_code(e) == 'NoSuchLifecycleConfiguration':
+            return []
+        raise
+
+def find_analysis_cache_expiry(feedback_bucket, prefix=ANALYSIS_CACHE_PREFIX, days=ANALYSIS_CACHE_DAYS):
+    # Only a rule with the current prefix and expiry counts as configured
+    wanted = analysis_cache_rule(prefix, days)
+    for rule in lifecycle_rules(feedback_bucket):
+        if rule.get('ID') == ANALYSIS_CACHE_RULE:
+            return ANALYSIS_CACHE_RULE if all(rule.get(k) == v for k, v in wanted.items()) else None
+    return None
+
+# Expire cached model analyses stored under the feedback bucket. The put
+# replaces the bucket's whole lifecycle configuration, so every other rule
+# is written back as it was.
+def configure_analysis_cache_expiry(feedback_bucket, prefix=ANALYSIS_CACHE_PREFIX, days=ANALYSIS_CACHE_DAYS):
+    rules = [rule for rule in lifecycle_rules(feedback_bucket) if rule.get('ID') != ANALYSIS_CACHE_RULE]
+    s3.put_bucket_lifecycle_configuration(
+        Bucket=feedback_bucket,
+        LifecycleConfiguration={'Rules': rules + [analysis_cache_rule(prefix, days)]}
+    )
+    print(f"Configured {days}-day expiry for s3://{feedback_bucket}/{prefix}")
+    return ANALYSIS_CACHE_RULE
+
+def find_queue(queue_name):
+    try:
+        queue_url = sqs.get_queue_url(QueueName=queue_name)['QueueUrl']
+    except Exception as e:
+        if error_code(e) in ('AWS.SimpleQueueService.NonExistentQueue', 'QueueDoesNotExist'):
+            return None
+        raise
+    queue_arn = sqs.get_queue_attributes(
+        QueueUrl=queue_url,
+        AttributeNames=['QueueArn']
+    )['Attributes']['QueueArn']
+    return {'queue_url': queue_url, 'queue_arn': queue_arn}
+
+def create_queue(queue_name, attributes):
+    queue_url = sqs.create_queue(QueueName=queue_name, Attributes=attributes)['QueueUrl']
+    queue_arn = sqs.get_queue_attributes(
+        QueueUrl=queue_url,
+        AttributeNames=['QueueArn']
+    )['Attributes']['QueueArn']
+    print(f"Created queue: {queue_url}")
+    return {'queue_url': queue_url, 'queue_arn': queue_arn}
+
+# The queue feeding the analysis worker, with a dead-letter queue for jobs
+# that keep failing
+def create_analysis_dlq(queue_name=ANALYSIS_QUEUE):
+    return create_queue(f"{queue_name}-dlq", {'MessageRetentionPeriod': str(14 * 24 * 3600)})
+
+def create_analysis_queue(dlq_arn, queue_name=ANALYSIS_QUEUE, worker_timeout_seconds=60):
+    # AWS recommends a visibility timeout of 6x the consumer's timeout
+    return create_queue(queue_name, {
+        'VisibilityTimeout': str(6 * worker_timeout_seconds),
+        'RedrivePolicy': json.dumps({'deadLetterTargetArn': dlq_arn, 'maxReceiveCount': '3'})
+    })
+
+def find_table(table_name):
+    try:
+        dynamodb.describe_table(TableName=table_name)
+    except Exception as e:
+        if error_code(e) == 'ResourceNotFoundException':
+            return None
+        raise
+    return table_name
 
-# Upload nutrition guidelines to knowledge base bucket
+# Meal history table: one item per meal, newest-first queries per user
+def create_meals_table(table_name=MEALS_TABLE):
+    dynamodb.create_table(
+        TableName=table_name,
+        AttributeDefinitions=[
+            {'AttributeName': 'userId', 'AttributeType': 'S'},
+            {'AttributeName': 'timestamp', 'AttributeType': 'S'}
+        ],
+        KeySchema=[
+            {'AttributeName': 'userId', 'KeyType': 'HASH'},
+            {'AttributeName': 'timestamp', 'KeyType': 'RANGE'}
+        ],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    dynamodb.get_waiter('table_exists').wait(TableName=table_name)
+    print(f"Created meal history table: {table_name}")
+    return table_name
+
+def find_meals_table(table_name=MEALS_TABLE):
+    return find_table(table_name)
+
+# Rate limit buckets and model concurrency slots (lambda_functions/admission.py)
+def create_admission_table(table_name=ADMISSION_TABLE):
+    dynamodb.create_table(
+        TableName=table_name,
+        AttributeDefinitions=[
+            {'AttributeName': 'pk', 'AttributeType': 'S'},
+            {'AttributeName': 'sk', 'AttributeType': 'S'}
+        ],
+        KeySchema=[
+            {'AttributeName': 'pk', 'KeyType': 'HASH'},
+            {'AttributeName': 'sk', 'KeyType': 'RANGE'}
+        ],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    dynamodb.get_waiter('table_exists').wait(TableName=table_name)
+    print(f"Created admission table: {table_name}")
+    return table_name
+
+def find_table_expiry(table_name, attribute='ttl'):
+    description = dynamodb.describe_time_to_live(TableName=table_name)['TimeToLiveDescription']
+    if description.get('TimeToLiveStatus') in ('ENABLED', 'ENABLING') and description.get('AttributeName') == attribute:
+        return attribute
+    return None
+
+# Idle buckets and expired slot leases are deleted by DynamoDB TTL
+def configure_table_expiry(table_name, attribute='ttl'):
+    dynamodb.update_time_to_live(
+        TableName=table_name,
+        TimeToLiveSpecification={'Enabled': True, 'AttributeName': attribute}
+    )
+    print(f"Enabled expiry on {table_name}.{attribute}")
+    return attribute
+
+def load_nutrition_guidelines(path=GUIDELINES_FILE):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def guideline_objects():
+    # {key: (title, body)} for the documents of nutrition_guidelines.json
+    return {f"guideline_{i+1}.txt": (g["title"], g["content"].encode('utf-8'))
+            for i, g in enumerate(load_nutrition_guidelines())}
+
+def stale_guidelines(kb_bucket):
+    # Keys whose uploaded copy is missing or differs. Single-part uploads
+    # have the MD5 of the body as ETag, so one listing covers every document.
+    def list_etags():
+        etags = {}
+        for page in s3.get_paginator('list_objects_v2').paginate(Bucket=kb_bucket):
+            for item in page.get('Contents', []):
+                etags[item['Key']] = item['ETag'].strip('"')
+        return etags
+    etags = lookup(('etags', kb_bucket), list_etags)
+    return {key: obj for key, obj in guideline_objects().items()
+            if etags.get(key) != hashlib.md5(obj[1]).hexdigest()}
+
+def find_nutrition_guidelines(kb_bucket):
+    return None if stale_guidelines(kb_bucket) else sorted(guideline_objects())
+
+# Upload the nutrition guidelines that changed to the knowledge base bucket
 def upload_nutrition_guidelines(kb_bucket):
-    # Create some basic nutrition guideline documents
-    guidelines = [
-        {
-            "title": "Healthy Plate Model",
-            "content": """
-            A healthy meal should follow the plate model:
-            - 1/2 of the plate: vegetables and fruits
-            - 1/4 of the plate: whole grains or starchy vegetables
-            - 1/4 of the plate: protein-rich foods
-            - Include a small amount of healthy fats
-            - Drink water, tea, or coffee without added sugar
-            """
-        },
-        {
-            "title": "Protein Guidelines",
-            "content": """
-            Healthy protein sources include:
-            - Lean meats like chicken, turkey, and fish
-            - Plant-based proteins like beans, lentils, tofu, and tempeh
-            - Low-fat dairy products
-            - Eggs
-            Limit red and processed meats.
-            """
-        },
-        {
-            "title": "Carbohydrate Guidelines",
-            "content": """
-            Choose complex carbohydrates:
-            - Whole grains (brown rice, quinoa, oats, barley)
-            - Starchy vegetables (sweet potatoes, squash)
-            - Beans and legumes
-            Limit refined grains and added sugars.
-            """
-        },
-        {
-            "title": "Fat Guidelines",
-            "content": """
-            Include healthy fats:
-            - Avocados
-            - Nuts and seeds
-            - Olive oil
-            - Fatty fish
-            Limit saturated and trans fats.
-            """
-        },
-        {
-            "title": "Portion Size Guidelines",
-            "content": """
-            Appropriate portion sizes:
-            - Protein: palm-sized portion (3-4 oz)
-            - Grains/Starches: 1/2 cup or fist-sized portion
-            - Vegetables: 1-2 cups or more
-            - Fruits: 1 medium fruit or 1/2 cup
-            - Fats: thumb-sized portion (1-2 tbsp)
-            """
-        }
-    ]
-    
-    for i, guideline in enumerate(guidelines):
-        filename = f"guideline_{i+1}.txt"
+    def upload(item):
+        filename, (title, body) = item
         s3.put_object(
             Bucket=kb_bucket,
             Key=filename,
-            Body=guideline["content"],
-            Metadata={"title": guideline["title"]}
+            Body=body,
+            Metadata={"title": title}
         )
         print(f"Uploaded {filename} to {kb_bucket}")
+    with ThreadPoolExecutor(max_workers=provisioning.WORKERS) as executor:
+        list(executor.map(upload, stale_guidelines(kb_bucket).items()))
+    provisioning.forget(('etags', kb_bucket))
+    return sorted(guideline_objects())
+
+# For an existing agent, use its latest prepared version
+def find_agent_version(agent_id=AGENT_ID):
+    versions = bedrock_agent.list_agent_versions(agentId=agent_id)
+    for version in versions.get('agentVersionSummaries', []):
+        if version['status'] == 'PREPARED' or version['status'] == 'READY':
+            print(f"Using existing agent version: {version['agentVersion']}")
+            return version['agentVersion']
+    return None
 
-# Create a knowledge base for nutrition guidelines
-def create_knowledge_base(kb_bucket, role_arn):
-    # Since you already have a knowledge base, just return the existing ID
-    kb_id = "EA6O5SVHWD"
-    print(f"Using existing knowledge base: {kb_id}")
-    
-    # Upload your nutrition guidelines to the existing knowledge base
-    # You may need to manually upload these to the correct location
-    # or use the dataSourceConfiguration to point to your S3 bucket
-    
+# If no prepared version exists, prepare and use DRAFT
+def prepare_agent_version(agent_id=AGENT_ID):
+    bedrock_agent.prepare_agent(agentId=agent_id)
+    print("Prepared agent version: DRAFT")
+    return 'DRAFT'
+
+def find_agent_knowledge_base(agent_version, kb_id, agent_id=AGENT_ID):
+    kbs = bedrock_agent.list_agent_knowledge_bases(agentId=agent_id, agentVersion=agent_version)
+    for kb in kbs.get('agentKnowledgeBaseSummaries', []):
+        if kb['knowledgeBaseId'] == kb_id:
+            return kb_id
+    return None
+
+def associate_knowledge_base(agent_version, kb_id, agent_id=AGENT_ID):
+    bedrock_agent.associate_agent_knowledge_base(
+        agentId=agent_id,
+        agentVersion=agent_version,
+        knowledgeBaseId=kb_id,
+        description='Nutrition guidelines knowledge base'
+    )
+    print(f"Associated knowledge base {kb_id} with agent {agent_id} (version: {agent_version})")
     return kb_id
 
-# Create an agent to analyze meal images (or use existing)
-def create_agent(kb_id, role_arn):
-    # We already know the agent exists from the error message
-    agent_id = "KKJN9H7DZE"
-    print(f"Using existing agent: {agent_id}")
-    
-    # For an existing agent, we need to get the latest version
-    try:
-        versions = bedrock_agent.list_agent_versions(agentId=agent_id)
-        agent_version = None
-        
-        for version in versions.get('agentVersionSummaries', []):
-            if version['status'] == 'PREPARED' or version['status'] == 'READY':
-                agent_version = version['agentVersion']
-                print(f"Using existing agent version: {agent_version}")
-                break
-        
-        # If no prepared version exists, use DRAFT
-        if not agent_version:
-            agent_version = 'DRAFT'
-            print(f"No prepared version found, using: {agent_version}")
-            
-            # Try to prepare the DRAFT version
-            try:
-                prepare_response = bedrock_agent.prepare_agent(
-                    agentId=agent_id,
-                    agentVersion=agent_version
-                )
-                print(f"Prepared agent version: {agent_version}")
-            except Exception as e:
-                print(f"Error preparing agent version: {e}")
-        
-        # Check if we need to associate the knowledge base
-        try:
-            kbs = bedrock_agent.list_agent_knowledge_bases(
-                agentId=agent_id,
-                agentVersion=agent_version
-            )
-            
-            kb_found = False
-            for kb in kbs.get('agentKnowledgeBaseSummaries', []):
-                if kb['knowledgeBaseId'] == kb_id:
-                    kb_found = True
-                    print(f"Knowledge base {kb_id} already associated with agent")
-                    break
-            
-            if not kb_found:
-                # Associate the knowledge base
-                bedrock_agent.associate_agent_knowledge_base(
-                    agentId=agent_id,
-                    agentVersion=agent_version,
-                    knowledgeBaseId=kb_id,
-                    description='Nutrition guidelines knowledge base'
-                )
-                print(f"Associated knowledge base {kb_id} with agent {agent_id} (version: {agent_version})")
-        except Exception as e:
-            print(f"Error checking knowledge base associations: {e}")
-        
-        # Check if alias exists
-        try:
-            aliases = bedrock_agent.list_agent_aliases(agentId=agent_id)
-            alias_id = None
-            
-            for alias in aliases.get('agentAliasSummaries', []):
-                if alias['agentAliasName'] == 'Production':
-                    alias_id = alias['agentAliasId']
-                    print(f"Using existing agent alias: {alias_id}")
-                    break
-            
-            # Create alias if it doesn't exist
-            if not alias_id:
-                alias_response = bedrock_agent.create_agent_alias(
-                    agentId=agent_id,
-                    agentAliasName='Production',
-                    description='Production version of the meal analysis agent',
-                    routingConfiguration=[
-                        {
-                            'agentVersion': agent_version,
-                            'provisionedThroughput': None  # Use on-demand throughput
-                        }
-                    ]
-                )
-                
-                alias_id = alias_response['agentAlias']['agentAliasId']
-                print(f"Created agent alias: {alias_id}")
-            
-            return agent_id, agent_version, alias_id
-        except Exception as e:
-            print(f"Error with agent aliases: {e}")
-            
-    except Exception as e:
-        print(f"Error getting agent versions: {e}")
-    
-    # If we get here, something went wrong but we still want to return what we know
-    return agent_id, "DRAFT", None
-
-def main():
-    print("Setting up AWS resources for Healthy Meal Analysis app...")
-    
-    # Create S3 buckets
-    buckets = create_buckets()
-    
-    # Create IAM role
-    role_arn = create_agent_role()
-    
-    # Upload nutrition guidelines
-    upload_nutrition_guidelines(buckets['kb_bucket'])
-    
-    # Create knowledge base
-    kb_id = create_knowledge_base(buckets['kb_bucket'], role_arn)
-    
-    # Create or use existing agent
-    agent_id, agent_version, alias_id = create_agent(kb_id, role_arn)
-    
-    print("\nAWS resources setup complete!")
-    print(f"Images Bucket: {buckets['images_bucket']}")
-    print(f"Feedback Bucket: {buckets['feedback_bucket']}")
-    print(f"Knowledge Base Bucket: {buckets['kb_bucket']}")
-    print(f"Knowledge Base ID: {kb_id}")
-    print(f"Agent ID: {agent_id}")
-    print(f"Agent Version: {agent_version}")
-    if alias_id:
-        print(f"Agent Alias ID: {alias_id}")
-    
-    # Return configuration for other components
-    return {
-        'images_bucket': buckets['images_bucket'],
-        'feedback_bucket': buckets['feedback_bucket'],
-        'kb_bucket': buckets['kb_bucket'],
-        'knowledge_base_id': kb_id,
-        'agent_id': agent_id,
-        'agent_version': agent_version,
-        'agent_alias_id': alias_id
+def find_agent_alias(agent_id=AGENT_ID):
+    aliases = bedrock_agent.list_agent_aliases(agentId=agent_id)
+    for alias in aliases.get('agentAliasSummaries', []):
+        if alias['agentAliasName'] == AGENT_ALIAS_NAME:
+            return alias['agentAliasId']
+    return None
+
+def create_agent_alias(agent_version, agent_id=AGENT_ID):
+    alias_response = bedrock_agent.create_agent_alias(
+        agentId=agent_id,
+        agentAliasName=AGENT_ALIAS_NAME,
+        description='Production version of the meal analysis agent',
+        routingConfiguration=[
+            {
+                'agentVersion': agent_version,
+                'provisionedThroughput': None  # Use on-demand throughput
+            }
+        ]
+    )
+    alias_id = alias_response['agentAlias']['agentAliasId']
+    print(f"Created agent alias: {alias_id}")
+    return alias_id
+
+def build_steps():
+    # Buckets, queues, the table and the agent version don't depend on each
+    # other; the guideline upload waits for its bucket, the queue for its
+    # DLQ, and the agent's knowledge base and alias for its version
+    steps = []
+    for bucket_name in (IMAGES_BUCKET, FEEDBACK_BUCKET, KB_BUCKET):
+        steps.append(Step(f"bucket:{bucket_name}",
+                          lambda outputs, b=bucket_name: find_bucket(b),
+                          lambda outputs, b=bucket_name: create_bucket(b)))
+    steps += [
+        Step('analysis-cache-expiry',
+             lambda outputs: find_analysis_cache_expiry(FEEDBACK_BUCKET),
+             lambda outputs: configure_analysis_cache_expiry(FEEDBACK_BUCKET),
+             parent=f"bucket:{FEEDBACK_BUCKET}"),
+        Step('nutrition-guidelines',
+             lambda outputs: find_nutrition_guidelines(KB_BUCKET),
+             lambda outputs: upload_nutrition_guidelines(KB_BUCKET),
+             parent=f"bucket:{KB_BUCKET}"),
+        # Queue for asynchronous meal analysis jobs
+        Step('analysis-dlq',
+             lambda outputs: find_queue(f"{ANALYSIS_QUEUE}-dlq"),
+             lambda outputs: create_analysis_dlq()),
+        Step('analysis-queue',
+             lambda outputs: find_queue(ANALYSIS_QUEUE),
+             lambda outputs: create_analysis_queue(outputs['analysis-dlq']['queue_arn']),
+             depends_on=['analysis-dlq']),
+        # Meal history table (MEAL_STORE=dynamodb)
+        Step('meals-table', lambda outputs: find_meals_table(), lambda outputs: create_meals_table()),
+        # Admission control for /analyze-meal
+        Step('admission-table',
+             lambda outputs: find_table(ADMISSION_TABLE),
+             lambda outputs: create_admission_table()),
+        Step('admission-table-expiry',
+             lambda outputs: find_table_expiry(ADMISSION_TABLE),
+             lambda outputs: configure_table_expiry(ADMISSION_TABLE),
+             parent='admission-table'),
+        # The agent role and knowledge base already exist and are only
+        # referenced; documents reach the knowledge base through KB_BUCKET
+        Step('agent-role', lambda outputs: AGENT_ROLE_ARN),
+        Step('knowledge-base', lambda outputs: KNOWLEDGE_BASE_ID),
+        Step('agent-version', lambda outputs: find_agent_version(), lambda outputs: prepare_agent_version()),
+        Step('agent-knowledge-base',
+             lambda outputs: find_agent_knowledge_base(outputs['agent-version'], outputs['knowledge-base']),
+             lambda outputs: associate_knowledge_base(outputs['agent-version'], outputs['knowledge-base']),
+             depends_on=['agent-version', 'knowledge-base']),
+        Step('agent-alias',
+             lambda outputs: find_agent_alias(),
+             lambda outputs: create_agent_alias(outputs['agent-version']),
+             depends_on=['agent-version'])
+    ]
+    return steps
+
+def main(argv=None):
+    args = provisioning.arguments('Set up the AWS resources of the Healthy Meal Analysis app').parse_args(argv)
+    print("Setting up AWS resources for Healthy Meal Analysis app..."
+          if not args.plan else "Planning AWS resources for Healthy Meal Analysis app...")
+
+    outputs, results = provisioning.run(build_steps(), apply=not args.plan, workers=args.workers)
+    complete = provisioning.report(results)
+    if args.plan:
+        return None
+
+    queue = outputs.get('analysis-queue') or {}
+    config = {
+        'images_bucket': outputs.get(f"bucket:{IMAGES_BUCKET}"),
+        'feedback_bucket': outputs.get(f"bucket:{FEEDBACK_BUCKET}"),
+        'kb_bucket': outputs.get(f"bucket:{KB_BUCKET}"),
+        'knowledge_base_id': outputs.get('knowledge-base'),
+        'agent_id': AGENT_ID,
+        'agent_version': outputs.get('agent-version') or 'DRAFT',
+        'agent_alias_id': outputs.get('agent-alias'),
+        'analysis_queue_url': queue.get('queue_url'),
+        'analysis_queue_arn': queue.get('queue_arn'),
+        'meals_table': outputs.get('meals-table'),
+        'admission_table': outputs.get('admission-table')
     }
 
+    print("\nAWS resources setup complete!" if complete else "\nAWS resources setup incomplete")
+    print(f"Images Bucket: {config['images_bucket']}")
+    print(f"Feedback Bucket: {config['feedback_bucket']}")
+    print(f"Knowledge Base Bucket: {config['kb_bucket']}")
+    print(f"Knowledge Base ID: {config['knowledge_base_id']}")
+    print(f"Agent ID: {config['agent_id']}")
+    print(f"Agent Version: {config['agent_version']}")
+    if config['agent_alias_id']:
+        print(f"Agent Alias ID: {config['agent_alias_id']}")
+    print(f"Analysis Queue URL: {config['analysis_queue_url']}")
+    print(f"Meals Table: {config['meals_table']}")
+    print(f"Admission Table: {config['admission_table']}")
+
+    # Return configuration for other components
+    return config
+
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -0,0 +1,53 @@
+// Downscale a photo in the browser before upload. Phone cameras produce
+// 12 MP images; the analysis only needs ~1568px on the long edge, so this
+// cuts upload size (and API payload) by an order of magnitude.
+export const MAX_EDGE = 1568;
+export const JPEG_QUALITY = 0.85;
+
+const loadImage = (file) =>
+  new Promise((resolve, reject) => {
+    const url = URL.createObjectURL(file);
+    const img = new Image();
+    img.onload = () => {
+      URL.revokeObjectURL(url);
+      resolve(img);
+    };
+    img.onerror = (err) => {
+      URL.revokeObjectURL(url);
+      reject(err);
+    };
+    img.src = url;
+  });
+
+const readAsDataUrl = (blob) =>
+  new Promise((resolve, reject) => {
+    const reader = new FileReader();
+    reader.onload = () => resolve(reader.result);
+    reader.onerror = reject;
+    reader.readAsDataURL(blob);
+  });
+
+// Returns a data URL ready for the /analyze-meal request body. Falls back to
+// the original file if the browser can't decode it (e.g. HEIC outside Safari);
+// the server downscales those instead.
+export const resizeImage = async (file, maxEdge = MAX_EDGE, quality = JPEG_QUALITY) => {
+  let img;
+  try {
+    img = await loadImage(file);
+  } catch (err) {
+    return readAsDataUrl(file);
+  }
+
+  const scale = Math.min(1, maxEdge / Math.max(img.naturalWidth, img.naturalHeight));
+  if (scale === 1 && file.type === 'image/jpeg') {
+    return readAsDataUrl(file);
+  }
+
+  const canvas = document.createElement('canvas');
+  canvas.width = Math.round(img.naturalWidth * scale);
+  canvas.height = Math.round(img.naturalHeight * scale);
+  canvas.getContext('2d').drawImage(img, 0, 0, canvas.width, canvas.height);
+  return canvas.toDataURL('image/jpeg', quality);
+};
+
+export default resizeImage;
@@ -0,0 +1,44 @@
+// Uploads a photo straight to S3 through a presigned POST from
+// /upload-url, so the analysis request only carries the resulting imageKey
+// instead of a base64 data URL (~33% larger than the file itself).
+const API_URL = process.env.REACT_APP_API_URL;
+
+export const uploadImage = async (file, userId) => {
+  const response = await fetch(`${API_URL}/upload-url`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ userId, contentType: file.type || 'image/jpeg' }),
+  });
+  const upload = await response.json();
+  if (!upload.success) {
+    throw new Error(upload.error || 'Could not get an upload URL');
+  }
+
+  const form = new FormData();
+  Object.entries(upload.fields).forEach(([name, value]) => form.append(name, value));
+  // The file must be the last field of the form
+  form.append('file', file);
+
+  const s3Response = await fetch(upload.url, { method: 'POST', body: form });
+  if (!s3Response.ok) {
+    throw new Error(`Upload failed with status ${s3Response.status}`);
+  }
+  return upload;
+};
+
+// Uploads the photo and requests the analysis by imageKey. With automatic
+// analysis enabled the upload itself starts the job, polled by image id.
+export const analyzeUploadedImage = async (file, userId) => {
+  const upload = await uploadImage(file, userId);
+  if (upload.autoAnalyze) {
+    return { success: true, jobId: upload.imageId, imageId: upload.imageId, status: 'queued' };
+  }
+  const response = await fetch(`${API_URL}/analyze-meal`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ userId, imageKey: upload.imageKey }),
+  });
+  return response.json();
+};
+
+export default uploadImage;
@@ -1 +1,318 @@
- 
\ No newline at end of file
+import argparse
+import ast
+import base64
+import hashlib
+import io
+import json
+import os
+import py_compile
+import subprocess
+import sys
+import tempfile
+import zipfile
+
+# Builds one deployment package per Lambda handler in lambda_functions/ and
+# deploys the ones that changed.
+#
+# A package holds the handler and the local modules it imports, found by
+# following import statements (including the ones inside functions), plus
+# the data files those modules read. Third-party imports are reported; the
+# ones the Lambda runtime doesn't provide can be bundled from a pip target
+# directory with --site-packages. No bytecode caches are packed, except the
+# .pyc files --precompile adds on purpose.
+#
+# Packages are reproducible: entries are sorted, with fixed timestamps and
+# permissions, so the same sources give byte-identical zips. That makes the
+# package's SHA-256 (Lambda's CodeSha256) a content hash: --deploy skips
+# functions whose deployed code already has it, and --verify rebuilds
+# everything offline and checks it against dist/manifest.json.
+#
+#   python update_lambda.py                      # build dist/*.zip and the manifest
+#   python update_lambda.py --verify             # rebuild and compare, no AWS calls
+#   python update_lambda.py --deploy process_image
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+LAMBDA_DIR = os.path.join(ROOT, 'lambda_functions')
+OUTPUT_DIR = os.path.join(ROOT, 'dist')
+MANIFEST = 'manifest.json'
+
+# Python version of the functions' runtime; precompiled .pyc files only load
+# on the version that wrote them
+RUNTIME = os.environ.get('LAMBDA_RUNTIME', 'python3.11')
+
+# Files read at run time by the module that ships them
+DATA_FILES = {
+    'guideline_index': ['guideline_index.json']
+}
+
+# Provided by the Lambda Python runtime, never bundled
+RUNTIME_PACKAGES = {'boto3', 'botocore', 's3transfer', 'jmespath', 'dateutil', 'urllib3', 'six',
+                    'snapshot_restore_py'}
+
+# Fixed zip metadata: 1980-01-01 (the earliest zip timestamp), rw-r--r--
+ZIP_DATE = (1980, 1, 1, 0, 0, 0)
+FILE_MODE = 0o644 << 16
+
+# Placeholder for environment variables a module reads with os.environ[...]
+# at import, so the import check can run outside Lambda
+IMPORT_CHECK_VALUE = 'import-check'
+
+
+def handlers():
+    # Modules defining lambda_handler, by module name
+    names = []
+    for filename in sorted(os.listdir(LAMBDA_DIR)):
+        if filename.endswith('.py'):
+            with open(os.path.join(LAMBDA_DIR, filename), encoding='utf-8') as f:
+                if 'def lambda_handler(' in f.read():
+                    names.append(filename[:-3])
+    return names
+
+
+def parse(module):
+    with open(os.path.join(LAMBDA_DIR, f"{module}.py"), encoding='utf-8') as f:
+        return ast.parse(f.read(), filename=f"{module}.py")
+
+
+def imported_names(tree):
+    # Top-level names of every module the code imports
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name.split('.')[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.add(node.module.split('.')[0])
+    return names
+
+
+def required_environment(tree):
+    # Names read as os.environ['NAME'], which fail when unset
+    names = set()
+    for node in ast.walk(tree):
+        if (isinstance(node, ast.Subscript) and isinstance(node.value, ast.Attribute)
+                and node.value.attr == 'environ' and isinstance(node.slice, ast.Constant)):
+            names.add(node.slice.value)
+    return names
+
+
+def dependencies(handler):
+    # (local modules, third-party top-level names, required environment)
+    # for a handler, following local imports transitively
+    local = set(os.path.splitext(f)[0] for f in os.listdir(LAMBDA_DIR) if f.endswith('.py'))
+    modules, external, environment = set(), set(), set()
+    pending = [handler]
+    while pending:
+        module = pending.pop()
+        if module in modules:
+            continue
+        modules.add(module)
+        tree = parse(module)
+        environment |= required_environment(tree)
+        for name in imported_names(tree):
+            if name in local:
+                pending.append(name)
+            elif name not in sys.stdlib_module_names:
+                external.add(name)
+    return sorted(modules), sorted(external), sorted(environment)
+
+
+def vendored_files(site_packages, name):
+    # (archive name, path) for an installed top-level package or module,
+    # without bytecode caches
+    files = []
+    package = os.path.join(site_packages, name)
+    if os.path.isdir(package):
+        for directory, subdirectories, filenames in os.walk(package):
+            subdirectories[:] = [d for d in subdirectories if d != '__pycache__']
+            for filename in filenames:
+                if filename.endswith(('.pyc', '.pyo')):
+                    continue
+                path = os.path.join(directory, filename)
+                files.append((os.path.relpath(path, site_packages).replace(os.sep, '/'), path))
+    else:
+        for filename in os.listdir(site_packages):
+            if filename.split('.')[0] == name and filename.endswith(('.py', '.so', '.pyd')):
+                files.append((filename, os.path.join(site_packages, filename)))
+    return files
+
+
+def compile_module(path, name):
+    # Bytecode that doesn't depend on the source's mtime (an unchecked hash
+    # pyc), so it is reproducible and used without a source check
+    with tempfile.TemporaryDirectory() as directory:
+        target = os.path.join(directory, 'module.pyc')
+        py_compile.compile(path, cfile=target, dfile=name, doraise=True,
+                           invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)
+        with open(target, 'rb') as f:
+            return f.read()
+
+
+def build(handler, precompile=False, site_packages=None):
+    # The package as bytes, and its manifest entry
+    modules, external, environment = dependencies(handler)
+    entries = {}
+    for module in modules:
+        path = os.path.join(LAMBDA_DIR, f"{module}.py")
+        with open(path, 'rb') as f:
+            entries[f"{module}.py"] = f.read()
+        if precompile:
+            tag = sys.implementation.cache_tag
+            entries[f"__pycache__/{module}.{tag}.pyc"] = compile_module(path, f"{module}.py")
+        for filename in DATA_FILES.get(module, []):
+            with open(os.path.join(LAMBDA_DIR, filename), 'rb') as f:
+                entries[filename] = f.read()
+
+    bundled, missing = [], []
+    for name in external:
+        if name in RUNTIME_PACKAGES:
+            continue
+        files = vendored_files(site_packages, name) if site_packages else []
+        if not files:
+            missing.append(name)
+            continue
+        bundled.append(name)
+        for arcname, path in files:
+            with open(path, 'rb') as f:
+                entries[arcname] = f.read()
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED, compresslevel=9) as archive:
+        for arcname in sorted(entries):
+            info = zipfile.ZipInfo(arcname, date_time=ZIP_DATE)
+            info.external_attr = FILE_MODE
+            info.create_system = 3
+            info.compress_type = zipfile.ZIP_DEFLATED
+            archive.writestr(info, entries[arcname], compresslevel=9)
+    content = buffer.getvalue()
+
+    return content, {
+        'file': f"{handler}.zip",
+        'codeSha256': base64.b64encode(hashlib.sha256(content).digest()).decode('ascii'),
+        'bytes': len(content),
+        'unpackedBytes': sum(len(data) for data in entries.values()),
+        'modules': modules,
+        'dataFiles': sorted(f for m in modules for f in DATA_FILES.get(m, [])),
+        'bundled': bundled,
+        # Imported but neither in the runtime nor bundled: only fine for
+        # optional imports (e.g. Pillow, guarded by image_utils)
+        'notBundled': missing,
+        'requiredEnvironment': environment,
+        'precompiled': precompile
+    }
+
+
+def import_time(handler, content, environment):
+    # Imports the handler from the unpacked package in a fresh, isolated
+    # interpreter: fails if the package is missing a module, and measures
+    # the import the way a cold start does (no bytecode written)
+    with tempfile.TemporaryDirectory() as directory:
+        with zipfile.ZipFile(io.BytesIO(content)) as archive:
+            archive.extractall(directory)
+        script = (f"import sys, time\nsys.path.insert(0, {directory!r})\n"
+                  f"start = time.perf_counter()\nimport {handler}\n"
+                  f"print((time.perf_counter() - start) * 1000)\n")
+        env = {'PATH': os.environ.get('PATH', ''), 'AWS_DEFAULT_REGION': 'us-west-2',
+               **{name: IMPORT_CHECK_VALUE for name in environment}}
+        result = subprocess.run([sys.executable, '-I', '-B', '-c', script], cwd=directory, env=env,
+                                capture_output=True, text=True)
+    if result.returncode:
+        raise RuntimeError(f"{handler} does not import from its package:\n{result.stderr.strip()}")
+    return round(float(result.stdout.strip().splitlines()[-1]), 1)
+
+
+def read_manifest(output):
+    try:
+        with open(os.path.join(output, MANIFEST), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def deploy(handler, entry, content, name_format):
+    # Uploads the package unless the function already runs this exact code
+    import boto3
+    lambda_client = boto3.client('lambda')
+    function_name = name_format.format(name=handler)
+    deployed = lambda_client.get_function_configuration(FunctionName=function_name)['CodeSha256']
+    if deployed == entry['codeSha256']:
+        print(f"{function_name}: unchanged ({entry['codeSha256']}), skipped")
+        return False
+    response = lambda_client.update_function_code(FunctionName=function_name, ZipFile=content)
+    if response['CodeSha256'] != entry['codeSha256']:
+        raise RuntimeError(f"{function_name}: Lambda reports {response['CodeSha256']}, built {entry['codeSha256']}")
+    print(f"{function_name}: updated to {entry['codeSha256']}")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build, verify and deploy the Lambda packages')
+    parser.add_argument('functions', nargs='*', help='Handler modules (default: all)')
+    parser.add_argument('--output', default=OUTPUT_DIR)
+    parser.add_argument('--precompile', action='store_true',
+                        help=f"Ship .pyc files; the build must run on the runtime's Python ({RUNTIME})")
+    parser.add_argument('--site-packages', help='pip --target directory to bundle third-party imports from')
+    parser.add_argument('--verify', action='store_true',
+                        help='Rebuild offline and check against the manifest and the built packages')
+    parser.add_argument('--deploy', action='store_true', help='Upload packages whose CodeSha256 changed')
+    parser.add_argument('--name-format', default='{name}', help='Lambda function name for a handler module')
+    parser.add_argument('--skip-import-check', action='store_true')
+    args = parser.parse_args()
+
+    if args.precompile and RUNTIME != f"python{sys.version_info[0]}.{sys.version_info[1]}":
+        raise SystemExit(f"--precompile needs Python {RUNTIME[6:]} (the runtime's), this is {sys.version.split()[0]}")
+
+    available = handlers()
+    unknown = [name for name in args.functions if name not in available]
+    if unknown:
+        raise SystemExit(f"Not handler modules: {', '.join(unknown)} (have {', '.join(available)})")
+    selected = args.functions or available
+
+    manifest = read_manifest(args.output)
+    problems = []
+    os.makedirs(args.output, exist_ok=True)
+    for handler in selected:
+        content, entry = build(handler, args.precompile, args.site_packages)
+        if not args.skip_import_check:
+            try:
+                entry['importMs'] = import_time(handler, content, entry['requiredEnvironment'])
+            except RuntimeError as e:
+                problems.append(str(e))
+        path = os.path.join(args.output, entry['file'])
+
+        if args.verify:
+            recorded = manifest.get(handler, {}).get('codeSha256')
+            on_disk = None
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    on_disk = base64.b64encode(hashlib.sha256(f.read()).digest()).decode('ascii')
+            if not recorded or recorded != entry['codeSha256'] or on_disk != entry['codeSha256']:
+                problems.append(f"{handler}: rebuilt {entry['codeSha256']}, manifest {recorded}, "
+                                f"{entry['file']} {on_disk}")
+        else:
+            with open(path, 'wb') as f:
+                f.write(content)
+            manifest[handler] = entry
+
+        print(f"{handler:<22} {entry['bytes']:>8} B zip  {entry['unpackedBytes']:>8} B unpacked  "
+              f"{len(entry['modules']):>2} modules  import {entry.get('importMs', '-')} ms  "
+              f"{entry['codeSha256']}")
+        if entry['notBundled']:
+            print(f"{'':<22} not bundled: {', '.join(entry['notBundled'])}")
+
+        if args.deploy and not problems:
+            deploy(handler, entry, content, args.name_format)
+
+    if not args.verify:
+        with open(os.path.join(args.output, MANIFEST), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+    if problems:
+        print('\n'.join(problems))
+        raise SystemExit(1)
+    if args.verify:
+        print(f"Verified {len(selected)} packages against {os.path.join(args.output, MANIFEST)}")
+
+
+if __name__ == "__main__":
+    main()